@@ -2,15 +2,445 @@ import os
 import pika
 import json
 import logging
+import time
+import uuid
+import atexit
 import base64
+import threading
+import contextvars
+import collections
+import concurrent.futures
 
 from fizzlibs.ext import qqueue
+from fizzlibs.ext import idempotency
 from fizzlibs.ext.handler import AuthHandler
+from fizzlibs.ext.scheduler import delay_scheduler
+
+
+# Pushed tasks run `inline` in the push request, or are acknowledged
+# first and run by a bounded pool of `thread` or `process` workers
+DEFERRED_EXECUTION = 'inline'
+DEFERRED_WORKERS = 8
+# Seconds given to in-flight tasks at exit
+DEFERRED_DRAIN_TIMEOUT = 30
+
+# Delivery attempt of the task being run
+_delivery_attempt = contextvars.ContextVar('delivery_attempt', default=None)
+# Batch collecting the tasks deferred in the current scope
+_current_batch = contextvars.ContextVar('deferred_batch', default=None)
+
+
+class PermanentTaskFailure(Exception):
+    """Raised by a handler when its task must not be retried"""
+
+
+def delivery_attempt():
+    """
+    Delivery attempt of the running task, starting at 1
+
+    Pub/Sub only counts the deliveries of queues with a dead letter
+    policy (`max_attempts` or `dead_letter_queue` settings), None otherwise
+    """
+    return _delivery_attempt.get()
+
+
+def _log_publish_error(queue_name, task, error):
+    logging.error(f'Unable to publish deferred task {task} to {queue_name}: {error}')
+
+
+# Called with (queue name, task, error) for each task a batch fails to publish
+publish_error_hook = _log_publish_error
+
+
+def set_publish_error_hook(hook):
+    """Replaces the hook called when a batched task is not published,
+    None restores the default hook which logs the error
+    """
+    global publish_error_hook
+
+    publish_error_hook = hook or _log_publish_error
+
+
+class DeferredBatch(object):
+    """
+    Collects the tasks deferred within its scope, and publishes them
+    in one batch per queue when the scope exits, without waiting for
+    their confirmation
+
+    `FlaskApplication` runs every request in a batch when
+    DEFERRED_BATCHING is on. Tasks with a countdown are scheduled
+    right away.
+
+        with deferred.DeferredBatch() as batch:
+            deferred.defer(handler, 1)
+            deferred.defer(handler, 2, _queue='other')
+
+            failures = batch.flush()
+
+    ...
+
+    Attributes
+    ----------
+    on_error : a callable
+        Called with (queue name, task, error) for each task which could
+        not be published, from a publisher thread (default is
+        `publish_error_hook`)
+    """
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+
+        self._lock = threading.Lock()
+        # queue name -> tasks waiting for the end of the scope
+        self._pending = collections.OrderedDict()
+        # (queue name, task, future) awaiting confirmation
+        self._futures = []
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_current_batch.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_batch.reset(self._tokens.pop())
+
+        # Tasks deferred before an error are published, as without batch
+        self.publish()
+
+    def add(self, queue_name, task):
+        with self._lock:
+            self._pending.setdefault(queue_name, []).append(task)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(tasks) for tasks in self._pending.values())
+
+    def __report(self, queue_name, task, error):
+        try:
+            (self.on_error or publish_error_hook)(queue_name, task, error)
+        except Exception as e:
+            logging.error(f'Deferred publish error hook failed: {e}')
+
+    def __on_done(self, queue_name, task, future):
+        error = future.exception()
+
+        if error is not None:
+            self.__report(queue_name, task, error)
+
+    def publish(self):
+        """Publishes the collected tasks, one batch per queue. Returns
+        without waiting for the confirmations of pubsub
+        """
+        with self._lock:
+            pending, self._pending = self._pending, collections.OrderedDict()
+
+        for queue_name, tasks in pending.items():
+            for start in range(0, len(tasks), qqueue.QQUEUE_MAX_TASKS_LIMIT):
+                chunk = tasks[start:start + qqueue.QQUEUE_MAX_TASKS_LIMIT]
+
+                try:
+                    futures = qqueue.QQueue(name=queue_name).add_async(chunk)
+                except Exception as e:
+                    for task in chunk:
+                        self.__report(queue_name, task, e)
+
+                    continue
+
+                with self._lock:
+                    self._futures.extend(
+                        (queue_name, task, future) for task, future in zip(chunk, futures))
+
+                for task, future in zip(chunk, futures):
+                    future.add_done_callback(
+                        lambda future, queue_name=queue_name, task=task:
+                            self.__on_done(queue_name, task, future))
+
+    def flush(self, timeout=None):
+        """Publishes the collected tasks and waits for pubsub to confirm
+        them, and the tasks published earlier by the batch
+
+        Returns
+        -------
+        List of (queue name, task, error) of the tasks not published
+        """
+        self.publish()
+
+        with self._lock:
+            futures, self._futures = self._futures, []
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        failures = []
+
+        for queue_name, task, future in futures:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+
+            try:
+                future.result(timeout=remaining)
+            except Exception as e:
+                failures.append((queue_name, task, e))
+
+        return failures
+
+
+def current_batch():
+    """The `DeferredBatch` of the current scope, None outside of batches"""
+    return _current_batch.get()
+
+
+def flush(timeout=None):
+    """Flushes the batch of the current scope, see `DeferredBatch.flush`"""
+    batch = _current_batch.get()
+
+    return batch.flush(timeout=timeout) if batch is not None else []
+
+
+def _execute(task, attempt):
+    """Runs a deferred task, returns the response of its push request.
+    Its idempotency key, claimed by the push request, is completed
+    unless the task must run again
+    """
+    task.delivery_attempt = attempt
+    token = _delivery_attempt.set(attempt)
+    key = getattr(task, 'idempotency_key', None)
+
+    try:
+        task.handler(*task.args, **task.kwargs)
+    except PermanentTaskFailure as e:
+        logging.exception(f'Permanent failure of {task.handler}: {e}')
+        task.discard_claim()
+
+        if key:
+            idempotency.idempotency_store.complete(key)
+
+        return {'message': 'dropped'}, 200
+    except Exception as e:
+        logging.exception(f'Failure of {task.handler}, delivery attempt {attempt}: {e}')
+        logging.error(task.args)
+        logging.error(task.kwargs)
+
+        if key:
+            idempotency.idempotency_store.release(key)
+
+        return {'message': 'failed', 'error': str(e)}, 500
+    finally:
+        _delivery_attempt.reset(token)
+
+    if key:
+        idempotency.idempotency_store.complete(key)
+
+    task.discard_claim()
+
+    return {'message': 'success'}, 200
+
+
+def _execute_data(payload, attributes, attempt):
+    """Runs a deferred task in a process worker, returns its status"""
+    return _execute(qqueue.Task.from_data(payload, attributes), attempt)[1]
+
+
+class DeferredExecutor(object):
+    """
+    Runs pushed tasks after their push request is acknowledged
+
+    Long handlers no longer hold push requests open, and concurrency is
+    not bound to the WSGI threads. Tasks are accepted while fewer than
+    `max_pending` are queued or running, the push request answers 429
+    otherwise, and 503 once the executor drains, so that Pub/Sub slows
+    the delivery down.
+
+    Note: Execution is at most once, a task failing or lost with its
+    process is not delivered again
+
+    ...
+
+    Attributes
+    ----------
+    max_workers : int
+        Number of worker threads or processes
+    max_pending : int
+        Number of tasks queued or running at once (default is twice
+        `max_workers`)
+    processes : bool
+        Run tasks in worker processes, handlers must be importable
+    stats : dict
+        Number of tasks accepted, rejected, succeeded and failed
+    """
+    def __init__(self, max_workers=DEFERRED_WORKERS, max_pending=None, processes=False):
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 2 * max_workers
+        self.processes = processes
+        self.stats = {'accepted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0}
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._executor = None
+        self._pid = None
+        self._in_flight = 0
+        self._draining = False
+
+    def __get_executor(self):
+        """Pool of this process, the lock must be held"""
+        if self._executor is None or self._pid != os.getpid():
+            # Pools are not inherited by forked children
+            self._pid = os.getpid()
+            self._in_flight = 0
+
+            if self.processes:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='deferred')
+
+        return self._executor
+
+    @property
+    def in_flight(self):
+        """Number of tasks queued or running"""
+        return self._in_flight
+
+    def submit(self, task, payload, attributes, attempt=None):
+        """Hands a decoded task over to the pool
+
+        Returns
+        -------
+        HTTP status of the push request: 200 when accepted, 429 when
+        the pool is saturated and 503 when it is draining
+        """
+        with self._lock:
+            if self._draining:
+                self.stats['rejected'] += 1
+                return 503
+
+            executor = self.__get_executor()
+
+            if self._in_flight >= self.max_pending:
+                self.stats['rejected'] += 1
+                return 429
+
+            self._in_flight += 1
+            self.stats['accepted'] += 1
+
+        try:
+            if self.processes:
+                future = executor.submit(_execute_data, payload, attributes, attempt)
+            else:
+                future = executor.submit(lambda: _execute(task, attempt)[1])
+        except Exception as e:
+            # Broken or shut down pool
+            logging.error(f'Unable to run deferred task: {e}')
+            self.__done(None)
+            return 503
+
+        future.add_done_callback(self.__done)
+
+        return 200
+
+    def __done(self, future):
+        try:
+            succeeded = future is not None and future.result() == 200
+        except Exception as e:
+            logging.error(f'Deferred worker failed: {e}')
+            succeeded = False
+
+        with self._lock:
+            self.stats['succeeded' if succeeded else 'failed'] += 1
+            self._in_flight -= 1
+            self._idle.notify_all()
+
+    def shutdown(self, timeout=None):
+        """Rejects new tasks and waits for the in-flight ones
+
+        Returns
+        -------
+        True once every in-flight task is done, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            self._draining = True
+
+            while self._in_flight and self._pid == os.getpid():
+                remaining = None if deadline is None else deadline - time.monotonic()
+
+                if remaining is not None and remaining <= 0:
+                    break
+
+                self._idle.wait(remaining)
+
+            drained = not self._in_flight or self._pid != os.getpid()
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=drained)
+
+        return drained
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The process-wide `DeferredExecutor`, None when pushed tasks run
+    inline. Configured by DEFERRED_EXECUTION (`inline`, `thread` or
+    `process`), DEFERRED_WORKERS and DEFERRED_MAX_PENDING
+    """
+    global _executor
+
+    mode = os.environ.get('DEFERRED_EXECUTION', DEFERRED_EXECUTION)
+
+    if mode == 'inline':
+        return None
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = DeferredExecutor(
+                max_workers=int(os.environ.get('DEFERRED_WORKERS', DEFERRED_WORKERS)),
+                max_pending=int(os.environ.get('DEFERRED_MAX_PENDING', 0)) or None,
+                processes=mode == 'process'
+            )
+
+        return _executor
+
+
+def shutdown(timeout=DEFERRED_DRAIN_TIMEOUT):
+    """Drains the process-wide executor, see `DeferredExecutor.shutdown`"""
+    global _executor
+
+    with _executor_lock:
+        executor = _executor
+
+    if executor is None:
+        return True
+
+    # Kept in place while draining, so that pushes are answered 503
+    drained = executor.shutdown(timeout=timeout)
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+    return drained
+
+
+atexit.register(shutdown)
 
 
 class Deferred_Task_API(AuthHandler):
     """
     A class to handle default push route
+
+    Failed tasks answer 500, Pub/Sub delivers them again after the
+    backoff of the queue, and dead-letters them after `max_attempts`.
+    Tasks which can not be decoded, or raise `PermanentTaskFailure`,
+    are acknowledged and dropped.
+
+    With DEFERRED_EXECUTION set to `thread` or `process`, decoded tasks
+    are acknowledged at once and run by the `DeferredExecutor`.
+
+    Deliveries of an idempotency key already run are acknowledged
+    without running, those of a running key are answered 409 and
+    delivered again later
     ...
     Parameters
     ----------
@@ -18,19 +448,45 @@ class Deferred_Task_API(AuthHandler):
     """
     def post(self):
         data = self.request.json
-        payload = base64.b64decode(data['message']['data'].encode('utf-8'))
+        message = data['message']
+        attempt = data.get('deliveryAttempt') or None
 
         try:
-            task = qqueue.Task.from_pickle(payload)
-            task.handler(*task.args, **task.kwargs)
+            payload = base64.b64decode(message['data'].encode('utf-8'))
+            attributes = message.get('attributes')
+            task = qqueue.Task.from_data(payload, attributes)
         except Exception as e:
-            logging.error(task.handler)
-            logging.error(task.args)
-            logging.error(task.kwargs)
+            # Would fail the same way on every delivery
+            logging.exception(f'Unable to decode task {message.get("messageId")}: {e}')
+
+            return {'message': 'dropped'}
+
+        key = (attributes or {}).get(qqueue.QQUEUE_IDEMPOTENCY_ATTRIBUTE)
+
+        if key:
+            state = idempotency.idempotency_store.claim(key)
+
+            if state == idempotency.DONE:
+                logging.info(f'Duplicate of task {key} suppressed')
+                return {'message': 'duplicate'}
 
-            raise Exception(e)
+            if state == idempotency.RUNNING:
+                return {'message': 'running'}, 409
 
-        return {'message': 'success'}
+        executor = get_executor()
+
+        if executor is None:
+            return _execute(task, attempt)
+
+        status = executor.submit(task, payload, attributes, attempt)
+
+        if status == 200:
+            return {'message': 'accepted'}
+
+        if key:
+            idempotency.idempotency_store.release(key)
+
+        return {'message': 'busy' if status == 429 else 'unavailable'}, status
 
 
 def defer(func_handler,
@@ -38,6 +494,7 @@ def defer(func_handler,
           _queue='default',
           _countdown=0,
           _target=None,
+          _idempotency_key=None,
           **kwargs):
     """
     Handles push queue
@@ -52,20 +509,39 @@ def defer(func_handler,
     _queue : str
         Name of push queue
     _countdown : int
-        Wait before pushing to subscriber
-
-        NOTE: Not implemented
+        Wait before pushing to subscriber, delayed tasks are kept
+        in Redis until `delay_scheduler` publishes them. The scheduler
+        runs in the processes booted with QQUEUE_DELAY_SCHEDULER=on, or
+        in a dedicated `python -m fizzlibs.ext.scheduler` worker
     _target : str
         Specify a different target to push messages
 
         NOTE: Not implementd
+    _idempotency_key : str
+        Deliveries of the key are run once within the idempotency TTL,
+        when Redis is configured (default is a key per call)
     kwargs : arguments
         Dict arguments for callable
+
+    Within a `DeferredBatch`, the task is published when the batch
+    scope exits
     """
 
-    task = qqueue.Task(handler=func_handler, *args, **kwargs)
-    queue = qqueue.QQueue(name=(_queue or 'default'))
-    queue.add(task)
+    task = qqueue.Task(
+        handler=func_handler,
+        idempotency_key=_idempotency_key or uuid.uuid4().hex,
+        *args,
+        **kwargs
+    )
+    batch = _current_batch.get()
+
+    if _countdown and _countdown > 0:
+        delay_scheduler.schedule(_queue or 'default', task, _countdown)
+    elif batch is not None:
+        batch.add(_queue or 'default', task)
+    else:
+        queue = qqueue.QQueue(name=(_queue or 'default'))
+        queue.add(task)
 
     if os.environ.get('FLASK_APP') == 'tests/app:create_app':
         # Required for test automation
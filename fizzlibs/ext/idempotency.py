@@ -0,0 +1,129 @@
+import os
+import logging
+import threading
+
+from fizzlibs.ext import rediscache
+
+
+# Seconds a completed key suppresses its duplicates
+IDEMPOTENCY_TTL = int(os.environ.get('DEFERRED_IDEMPOTENCY_TTL', 24 * 60 * 60))
+# Seconds a key is held by a running task, the longest push ack deadline
+IDEMPOTENCY_LEASE = int(os.environ.get('DEFERRED_IDEMPOTENCY_LEASE', 600))
+
+# States of a claimed key
+CLAIMED = 'claimed'
+RUNNING = 'running'
+DONE = 'done'
+
+_RUNNING = b'running'
+_DONE = b'done'
+
+
+class IdempotencyStore(object):
+    """
+    Runs the deliveries of an idempotency key once
+
+    A key is claimed with a single SET NX, held while its task runs and
+    expires after `lease` seconds if the process dies. Completed keys
+    are kept for `ttl` seconds, duplicates delivered within this window
+    are suppressed.
+
+    Without Redis, or when it fails, every delivery is run.
+
+    ...
+
+    Attributes
+    ----------
+    prefix : str
+        Prefix of the Redis keys
+    stats : dict
+        Number of keys claimed, and of duplicates suppressed or
+        delivered while running, by this process
+    """
+    def __init__(self, prefix=None, ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE):
+        if prefix is None:
+            suffix = os.environ.get('GKE_SOFTWARE_ID')
+            prefix = f'{suffix}-fizzlibs:idempotency' if suffix else 'fizzlibs:idempotency'
+
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lease = lease
+        self.stats = {'claimed': 0, 'suppressed': 0, 'running': 0, 'unavailable': 0}
+
+        self.suppressed_key = f'{prefix}:suppressed'
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return all([os.environ.get('REDIS_SERVICE_HOST'), os.environ.get('REDIS_SERVICE_PORT')])
+
+    def __key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def __count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def claim(self, key):
+        """Claims `key` for the delivery being handled
+
+        Returns
+        -------
+        `CLAIMED` when the task must run, `DONE` for a duplicate of a
+        completed task, and `RUNNING` for a duplicate of a running one
+        """
+        if not self.available():
+            return CLAIMED
+
+        try:
+            r = rediscache.__get_radis__()
+
+            if r.set(self.__key(key), _RUNNING, nx=True, ex=self.lease):
+                self.__count('claimed')
+                return CLAIMED
+
+            state = r.get(self.__key(key))
+
+            if state == _DONE:
+                r.incr(self.suppressed_key)
+                self.__count('suppressed')
+                return DONE
+
+            if state == _RUNNING:
+                self.__count('running')
+                return RUNNING
+        except Exception as e:
+            logging.warning(f'Idempotency key {key} not checked: {e}')
+            self.__count('unavailable')
+            return CLAIMED
+
+        # Released in between, claim it again
+        return self.claim(key)
+
+    def complete(self, key):
+        """Suppresses the deliveries of `key` for `ttl` seconds"""
+        if not self.available():
+            return
+
+        try:
+            rediscache.__get_radis__().set(self.__key(key), _DONE, ex=self.ttl)
+        except Exception as e:
+            logging.warning(f'Idempotency key {key} not completed: {e}')
+
+    def release(self, key):
+        """Lets a failed task run again on its next delivery"""
+        if not self.available():
+            return
+
+        try:
+            rediscache.__get_radis__().delete(self.__key(key))
+        except Exception as e:
+            logging.warning(f'Idempotency key {key} not released: {e}')
+
+    def suppressed(self):
+        """Number of duplicates suppressed by every process"""
+        return int(rediscache.__get_radis__().get(self.suppressed_key) or 0)
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,940 @@
+"""
+In-process backend of `QQueue`
+
+Clients with the surface of the pubsub_v1 publisher and subscriber
+clients used by `QQueue`, over a thread-safe broker living in the
+current process. Topics, subscriptions, tag filters, lease deadlines,
+redelivery, ordering keys and push subscriptions behave as on Pub/Sub.
+
+Select it with QQUEUE_BACKEND=memory, or `backend: memory` in queue.yaml
+"""
+import re
+import time
+import heapq
+import base64
+import asyncio
+import logging
+import datetime
+import functools
+import itertools
+import threading
+import collections
+import urllib.parse
+import concurrent.futures
+import google.api_core.exceptions
+from google.cloud.pubsub import types
+
+
+MEMQUEUE_DEFAULT_ACK_DEADLINE = 10
+# Streaming pull holds messages until they are acked or nacked
+MEMQUEUE_STREAM_LEASE = 60 * 60
+MEMQUEUE_STREAM_WORKERS = 10
+MEMQUEUE_STREAM_MAX_MESSAGES = 1000
+# Longest wait of a pull which does not return immediately
+MEMQUEUE_PULL_TIMEOUT = 10
+MEMQUEUE_PUSH_BATCH = 100
+MEMQUEUE_PUSH_INTERVAL = 1
+# Pub/Sub defaults of a retry policy without backoff bounds
+MEMQUEUE_MIN_BACKOFF = 10
+MEMQUEUE_MAX_BACKOFF = 600
+# Pub/Sub default of a dead letter policy without max delivery attempts
+MEMQUEUE_MAX_DELIVERY_ATTEMPTS = 5
+
+# Filters as written by `QQueue`: [NOT ]attributes.key = "value" [AND ...]
+_FILTER_TERM = re.compile(r'^(NOT )?attributes\.([\w.-]+) = "(.*)"$')
+_ACK_STATUS = (102, 200, 201, 202, 204)
+
+
+def _parse_filter(expression):
+    if not expression:
+        return ()
+
+    terms = []
+
+    for term in expression.split(' AND '):
+        match = _FILTER_TERM.match(term.strip())
+
+        if not match:
+            raise google.api_core.exceptions.InvalidArgument(
+                f'Unsupported subscription filter: {expression}')
+
+        terms.append((bool(match.group(1)), match.group(2), match.group(3)))
+
+    return tuple(terms)
+
+
+def _seconds(duration, default):
+    """Seconds of a protobuf duration, `default` when unset"""
+    seconds = duration.total_seconds() if duration else 0
+
+    return seconds or default
+
+
+def _timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+
+    if hasattr(value, 'seconds'):
+        return value.seconds + value.nanos / 1e9
+
+    return float(value)
+
+
+class MemoryFuture(object):
+    """Resolved future of a publish, memory publishes are synchronous"""
+    __slots__ = ('_result', '_exception')
+
+    def __init__(self, result=None, exception=None):
+        self._result = result
+        self._exception = exception
+
+    def done(self):
+        return True
+
+    def running(self):
+        return False
+
+    def cancelled(self):
+        return False
+
+    def cancel(self):
+        return False
+
+    def result(self, timeout=None):
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+    def exception(self, timeout=None):
+        return self._exception
+
+    def add_done_callback(self, callback):
+        callback(self)
+
+
+class _Message(object):
+    __slots__ = ('message_id', 'data', 'attributes', 'ordering_key', 'publish_time')
+
+    def __init__(self, message_id, data, attributes, ordering_key, publish_time):
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.ordering_key = ordering_key
+        self.publish_time = publish_time
+
+
+class _ReceivedMessage(object):
+    __slots__ = ('ack_id', 'message', 'delivery_attempt')
+
+    def __init__(self, ack_id, message, delivery_attempt):
+        self.ack_id = ack_id
+        self.message = message
+        self.delivery_attempt = delivery_attempt
+
+
+class _PullResponse(object):
+    __slots__ = ('received_messages',)
+
+    def __init__(self, received_messages):
+        self.received_messages = received_messages
+
+
+class _Subscription(object):
+    """
+    Messages of a subscription
+
+    Ready messages wait in a deque, leased ones are indexed by ack id
+    with their deadline. Expired leases are found through a heap of
+    deadlines, and delivered again before any other message.
+
+    With a retry policy, nacked and expired messages wait in a heap for
+    their backoff instead. With a dead letter policy, messages delivered
+    `max_attempts` times are published to the dead letter topic.
+    """
+    def __init__(self, request, publish=None):
+        self.name = request.name
+        self.topic = request.topic
+        self.terms = _parse_filter(request.filter)
+        self.ordering = request.enable_message_ordering
+        # Publishes dead letters, as `MemoryBroker.publish`
+        self._publish = publish
+
+        self.configure(request)
+
+        self.condition = threading.Condition(threading.Lock())
+        # Threads waiting on the condition, spares notifying nobody
+        self._waiters = 0
+
+        # [message, delivery attempts]
+        self._ready = collections.deque()
+        # ack id -> ([message, delivery attempts], deadline)
+        self._leased = {}
+        self._deadlines = []
+        # (available at, sequence, [message, delivery attempts])
+        self._delayed = []
+        self._sequence = itertools.count()
+        # Ordering keys with a message leased or waiting for its backoff
+        self._blocked = set()
+        self._ack_ids = itertools.count(1)
+
+    def configure(self, request):
+        """Applies the mutable settings of a subscription request"""
+        self.request = request
+        self.push_endpoint = request.push_config.push_endpoint or None
+        self.ack_deadline = request.ack_deadline_seconds or MEMQUEUE_DEFAULT_ACK_DEADLINE
+
+        if 'retry_policy' in request:
+            self.backoff = (
+                _seconds(request.retry_policy.minimum_backoff, MEMQUEUE_MIN_BACKOFF),
+                _seconds(request.retry_policy.maximum_backoff, MEMQUEUE_MAX_BACKOFF)
+            )
+        else:
+            self.backoff = None
+
+        if request.dead_letter_policy.dead_letter_topic:
+            self.dead_letter_topic = request.dead_letter_policy.dead_letter_topic
+            self.max_attempts = (request.dead_letter_policy.max_delivery_attempts
+                                 or MEMQUEUE_MAX_DELIVERY_ATTEMPTS)
+        else:
+            self.dead_letter_topic = None
+            self.max_attempts = None
+
+    def matches(self, attributes):
+        for negate, key, value in self.terms:
+            if (attributes.get(key) == value) == negate:
+                return False
+
+        return True
+
+    def _wait(self, timeout):
+        """Waits for the subscription to change, the condition must be held"""
+        self._waiters += 1
+
+        try:
+            self.condition.wait(timeout)
+        finally:
+            self._waiters -= 1
+
+    def _notify(self):
+        if self._waiters:
+            self.condition.notify_all()
+
+    def put(self, message):
+        with self.condition:
+            self._ready.append([message, 0])
+
+            if self._waiters:
+                self.condition.notify_all()
+
+    def _expire(self, now):
+        deadlines = self._deadlines
+        expired = []
+
+        while deadlines and deadlines[0][0] <= now:
+            deadline, ack_id = heapq.heappop(deadlines)
+            lease = self._leased.get(ack_id)
+
+            if lease is not None and lease[1] == deadline:
+                del self._leased[ack_id]
+                expired.append(lease[0])
+
+        if expired:
+            self.__return(expired, now)
+
+        delayed = self._delayed
+
+        if delayed and delayed[0][0] <= now:
+            available = []
+
+            while delayed and delayed[0][0] <= now:
+                available.append(heapq.heappop(delayed)[2])
+
+            self.__unblock(available)
+            self._ready.extendleft(reversed(available))
+
+    def __return(self, entries, now):
+        """Puts nacked or expired messages back for delivery, after
+        their backoff, or forwards them to the dead letter topic
+        """
+        redelivered = []
+
+        for entry in entries:
+            attempts = entry[1]
+
+            if self.max_attempts and attempts >= self.max_attempts and self.__dead_letter(entry):
+                self.__unblock([entry])
+            elif self.backoff:
+                # Ordering keys stay blocked during the backoff
+                minimum, maximum = self.backoff
+                delay = min(minimum * 2 ** min(attempts - 1, 32), maximum)
+                heapq.heappush(self._delayed, (now + delay, next(self._sequence), entry))
+            else:
+                redelivered.append(entry)
+
+        if redelivered:
+            self.__unblock(redelivered)
+            self._ready.extendleft(reversed(redelivered))
+
+    def __dead_letter(self, entry):
+        message, attempts = entry
+        attributes = dict(message.attributes)
+        _, project, _, subscription = self.name.split('/', 3)
+
+        attributes.update({
+            'CloudPubSubDeadLetterSourceSubscription': subscription,
+            'CloudPubSubDeadLetterSourceSubscriptionProject': project,
+            'CloudPubSubDeadLetterSourceDeliveryCount': str(attempts)
+        })
+
+        try:
+            self._publish(self.dead_letter_topic, message.data, attributes, message.ordering_key)
+        except google.api_core.exceptions.NotFound:
+            logging.error(f'Dead letter topic {self.dead_letter_topic} of {self.name} not found')
+            return False
+
+        return True
+
+    def _next_expiry(self, now):
+        """Seconds until the next lease expires or backoff ends,
+        None if nothing is leased or delayed
+        """
+        due = [heap[0][0] for heap in (self._deadlines, self._delayed) if heap]
+
+        if not due:
+            return None
+
+        return max(min(due) - now, 0)
+
+    def _lease(self, max_messages, seconds, now):
+        """Leases ready messages, the condition must be held"""
+        self._expire(now)
+
+        ready = self._ready
+
+        if not ready:
+            return []
+
+        received = []
+        skipped = []
+        deadline = now + seconds
+
+        while ready and len(received) < max_messages:
+            entry = ready.popleft()
+            message = entry[0]
+
+            if self.ordering and message.ordering_key:
+                if message.ordering_key in self._blocked:
+                    # Delivered once the previous message of its key is acked
+                    skipped.append(entry)
+                    continue
+
+                self._blocked.add(message.ordering_key)
+
+            entry[1] += 1
+            ack_id = str(next(self._ack_ids))
+
+            self._leased[ack_id] = (entry, deadline)
+            heapq.heappush(self._deadlines, (deadline, ack_id))
+
+            received.append(_ReceivedMessage(ack_id, message, entry[1]))
+
+        if skipped:
+            ready.extendleft(reversed(skipped))
+
+        if len(self._deadlines) > 2 * len(self._leased) + 1024:
+            # Drop the deadlines of acked messages
+            self._deadlines = [(lease[1], ack_id) for ack_id, lease in self._leased.items()]
+            heapq.heapify(self._deadlines)
+
+        return received
+
+    def lease(self, max_messages, seconds, wait=None):
+        with self.condition:
+            received = self._lease(max_messages, seconds, time.time())
+
+            if received or not wait:
+                return received
+
+            timeout = time.monotonic() + wait
+
+            while not received:
+                remaining = timeout - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                expiry = self._next_expiry(time.time())
+                self._wait(remaining if expiry is None else min(remaining, expiry))
+                received = self._lease(max_messages, seconds, time.time())
+
+            return received
+
+    def __unblock(self, entries):
+        if self.ordering:
+            for entry in entries:
+                self._blocked.discard(entry[0].ordering_key)
+
+    def acknowledge(self, ack_ids):
+        with self.condition:
+            acked = [self._leased.pop(ack_id)[0] for ack_id in ack_ids if ack_id in self._leased]
+
+            self.__unblock(acked)
+            self._notify()
+
+        return len(acked)
+
+    def modify(self, ack_ids, seconds):
+        now = time.time()
+
+        with self.condition:
+            returned = []
+
+            for ack_id in ack_ids:
+                lease = self._leased.get(ack_id)
+
+                if lease is None:
+                    # Expired or acked, as on Pub/Sub the call is a no-op
+                    continue
+
+                if seconds == 0:
+                    del self._leased[ack_id]
+                    returned.append(lease[0])
+                else:
+                    self._leased[ack_id] = (lease[0], now + seconds)
+                    heapq.heappush(self._deadlines, (now + seconds, ack_id))
+
+            if returned:
+                self.__return(returned, now)
+                self._notify()
+
+    def seek(self, before):
+        """Acknowledges every message published before `before`"""
+        with self.condition:
+            self._ready = collections.deque(
+                entry for entry in self._ready if entry[0].publish_time >= before)
+
+            for ack_id, lease in list(self._leased.items()):
+                if lease[0][0].publish_time < before:
+                    del self._leased[ack_id]
+                    self.__unblock([lease[0]])
+
+            for item in self._delayed:
+                if item[2][0].publish_time < before:
+                    self.__unblock([item[2]])
+
+            self._delayed = [item for item in self._delayed if item[2][0].publish_time >= before]
+            heapq.heapify(self._delayed)
+
+            self._notify()
+
+    def backlog(self):
+        """Number of unacknowledged messages and time of the oldest one"""
+        with self.condition:
+            self._expire(time.time())
+
+            times = [entry[0].publish_time for entry, _ in self._leased.values()]
+            times.extend(item[2][0].publish_time for item in self._delayed)
+
+            if self._ready:
+                # Redelivered messages are put back first
+                times.append(self._ready[0][0].publish_time)
+
+            count = len(self._ready) + len(self._leased) + len(self._delayed)
+
+            return count, min(times) if times else None
+
+
+class MemoryBroker(object):
+    """
+    Topics and subscriptions of the in-process backend
+
+    Use the process-wide `broker`. Push subscriptions deliver to the
+    application given to `attach_app`, through its test client.
+
+    ...
+
+    Attributes
+    ----------
+    topics : dict
+        Topic path -> list of subscriptions
+    subscriptions : dict
+        Subscription path -> subscription
+    """
+    def __init__(self):
+        self.topics = {}
+        self.subscriptions = {}
+
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+        self._push_client = None
+        self._push_thread = None
+        self._push_wakeup = threading.Event()
+        self._push_stopping = threading.Event()
+
+    def create_topic(self, name):
+        with self._lock:
+            if name in self.topics:
+                raise google.api_core.exceptions.AlreadyExists(name)
+
+            self.topics[name] = []
+
+        return types.Topic(name=name)
+
+    def get_topic(self, name):
+        if name not in self.topics:
+            raise google.api_core.exceptions.NotFound(name)
+
+        return types.Topic(name=name)
+
+    def publish(self, topic, data, attributes, ordering_key=''):
+        subscriptions = self.topics.get(topic)
+
+        if subscriptions is None:
+            raise google.api_core.exceptions.NotFound(topic)
+
+        message_id = str(next(self._message_ids))
+        message = _Message(message_id, data, attributes, ordering_key, time.time())
+        push = False
+
+        for subscription in subscriptions:
+            if subscription.terms and not subscription.matches(attributes):
+                continue
+
+            subscription.put(message)
+            push = push or subscription.push_endpoint is not None
+
+        if push:
+            self._push_wakeup.set()
+
+        return message_id
+
+    def create_subscription(self, request):
+        request = types.Subscription(**request) if isinstance(request, dict) else request
+
+        with self._lock:
+            if request.name in self.subscriptions:
+                raise google.api_core.exceptions.AlreadyExists(request.name)
+
+            if request.topic not in self.topics:
+                raise google.api_core.exceptions.NotFound(request.topic)
+
+            subscription = _Subscription(request, self.publish)
+
+            self.subscriptions[request.name] = subscription
+            # Replaced rather than appended, publishers iterate it unlocked
+            self.topics[request.topic] = self.topics[request.topic] + [subscription]
+
+        if subscription.push_endpoint:
+            self.__ensure_push_thread()
+
+        return request
+
+    def update_subscription(self, request):
+        """Updates the fields of a subscription named by the update mask"""
+        request = types.UpdateSubscriptionRequest(request)
+        changes = request.subscription
+        subscription = self.subscription(changes.name)
+
+        with subscription.condition:
+            updated = types.Subscription(subscription.request)
+
+            for path in request.update_mask.paths:
+                if path in changes:
+                    setattr(updated, path, getattr(changes, path))
+                else:
+                    delattr(updated, path)
+
+            subscription.configure(updated)
+            subscription._notify()
+
+        if subscription.push_endpoint:
+            self.__ensure_push_thread()
+
+        return updated
+
+    def subscription(self, name):
+        try:
+            return self.subscriptions[name]
+        except KeyError:
+            raise google.api_core.exceptions.NotFound(name)
+
+    def backlog(self, names):
+        """Backlog and age of the oldest message of subscriptions,
+        as `QQueue.fetch_statistics` expects them
+        """
+        total = 0
+        oldest = None
+
+        for name in names:
+            if name not in self.subscriptions:
+                continue
+
+            count, published = self.subscriptions[name].backlog()
+            total += count
+
+            if published is not None:
+                oldest = published if oldest is None else min(oldest, published)
+
+        return {
+            'backlog': total,
+            'oldest_task_age': time.time() - oldest if oldest is not None else 0
+        }
+
+    def reset(self):
+        """Deletes every topic and subscription"""
+        with self._lock:
+            self.topics = {}
+            self.subscriptions = {}
+
+    def attach_app(self, app, background=True):
+        """Delivers push subscriptions to `app`, a Flask application
+
+        Parameters
+        ----------
+        app : Flask
+            Receives the Pub/Sub push requests through its test client
+        background : bool
+            Push from a background thread, else only on `deliver_push`
+        """
+        self._push_client = app.test_client()
+
+        if background:
+            self._push_stopping.clear()
+            self.__ensure_push_thread()
+        else:
+            self.stop_push()
+
+    def deliver_push(self, max_messages=MEMQUEUE_PUSH_BATCH):
+        """Pushes messages of push subscriptions, from the calling thread.
+        A message which is not acknowledged by a 2xx status is delivered
+        again once its ack deadline expires, or after its backoff when
+        the subscription has a retry policy
+
+        Returns
+        -------
+        Number of messages acknowledged by the application
+        """
+        client = self._push_client
+
+        if client is None:
+            return 0
+
+        delivered = 0
+
+        for subscription in list(self.subscriptions.values()):
+            if not subscription.push_endpoint:
+                continue
+
+            for received in subscription.lease(max_messages, subscription.ack_deadline):
+                if self.__push(client, subscription, received):
+                    subscription.acknowledge([received.ack_id])
+                    delivered += 1
+                elif subscription.backoff:
+                    subscription.modify([received.ack_id], 0)
+
+        return delivered
+
+    def __push(self, client, subscription, received):
+        endpoint = urllib.parse.urlsplit(subscription.push_endpoint)
+        path = f'{endpoint.path}?{endpoint.query}' if endpoint.query else endpoint.path
+        message = received.message
+        publish_time = datetime.datetime.fromtimestamp(
+            message.publish_time, tz=datetime.timezone.utc).isoformat()
+
+        envelope = {
+            'message': {
+                'data': base64.b64encode(message.data).decode('utf-8'),
+                'attributes': message.attributes,
+                'messageId': message.message_id,
+                'message_id': message.message_id,
+                'publishTime': publish_time,
+                'publish_time': publish_time
+            },
+            'subscription': subscription.name,
+            'deliveryAttempt': received.delivery_attempt
+        }
+
+        try:
+            response = client.post(path or '/', json=envelope)
+        except Exception as e:
+            logging.error(f'Push of {message.message_id} to {subscription.push_endpoint} failed: {e}')
+            return False
+
+        return response.status_code in _ACK_STATUS
+
+    def __ensure_push_thread(self):
+        with self._lock:
+            if self._push_client is None or self._push_stopping.is_set():
+                return
+
+            if self._push_thread and self._push_thread.is_alive():
+                return
+
+            if not any(subscription.push_endpoint for subscription in self.subscriptions.values()):
+                return
+
+            self._push_thread = threading.Thread(
+                target=self.__run_push, name='memqueue-push', daemon=True)
+            self._push_thread.start()
+
+    def __run_push(self):
+        while not self._push_stopping.is_set():
+            self._push_wakeup.clear()
+
+            try:
+                if self.deliver_push():
+                    continue
+            except Exception as e:
+                logging.error(f'Push delivery error: {e}')
+
+            # Woken up by publishes, expired leases are retried periodically
+            self._push_wakeup.wait(MEMQUEUE_PUSH_INTERVAL)
+
+    def stop_push(self):
+        """Stops the background push delivery"""
+        self._push_stopping.set()
+        self._push_wakeup.set()
+
+        thread = self._push_thread
+
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+        self._push_thread = None
+
+
+broker = MemoryBroker()
+
+
+class MemoryPublisherClient(object):
+    """Publisher client of the in-process backend"""
+    def __init__(self, batch_settings=None, publisher_options=None, memory_broker=None, **kwargs):
+        self.batch_settings = batch_settings
+        self.publisher_options = publisher_options
+        self.broker = memory_broker or broker
+
+    @staticmethod
+    def topic_path(project, topic):
+        return f'projects/{project}/topics/{topic}'
+
+    def get_topic(self, topic=None, request=None):
+        return self.broker.get_topic(topic or request['topic'])
+
+    def create_topic(self, request=None, name=None):
+        return self.broker.create_topic(name or request['name'])
+
+    def publish(self, topic, data, ordering_key='', **attrs):
+        if not isinstance(data, bytes):
+            raise TypeError('Data being published to Pub/Sub must be sent as a bytestring.')
+
+        try:
+            return MemoryFuture(result=self.broker.publish(topic, data, attrs, ordering_key))
+        except google.api_core.exceptions.GoogleAPICallError as e:
+            return MemoryFuture(exception=e)
+
+    def resume_publish(self, topic, ordering_key):
+        pass
+
+    def stop(self):
+        pass
+
+
+class MemoryStreamingPullFuture(concurrent.futures.Future):
+    """
+    A running streaming pull of the in-process backend, returned by
+    `MemorySubscriberClient.subscribe`
+
+    Messages are handed to the callback from a pool of worker threads,
+    at most `flow_control.max_messages` at once
+    """
+    def __init__(self, subscription, callback, flow_control):
+        super().__init__()
+
+        self._subscription = subscription
+        self._callback = callback
+        self._max_messages = getattr(flow_control, 'max_messages', None) or MEMQUEUE_STREAM_MAX_MESSAGES
+        self._outstanding = 0
+        self._stopping = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=MEMQUEUE_STREAM_WORKERS, thread_name_prefix='memqueue-callback')
+
+        self._thread = threading.Thread(target=self.__run, name='memqueue-stream', daemon=True)
+        self._thread.start()
+
+    def __run(self):
+        condition = self._subscription.condition
+
+        try:
+            while True:
+                with condition:
+                    received = []
+
+                    while not self._stopping:
+                        if self._outstanding < self._max_messages:
+                            now = time.time()
+                            received = self._subscription._lease(
+                                self._max_messages - self._outstanding, MEMQUEUE_STREAM_LEASE, now)
+
+                            if received:
+                                self._outstanding += len(received)
+                                break
+
+                        self._subscription._wait(self._subscription._next_expiry(time.time()))
+
+                    if self._stopping:
+                        return
+
+                for message in received:
+                    self._executor.submit(self.__dispatch, message)
+        finally:
+            self._executor.shutdown(wait=True)
+            self.set_result(None)
+
+    def __dispatch(self, received):
+        message = MemoryMessage(self._subscription, received, self.__release)
+
+        try:
+            self._callback(message)
+        except Exception as e:
+            logging.exception(f'Subscriber callback failed: {e}')
+            message.nack()
+
+    def __release(self):
+        with self._subscription.condition:
+            self._outstanding -= 1
+            self._subscription._notify()
+
+    def cancel(self):
+        with self._subscription.condition:
+            self._stopping = True
+            self._subscription.condition.notify_all()
+
+        return True
+
+    def cancelled(self):
+        return self._stopping
+
+
+class MemoryMessage(object):
+    """A message delivered by a streaming pull"""
+    def __init__(self, subscription, received, release):
+        self.ack_id = received.ack_id
+        self.message_id = received.message.message_id
+        self.data = received.message.data
+        self.attributes = received.message.attributes
+        self.ordering_key = received.message.ordering_key
+        self.delivery_attempt = received.delivery_attempt
+
+        self._subscription = subscription
+        self._release = release
+        self._settled = False
+
+    def __settle(self):
+        if self._settled:
+            return False
+
+        self._settled = True
+        self._release()
+
+        return True
+
+    def ack(self):
+        if self.__settle():
+            self._subscription.acknowledge([self.ack_id])
+
+    def nack(self):
+        if self.__settle():
+            self._subscription.modify([self.ack_id], 0)
+
+    def modify_ack_deadline(self, seconds):
+        self._subscription.modify([self.ack_id], seconds)
+
+
+class MemorySubscriberClient(object):
+    """Subscriber client of the in-process backend"""
+    def __init__(self, memory_broker=None, **kwargs):
+        self.broker = memory_broker or broker
+
+    @staticmethod
+    def subscription_path(project, subscription):
+        return f'projects/{project}/subscriptions/{subscription}'
+
+    @staticmethod
+    def snapshot_path(project, snapshot):
+        return f'projects/{project}/snapshots/{snapshot}'
+
+    def get_subscription(self, subscription=None, request=None):
+        return self.broker.subscription(subscription or request['subscription']).request
+
+    def create_subscription(self, request=None, **kwargs):
+        return self.broker.create_subscription(request or kwargs)
+
+    def update_subscription(self, request=None, **kwargs):
+        return self.broker.update_subscription(request or kwargs)
+
+    def pull(self, request=None, subscription=None, max_messages=None,
+             return_immediately=False, timeout=None, **kwargs):
+        if request:
+            subscription = request['subscription']
+            max_messages = request.get('max_messages', max_messages)
+            return_immediately = request.get('return_immediately', return_immediately)
+
+        target = self.broker.subscription(subscription)
+        wait = None if return_immediately else (timeout or MEMQUEUE_PULL_TIMEOUT)
+
+        return _PullResponse(target.lease(max_messages or 1, target.ack_deadline, wait=wait))
+
+    def modify_ack_deadline(self, request=None, subscription=None, ack_ids=None, ack_deadline_seconds=None):
+        if request:
+            subscription = request['subscription']
+            ack_ids = request['ack_ids']
+            ack_deadline_seconds = request['ack_deadline_seconds']
+
+        self.broker.subscription(subscription).modify(ack_ids, ack_deadline_seconds)
+
+    def acknowledge(self, request=None, subscription=None, ack_ids=None):
+        if request:
+            subscription = request['subscription']
+            ack_ids = request['ack_ids']
+
+        self.broker.subscription(subscription).acknowledge(ack_ids)
+
+    def seek(self, request):
+        if request.get('snapshot'):
+            # Snapshots are not kept in memory
+            raise google.api_core.exceptions.NotFound(request['snapshot'])
+
+        self.broker.subscription(request['subscription']).seek(_timestamp(request['time']))
+
+    def subscribe(self, subscription, callback, flow_control=(), scheduler=None):
+        return MemoryStreamingPullFuture(self.broker.subscription(subscription), callback, flow_control)
+
+    def close(self):
+        pass
+
+
+class MemorySubscriberAsyncClient(object):
+    """asyncio subscriber client of the in-process backend, blocking
+    pulls wait in the default executor
+    """
+    def __init__(self, subscriber=None):
+        self._subscriber = subscriber or MemorySubscriberClient()
+
+    @staticmethod
+    def subscription_path(project, subscription):
+        return MemorySubscriberClient.subscription_path(project, subscription)
+
+    async def pull(self, request, timeout=None):
+        if request.get('return_immediately'):
+            return self._subscriber.pull(request=request)
+
+        return await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(self._subscriber.pull, request=request, timeout=timeout))
+
+    async def modify_ack_deadline(self, request):
+        self._subscriber.modify_ack_deadline(request=request)
+
+    async def acknowledge(self, request):
+        self._subscriber.acknowledge(request=request)
@@ -1,13 +1,35 @@
 import os
+import json
+import time
+import asyncio
+import hashlib
+import weakref
+import datetime
+import tempfile
 import pickle
+import atexit
+import functools
+import itertools
+import collections
+import concurrent.futures
+import urllib.parse
 import logging
+import io
+import zlib
+import uuid
 import base64
+import threading
 import mock
 import google.auth
 import google.api_core
 from google.api_core import retry
 from google.cloud.pubsub import types
 from google.cloud import pubsub_v1
+from google.pubsub_v1.services.subscriber import SubscriberAsyncClient
+
+from fizzlibs.ext import memqueue
+from fizzlibs.ext import rediscache
+from fizzlibs.storage import cloudstorage
 
 
 class QQUEUE_INVALID_PROJECT_ID(Exception):
@@ -25,13 +47,575 @@ class QQUEUE_TASK_TYPE_ERROR(Exception):
 class QQUEUE_TASKS_MAX_LIMIT_ERROR(Exception):
     pass
 
+class QQUEUE_CODEC_ERROR(Exception):
+    pass
+
+class QQUEUE_TAG_NOT_PROVISIONED_ERROR(Exception):
+    pass
+
+class QQUEUE_INVALID_TAG_ERROR(Exception):
+    pass
+
+class QQUEUE_SUBSCRIPTION_FILTER_ERROR(Exception):
+    pass
+
+class QQUEUE_BACKEND_ERROR(Exception):
+    pass
+
 QQUEUE_MAX_TASKS_LIMIT = 1000
 QQUEUE_MAX_BATCH_LIMIT = 500
+QQUEUE_MAX_IN_FLIGHT = 1000
+QQUEUE_MAX_OUTSTANDING_MESSAGES = 100
+QQUEUE_MIN_LEASE_SECONDS = 10
+QQUEUE_MAX_LEASE_SECONDS = 600
+# Redelivery backoff of failed tasks, Pub/Sub accepts 0 to 600 seconds
+QQUEUE_MIN_BACKOFF = 10
+QQUEUE_MAX_BACKOFF = 600
+# Deliveries before a task is dead-lettered, Pub/Sub accepts 5 to 100
+QQUEUE_MAX_ATTEMPTS = 5
+QQUEUE_DEAD_LETTER_SUFFIX = 'dead-letter'
+# Leases are extended this many seconds before they expire
+QQUEUE_LEASE_EXTENSION_MARGIN = 5
+# Tasks held longer than this are no longer extended
+QQUEUE_MAX_LEASE_DURATION = 60 * 60
+QQUEUE_MAX_ACK_IDS_PER_REQUEST = 2500
+# Buffered acks are sent once this many are pending, or after this delay
+QQUEUE_ACK_BATCH_SIZE = 1000
+QQUEUE_ACK_MAX_LATENCY = 0.1
+# Backlog figures are fetched from the backend at most once per TTL
+QQUEUE_STATISTICS_TTL = int(os.environ.get('QQUEUE_STATISTICS_TTL', 10))
+QQUEUE_MAX_OUTSTANDING_BYTES = 100 * 1024 * 1024
+
+# Wire format: MAGIC | VERSION | CODEC ID | body
+# The magic byte is not a base64 character, which tells framed
+# messages apart from legacy base64(pickle) ones
+QQUEUE_WIRE_MAGIC = b'\xfa'
+QQUEUE_WIRE_VERSION = 1
+QQUEUE_DEFAULT_CODEC = os.environ.get('QQUEUE_TASK_CODEC', 'pickle')
+
+# Task bodies larger than the threshold (in bytes) are compressed,
+# the compressor name is sent in the QQUEUE_ENCODING_ATTRIBUTE attribute
+QQUEUE_COMPRESS_THRESHOLD = int(os.environ.get('QQUEUE_COMPRESS_THRESHOLD', 32 * 1024))
+QQUEUE_DEFAULT_COMPRESSION = os.environ.get('QQUEUE_COMPRESSION', 'zlib')
+QQUEUE_ENCODING_ATTRIBUTE = 'qqueue_encoding'
+
+# Task bodies still larger than the threshold once compressed are stored
+# through fizzlibs.storage, only a reference is published (claim-check).
+# Opt-in: offload is off unless a provider and a bucket are configured,
+# larger bodies are then published inline as before
+QQUEUE_OFFLOAD_THRESHOLD = int(os.environ.get('QQUEUE_OFFLOAD_THRESHOLD', 1000 * 1000))
+QQUEUE_CLAIM_ATTRIBUTE = 'qqueue_claim'
+QQUEUE_CLAIM_BUCKET_ATTRIBUTE = 'qqueue_claim_bucket'
+QQUEUE_CLAIM_PROVIDER_ATTRIBUTE = 'qqueue_claim_provider'
+
+# Task tags are published as an attribute so that per tag subscriptions
+# (declared with `tags` in queue.yaml) filter them server side
+QQUEUE_TAG_ATTRIBUTE = 'qqueue_tag'
+
+# Idempotency keys are published as an attribute, so that duplicates
+# are detected without decoding the task
+QQUEUE_IDEMPOTENCY_ATTRIBUTE = 'qqueue_idempotency_key'
+
+# Round robin counters over the shards of a queue: queue name -> count
+_publish_cursors = collections.defaultdict(itertools.count)
+_lease_cursors = collections.defaultdict(itertools.count)
+
+# Per queue settings, as declared in queue.yaml
+QQUEUE_SETTINGS = {}
+
+
+def configure_queue(name, **settings):
+    """Registers the settings used by every `QQueue(name)` of the process"""
+    QQUEUE_SETTINGS[name] = settings
+
+
+# Queues provisioning: `eager` (concurrently at boot, skipped when the
+# same topology was verified within the marker TTL), `lazy` (on first
+# use of each queue) or `always` (at boot, ignoring markers)
+QQUEUE_PROVISION_WORKERS = 8
+QQUEUE_PROVISION_MARKER_TTL = int(os.environ.get('QQUEUE_PROVISION_MARKER_TTL', 24 * 60 * 60))
+
+# Queues waiting for lazy provisioning
+_lazy_provisioning = set()
+_provisioning_lock = threading.Lock()
+
+
+def topology_fingerprint(queue_yaml):
+    """Hash of queue.yaml content and of the environment it is provisioned in"""
+    digest = hashlib.sha256(queue_yaml)
+
+    for variable in ('QQUEUE_PROJECT_ID', 'GKE_SOFTWARE_ID', 'QQUEUE_BACKEND',
+                     'PUBSUB_EMULATOR_HOST', 'HTTP_SCHEME', 'HTTP_HOST'):
+        digest.update(f'|{os.environ.get(variable, "")}'.encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def __marker_path(fingerprint):
+    directory = os.environ.get('QQUEUE_PROVISION_MARKER_DIR', tempfile.gettempdir())
+    return os.path.join(directory, f'fizzlibs-queues-{fingerprint}')
+
+
+def __redis_configured():
+    return all([os.environ.get('REDIS_SERVICE_HOST'), os.environ.get('REDIS_SERVICE_PORT')])
+
+
+def _is_provisioned(fingerprint):
+    try:
+        if time.time() - os.path.getmtime(__marker_path(fingerprint)) < QQUEUE_PROVISION_MARKER_TTL:
+            return True
+    except OSError:
+        pass
+
+    if __redis_configured():
+        try:
+            return bool(rediscache.__get_radis__().exists(f'fizzlibs:queues:{fingerprint}'))
+        except Exception as e:
+            logging.warning(f'Unable to read provisioning marker: {e}')
+
+    return False
+
+
+def _mark_provisioned(fingerprint):
+    try:
+        with open(__marker_path(fingerprint), 'w') as f:
+            f.write(str(time.time()))
+    except OSError as e:
+        logging.warning(f'Unable to write provisioning marker: {e}')
+
+    if __redis_configured():
+        try:
+            rediscache.__get_radis__().setex(
+                f'fizzlibs:queues:{fingerprint}', QQUEUE_PROVISION_MARKER_TTL, 1)
+        except Exception as e:
+            logging.warning(f'Unable to write provisioning marker: {e}')
+
+
+def provision_queues(queues, fingerprint=None, mode=None, max_workers=QQUEUE_PROVISION_WORKERS):
+    """Registers queue settings and creates their topics and subscriptions
+    ...
+    Parameters
+    ----------
+    queues : list of dict
+        Queue declarations, as found in queue.yaml
+    fingerprint : str
+        `topology_fingerprint` of the declarations, enables markers
+    mode : str
+        `eager`, `lazy` or `always` (default is QQUEUE_PROVISIONING or `eager`)
+    max_workers : int
+        Number of queues provisioned concurrently
+    """
+    mode = mode or os.environ.get('QQUEUE_PROVISIONING', 'eager')
+    queues = queues or []
+
+    for queue in queues:
+        settings = dict(queue)
+        configure_queue(settings.pop('name'), **settings)
+
+    if mode == 'lazy':
+        with _provisioning_lock:
+            _lazy_provisioning.update(queue['name'] for queue in queues)
+
+        return
+
+    # In-process queues are provisioned by every process
+    durable = all(get_queue_backend(queue_backend_name(queue)).durable for queue in queues)
+
+    if mode == 'eager' and fingerprint and durable and _is_provisioned(fingerprint):
+        logging.info(f'Queues topology {fingerprint[:12]} already provisioned')
+        return
+
+    started = time.monotonic()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(max_workers, len(queues)), 1)) as executor:
+        futures = [
+            executor.submit(lambda queue: QQueue(**queue, initialize_queue=True), queue)
+            for queue in queues
+        ]
+
+    for future in futures:
+        # Raises the first provisioning error
+        future.result()
+
+    logging.info(f'Provisioned {len(queues)} queue(s) in {time.monotonic() - started:.2f}s')
+
+    if fingerprint and durable:
+        _mark_provisioned(fingerprint)
+
+
+class QQueueClientRegistry(object):
+    """
+    A process-wide pool of pubsub publisher and subscriber clients
+
+    Building a client opens a new gRPC channel, resolves credentials and,
+    for publishers, starts a batching thread. Clients are therefore shared
+    by every `QQueue` of the process that uses the same project,
+    credentials and batch settings.
+
+    The registry is fork-aware: a child process never reuses channels
+    inherited from its parent, it builds its own on first use.
+
+    ...
+
+    Attributes
+    ----------
+    stats : dict
+        Number of clients created and reused, by client type
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._publishers = {}
+        self._subscribers = {}
+        self.stats = self.__empty_stats()
+
+    @staticmethod
+    def __empty_stats():
+        return {
+            'publisher_created': 0,
+            'publisher_reused': 0,
+            'subscriber_created': 0,
+            'subscriber_reused': 0
+        }
+
+    def __check_fork(self):
+        if self._pid == os.getpid():
+            return
+
+        # gRPC channels and batching threads of the parent are not usable
+        # in the child, drop them without closing
+        self._pid = os.getpid()
+        self._publishers = {}
+        self._subscribers = {}
+        self.stats = self.__empty_stats()
+
+    def get_publisher(self, key, factory):
+        """Returns the publisher for `key`, creating it with `factory`
+        if it does not exist yet
+        """
+        with self._lock:
+            self.__check_fork()
+
+            publisher = self._publishers.get(key)
+
+            if publisher is None:
+                publisher = factory()
+                self._publishers[key] = publisher
+                self.stats['publisher_created'] += 1
+            else:
+                self.stats['publisher_reused'] += 1
+
+            return publisher
+
+    def get_subscriber(self, key, factory):
+        """Returns the subscriber for `key`, creating it with `factory`
+        if it does not exist yet
+        """
+        with self._lock:
+            self.__check_fork()
+
+            subscriber = self._subscribers.get(key)
+
+            if subscriber is None:
+                subscriber = factory()
+                self._subscribers[key] = subscriber
+                self.stats['subscriber_created'] += 1
+            else:
+                self.stats['subscriber_reused'] += 1
+
+            return subscriber
+
+    def statistics(self):
+        """Returns a snapshot of the registry counters"""
+        with self._lock:
+            self.__check_fork()
+
+            stats = dict(self.stats)
+            stats['publisher_active'] = len(self._publishers)
+            stats['subscriber_active'] = len(self._subscribers)
+
+            return stats
+
+    def shutdown(self):
+        """Flushes pending publishes and closes every pooled channel"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+
+            publishers, self._publishers = self._publishers, {}
+            subscribers, self._subscribers = self._subscribers, {}
+
+        for publisher in publishers.values():
+            try:
+                publisher.stop()
+            except Exception as e:
+                logging.warning(f'Unable to stop publisher: {e}')
+
+        for subscriber in subscribers.values():
+            try:
+                subscriber.close()
+            except Exception as e:
+                logging.warning(f'Unable to close subscriber: {e}')
+
+
+client_registry = QQueueClientRegistry()
+atexit.register(client_registry.shutdown)
+
+
+class QQueueHistogram(object):
+    """
+    Fixed buckets latency histogram, in milliseconds
+    """
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        index = len(self.BUCKETS)
+
+        for n, bound in enumerate(self.BUCKETS):
+            if ms <= bound:
+                index = n
+                break
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the `p` percentile"""
+        if not self.count:
+            return None
+
+        rank = p / 100 * self.count
+        seen = 0
+
+        for n, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank and count:
+                return self.BUCKETS[n] if n < len(self.BUCKETS) else float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else None,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99)
+        }
+
+
+class QQueueCounters(object):
+    """
+    Thread-safe, process-wide counters and latency histograms kept per queue
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, queue_name, **deltas):
+        with self._lock:
+            counters = self._counters.setdefault(queue_name, {})
+
+            for key, delta in deltas.items():
+                counters[key] = counters.get(key, 0) + delta
+
+    def observe(self, queue_name, name, seconds):
+        with self._lock:
+            histograms = self._histograms.setdefault(queue_name, {})
+
+            if name not in histograms:
+                histograms[name] = QQueueHistogram()
+
+            histograms[name].observe(seconds)
+
+    def snapshot(self, queue_name):
+        with self._lock:
+            return dict(self._counters.get(queue_name, {}))
+
+    def histograms(self, queue_name):
+        with self._lock:
+            return {
+                name: histogram.snapshot()
+                for name, histogram in self._histograms.get(queue_name, {}).items()
+            }
+
+    def reset(self, queue_name=None):
+        with self._lock:
+            if queue_name is None:
+                self._counters = {}
+                self._histograms = {}
+            else:
+                self._counters.pop(queue_name, None)
+                self._histograms.pop(queue_name, None)
+
+
+queue_counters = QQueueCounters()
+
+
+class TaskCodec(object):
+    """
+    Base class of `Task` wire codecs
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        Name used to select the codec
+    codec_id : int
+        Identifier written in the message header, between 1 and 255
+    """
+    name = None
+    codec_id = None
+
+    def encode(self, task):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def _state(self, task):
+        state = dict(task.__dict__)
+
+        if state.get('handler') is not None:
+            raise QQUEUE_CODEC_ERROR(
+                f'{self.name} codec can not encode tasks with a handler')
+
+        state.pop('handler', None)
+
+        if 'args' in state:
+            state['args'] = list(state['args'])
+
+        return state
+
+    @staticmethod
+    def _from_state(state):
+        task = Task.__new__(Task)
+        task.__dict__.update(state)
+
+        if '_claim' not in state:
+            # Claim-checked bodies are loaded on first access
+            task.handler = None
+            task.args = tuple(state.get('args', ()))
+
+        return task
+
+
+class PickleTaskCodec(TaskCodec):
+    """Pickles the whole task with the highest protocol available"""
+    name = 'pickle'
+    codec_id = 1
+
+    def encode(self, task):
+        return pickle.dumps(task, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class JsonTaskCodec(TaskCodec):
+    """Encodes plain pull tasks, which payload and arguments are JSON types"""
+    name = 'json'
+    codec_id = 2
+
+    def encode(self, task):
+        try:
+            return json.dumps(self._state(task), separators=(',', ':')).encode('utf-8')
+        except TypeError as e:
+            raise QQUEUE_CODEC_ERROR(e)
+
+    def decode(self, data):
+        return self._from_state(json.loads(data))
+
+
+class MsgpackTaskCodec(TaskCodec):
+    """Compact binary encoding of plain tasks, requires `msgpack`"""
+    name = 'msgpack'
+    codec_id = 3
+
+    def encode(self, task):
+        import msgpack
+
+        try:
+            return msgpack.packb(self._state(task), use_bin_type=True)
+        except TypeError as e:
+            raise QQUEUE_CODEC_ERROR(e)
+
+    def decode(self, data):
+        import msgpack
+
+        return self._from_state(msgpack.unpackb(data, raw=False))
+
+
+TASK_CODECS = {}
+_TASK_CODEC_IDS = {}
+
+
+def register_task_codec(codec):
+    """Makes a `TaskCodec` available by name and by header identifier"""
+    if not 0 < codec.codec_id < 256:
+        raise QQUEUE_CODEC_ERROR(f'Invalid codec id {codec.codec_id}')
+
+    TASK_CODECS[codec.name] = codec
+    _TASK_CODEC_IDS[codec.codec_id] = codec
+
+
+def get_task_codec(key):
+    """Returns a registered `TaskCodec` by name or header identifier"""
+    codecs = _TASK_CODEC_IDS if isinstance(key, int) else TASK_CODECS
+
+    try:
+        return codecs[key]
+    except KeyError:
+        raise QQUEUE_CODEC_ERROR(f'Unknown task codec: {key}')
+
+
+register_task_codec(PickleTaskCodec())
+register_task_codec(JsonTaskCodec())
+register_task_codec(MsgpackTaskCodec())
+
+
+TASK_COMPRESSORS = {}
+
+
+def register_task_compressor(name, compress, decompress):
+    """Makes a compressor available to queues and message decoding
+
+    Parameters
+    ----------
+    name : str
+        Value of the QQUEUE_ENCODING_ATTRIBUTE message attribute
+    compress : a callable
+        Takes and returns bytes
+    decompress : a callable
+        Reverse of `compress`
+    """
+    TASK_COMPRESSORS[name] = (compress, decompress)
+
+
+def get_task_compressor(name):
+    try:
+        return TASK_COMPRESSORS[name]
+    except KeyError:
+        raise QQUEUE_CODEC_ERROR(f'Unknown task compressor: {name}')
+
+
+register_task_compressor('zlib', lambda data: zlib.compress(data, 6), zlib.decompress)
 
 class Task(object):
     """
     A class to represent a `Cloud Task`
 
+    Tasks received with a claim-check reference load their body from
+    storage when one of its attributes is first accessed
+
     ...
 
     Attributes
@@ -53,6 +637,12 @@ class Task(object):
             subscriber to retrieve it.
 
             Note: This is not applicable if method type is PUSH
+        ordering_key : str
+            Tasks of a key are published to the same shard, and
+            delivered in order when the queue has `ordering` enabled
+        idempotency_key : str
+            Deliveries of tasks with the same key are run once by
+            the deferred push endpoint
         countdown : int
 
             Note: Implementation pending 
@@ -61,30 +651,166 @@ class Task(object):
         self.payload = payload
         self.method = kwargs.pop('method', 'push')
         self.tag = kwargs.pop('tag', None)
+        self.ordering_key = kwargs.pop('ordering_key', None)
+        self.idempotency_key = kwargs.pop('idempotency_key', None)
 
         self.handler = handler
         self.args = args
         self.kwargs = kwargs
 
-    def to_pickle(self):
+    def encode(self, codec=None):
+        """Serializes the task to its wire format
+        ...
+        Parameters
+        ----------
+        codec : str
+            Name of a registered `TaskCodec` (default is QQUEUE_DEFAULT_CODEC)
+
+        Returns
+        -------
+        Header prefixed bytes, as published to the queue
+        """
+        codec = get_task_codec(codec or QQUEUE_DEFAULT_CODEC)
+
+        return (
+            QQUEUE_WIRE_MAGIC
+            + bytes((QQUEUE_WIRE_VERSION, codec.codec_id))
+            + codec.encode(self)
+        )
+
+    @classmethod
+    def decode(cls, data):
+        """Deserializes a task from its wire format
+
+        Legacy base64(pickle) messages are still accepted
+        """
+        if not data.startswith(QQUEUE_WIRE_MAGIC):
+            return pickle.loads(base64.b64decode(data), fix_imports=True)
+
+        version = data[1]
+
+        if version != QQUEUE_WIRE_VERSION:
+            raise QQUEUE_CODEC_ERROR(f'Unsupported task wire version {version}')
+
+        return get_task_codec(data[2]).decode(data[3:])
+
+    def to_pickle(self, codec=None):
         '''
+        Text safe (base64) form of `encode`, to embed tasks in JSON
+
         TODO: Add encryption algorithm for added security
         '''
-        return base64.b64encode(
-            pickle.dumps(self, protocol=2, fix_imports=True)
-        )
+        return base64.b64encode(self.encode(codec))
 
     @classmethod
     def from_pickle(cls, data):
         '''
+        Accepts wire bytes as well as their base64 form, both
+        framed and legacy
+
         TODO: Add decryption algorithm for added security
         '''
-        return pickle.loads(base64.b64decode(data), fix_imports=True)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        if data.startswith(QQUEUE_WIRE_MAGIC):
+            return cls.decode(data)
+
+        data = base64.b64decode(data)
+
+        if data.startswith(QQUEUE_WIRE_MAGIC):
+            return cls.decode(data)
+
+        return pickle.loads(data, fix_imports=True)
+
+    _CLAIMED_ATTRIBUTES = (
+        'payload', 'method', 'tag', 'ordering_key', 'idempotency_key', 'handler', 'args', 'kwargs'
+    )
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, i.e. claim-checked tasks
+        # which body is not loaded yet
+        if name in Task._CLAIMED_ATTRIBUTES and '_claim' in self.__dict__:
+            self.__load_claim()
+            return self.__dict__[name]
+
+        raise AttributeError(name)
+
+    def __load_claim(self):
+        claim = self.__dict__['_claim']
+
+        data = cloudstorage.download_blob(
+            claim['filename'],
+            bucket=claim['bucket'],
+            provider=claim['provider']
+        )
+
+        if claim.get('encoding'):
+            _, decompress = get_task_compressor(claim['encoding'])
+            data = decompress(data)
+
+        task = Task.decode(data)
+
+        for name in Task._CLAIMED_ATTRIBUTES:
+            self.__dict__[name] = task.__dict__.get(name)
+
+    def discard_claim(self):
+        """Deletes the stored body of a claim-checked task"""
+        claim = self.__dict__.get('_claim')
+
+        if not claim:
+            return
+
+        try:
+            cloudstorage.delete_blob(
+                claim['filename'],
+                bucket=claim['bucket'],
+                provider=claim['provider']
+            )
+        except Exception as e:
+            logging.warning(f'Unable to delete task body {claim["filename"]}: {e}')
+
+    @classmethod
+    def from_data(cls, data, attributes=None):
+        """Builds a task from message data, decompressing it
+        if the message attributes name an encoding
+        """
+        encoding = attributes.get(QQUEUE_ENCODING_ATTRIBUTE) if attributes else None
+
+        if attributes and attributes.get(QQUEUE_CLAIM_ATTRIBUTE):
+            task = cls.__new__(cls)
+            task._claim = {
+                'filename': attributes.get(QQUEUE_CLAIM_ATTRIBUTE),
+                'bucket': attributes.get(QQUEUE_CLAIM_BUCKET_ATTRIBUTE) or None,
+                'provider': attributes.get(QQUEUE_CLAIM_PROVIDER_ATTRIBUTE) or None,
+                'encoding': encoding
+            }
+
+            return task
+
+        if encoding:
+            _, decompress = get_task_compressor(encoding)
+            data = decompress(data)
+
+        return cls.from_pickle(data)
 
     @classmethod
     def from_grpc_response(cls, grpc_response):
-        task = cls.from_pickle(grpc_response.message.data)
+        task = cls.from_data(
+            grpc_response.message.data, grpc_response.message.attributes
+        )
         task.ack_id = grpc_response.ack_id
+        # Only known when the subscription has a dead letter policy
+        task.delivery_attempt = getattr(grpc_response, 'delivery_attempt', None) or None
+
+        return task
+
+    @classmethod
+    def from_message(cls, message):
+        """Builds a task from a streaming pull message"""
+        task = cls.from_data(message.data, message.attributes)
+        task.ack_id = message.ack_id
+        task.delivery_attempt = getattr(message, 'delivery_attempt', None) or None
 
         return task
 
@@ -92,162 +818,1290 @@ class Task(object):
         return f'{self.__class__.__name__} : {self.payload}, {self.method}'
 
 
-class QQueue(object):
+class QQueueStatistics(object):
     """
-    A class to add or lease message to-and-from queue 
+    Statistics of a queue, returned by `QQueue.fetch_statistics`
+
+    Counters are those of the current process, backlog figures are
+    those of the backend and may be up to QQUEUE_STATISTICS_TTL old.
 
     ...
 
     Attributes
     ----------
+    queue_name : str
+    published, publish_failed, leased, acked, nacked : int
+        Tasks counted by this process
+    published_bytes, bytes_saved : int
+        Bytes published and saved by compression
+    publish_latency, lease_latency : dict
+        Latency histogram summaries (count, mean and percentiles in ms)
+    publish_rate, ack_rate : float
+        Tasks per second since the previous `fetch_statistics` call
+    backlog : int
+        Number of undelivered tasks, None if unknown
+    oldest_task_age : float
+        Age in seconds of the oldest unacknowledged task, None if unknown
+    fetched_at : float
+        UNIX time the backlog figures were fetched at
     """
-    def __init__(self, name, **kwargs):
-        self.project_id = os.environ.get('QQUEUE_PROJECT_ID')
-
-        if os.environ.get('GKE_SOFTWARE_ID'):
-            self.queue_name = f'{os.environ.get("GKE_SOFTWARE_ID")}-{name}'
-        else:
-            self.queue_name = name
+    def __init__(self, queue_name, counters, histograms, backlog=None, rates=None):
+        backlog = backlog or {}
+        rates = rates or {}
+
+        self.queue_name = queue_name
+        self.published = counters.get('published', 0)
+        self.publish_failed = counters.get('publish_failed', 0)
+        self.leased = counters.get('leased', 0)
+        self.acked = counters.get('acked', 0)
+        self.nacked = counters.get('nacked', 0)
+        self.published_bytes = counters.get('published_bytes', 0)
+        self.bytes_saved = counters.get('bytes_saved', 0)
+        self.publish_latency = histograms.get('publish_latency')
+        self.lease_latency = histograms.get('lease_latency')
+        self.publish_rate = rates.get('publish_rate')
+        self.ack_rate = rates.get('ack_rate')
+        self.backlog = backlog.get('backlog')
+        self.oldest_task_age = backlog.get('oldest_task_age')
+        self.fetched_at = backlog.get('fetched_at')
+        self.counters = counters
+
+    def to_dict(self):
+        return {
+            key: value for key, value in self.__dict__.items()
+            if key != 'counters'
+        }
 
-        if not self.project_id:
-            raise QQUEUE_INVALID_PROJECT_ID
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__} : {self.queue_name}, backlog {self.backlog}, '
+            f'{self.published} published, {self.acked} acked'
+        )
 
-        if kwargs.get('initialize_queue', False):
-            # Create queue
-            self.__create_queue()
-            # Create enduser
-            self.__create_enduser(**kwargs)
 
-    def __get_credentials(self):
-        if os.environ.get('PUBSUB_EMULATOR_HOST'):
-            # As pubsub_v1 looks for this env variable,
-            # We will also use the same to create mock credentials
-            return mock.Mock(spec=google.auth.credentials.Credentials)
+def _monitoring_backlog(queue, deadline=None):
+    """Backlog of a queue subscription from Cloud Monitoring
 
-        if self.project_id == os.environ.get('QQUEUE_PROJECT_ID') and os.environ.get('QQUEUE_SERVICE_KEY'):
-            # Getting default qqueue service account
-            return google.auth.credentials.Credentials.from_service_account_file(
-                    os.environ.get('QQUEUE_SERVICE_KEY'),
-                    scopes=SCOPES
-                )
+    Requires `google-cloud-monitoring`, returns None when it is not
+    installed or when running against the emulator
+    """
+    if os.environ.get('PUBSUB_EMULATOR_HOST'):
+        return None
 
-        raise QQUEUE_AUTHENTICATION_ERROR
+    try:
+        from google.cloud import monitoring_v3
+    except ImportError:
+        return None
 
-    def __get_subscriber(self):
-        subscriber = pubsub_v1.SubscriberClient(credentials=self.__get_credentials())
+    client = monitoring_v3.MetricServiceClient(credentials=queue._QQueue__get_credentials())
 
-        return (
-            subscriber,
-            subscriber.subscription_path(self.project_id, self.queue_name)
-        )
+    now = int(time.time())
+    interval = monitoring_v3.TimeInterval({
+        'end_time': {'seconds': now},
+        'start_time': {'seconds': now - 300}
+    })
 
-    def __get_publisher(self):
-        publisher = pubsub_v1.PublisherClient(
-                credentials=self.__get_credentials(),
-                batch_settings=types.BatchSettings(max_messages=QQUEUE_MAX_BATCH_LIMIT)
-            )
+    # One series per shard subscription
+    subscriptions = ', '.join(f'"{name}"' for name in queue._subscription_names())
 
-        return (
-            publisher,
-            publisher.topic_path(self.project_id, self.queue_name)
+    def latest(metric, combine):
+        results = client.list_time_series(
+            request={
+                'name': f'projects/{queue.project_id}',
+                'filter': (
+                    f'metric.type = "pubsub.googleapis.com/subscription/{metric}" '
+                    f'AND resource.labels.subscription_id = one_of({subscriptions})'
+                ),
+                'interval': interval,
+                'view': monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL
+            },
+            timeout=deadline
         )
 
-    def __create_queue(self):
-        """ Creates a pubsub topic
-        """
-        publisher, source = self.__get_publisher()
+        values = []
 
-        # Check if topic exists
-        try:
-            publisher.get_topic(topic=source)
-            logging.info(f'Queue {source} exists. Skipping creation')
-            return
-        except google.api_core.exceptions.NotFound:
-            pass
+        for series in results:
+            for point in series.points:
+                # Points are returned newest first
+                values.append(point.value.int64_value)
+                break
 
-        topic = publisher.create_topic(request={'name': source})
+        return combine(values) if values else None
 
-        logging.info('Created queue: {topic.name}')
+    return {
+        'backlog': latest('num_undelivered_messages', sum),
+        'oldest_task_age': latest('oldest_unacked_message_age', max)
+    }
 
-    def __create_enduser(self, **kwargs):
-        """ Creates a pubsub subscriber for a given topic
-        """
-        publisher, p_source = self.__get_publisher()
-        subscriber, s_source = self.__get_subscriber()
 
-        try:
-            subscriber.get_subscription(subscription=s_source)
-            logging.info (f'End user for {s_source} exists')
-            return
-        except google.api_core.exceptions.NotFound:
-            pass
+class QueueBackend(object):
+    """
+    Base class of `QQueue` backends
 
-        request={
-            'name': s_source,
-            'topic': p_source
-        }
+    A backend provides clients with the surface of the pubsub_v1
+    publisher and subscriber clients
 
-        if kwargs.get('mode', 'push') == 'push':
-            host = f'{os.environ.get("HTTP_SCHEME")}://{os.environ.get("HTTP_HOST")}'
-            path = kwargs.get('path', '/_ah/queue/deferred')
-            endpoint = f'{host}{path}'
-            endpoint = kwargs.get('endpoint', endpoint)
+    ...
 
-            push_config = pubsub_v1.types.PushConfig(push_endpoint=endpoint)
-            request['push_config'] = push_config
+    Attributes
+    ----------
+    name : str
+        Name used to select the backend, in QQUEUE_BACKEND or queue.yaml
+    durable : bool
+        False when queues only live in the current process,
+        provisioning markers are then ignored
+    """
+    name = None
+    durable = True
+
+    def publisher(self, queue, batch_settings, publisher_options):
+        raise NotImplementedError
+
+    def subscriber(self, queue):
+        raise NotImplementedError
+
+    def async_subscriber(self, queue):
+        raise NotImplementedError
+
+    def backlog(self, queue, deadline=None):
+        return None
+
+
+class PubsubQueueBackend(QueueBackend):
+    name = 'pubsub'
+
+    def publisher(self, queue, batch_settings, publisher_options):
+        return pubsub_v1.PublisherClient(
+            credentials=queue._credentials(),
+            batch_settings=batch_settings,
+            publisher_options=publisher_options
+        )
+
+    def subscriber(self, queue):
+        return pubsub_v1.SubscriberClient(credentials=queue._credentials())
+
+    def async_subscriber(self, queue):
+        if os.environ.get('PUBSUB_EMULATOR_HOST'):
+            import grpc
+            from google.pubsub_v1.services.subscriber.transports import SubscriberGrpcAsyncIOTransport
+
+            channel = grpc.aio.insecure_channel(os.environ.get('PUBSUB_EMULATOR_HOST'))
+
+            return SubscriberAsyncClient(transport=SubscriberGrpcAsyncIOTransport(channel=channel))
+
+        return SubscriberAsyncClient(credentials=queue._credentials())
+
+    def backlog(self, queue, deadline=None):
+        return _monitoring_backlog(queue, deadline)
+
+
+class MemoryQueueBackend(QueueBackend):
+    """Queues of the current process, see `memqueue`"""
+    name = 'memory'
+    durable = False
+
+    def publisher(self, queue, batch_settings, publisher_options):
+        return memqueue.MemoryPublisherClient(
+            batch_settings=batch_settings,
+            publisher_options=publisher_options
+        )
+
+    def subscriber(self, queue):
+        return memqueue.MemorySubscriberClient()
+
+    def async_subscriber(self, queue):
+        return memqueue.MemorySubscriberAsyncClient()
+
+    def backlog(self, queue, deadline=None):
+        return memqueue.broker.backlog([
+            memqueue.MemorySubscriberClient.subscription_path(queue.project_id, name)
+            for name in queue._subscription_names()
+        ])
+
+
+QUEUE_BACKENDS = {}
+
+
+def register_queue_backend(backend):
+    """Registers a `QueueBackend` instance by its name"""
+    QUEUE_BACKENDS[backend.name] = backend
+
+
+def get_queue_backend(name):
+    try:
+        return QUEUE_BACKENDS[name]
+    except KeyError:
+        raise QQUEUE_BACKEND_ERROR(f'Unknown queue backend {name}')
+
+
+def queue_backend_name(settings):
+    """Backend of a queue: its `backend` setting, else QQUEUE_BACKEND"""
+    return settings.get('backend') or os.environ.get('QQUEUE_BACKEND') or 'pubsub'
+
+
+register_queue_backend(PubsubQueueBackend())
+register_queue_backend(MemoryQueueBackend())
+
+
+def _backend_backlog(queue, deadline=None):
+    return get_queue_backend(queue.backend).backlog(queue, deadline)
+
+
+# Callable returning the backlog figures of a queue,
+# replaceable by a local stand-in
+backlog_provider = _backend_backlog
+
+
+def set_backlog_provider(provider):
+    """Replaces the source of backlog figures
+
+    Parameters
+    ----------
+    provider : a callable
+        Called with the `QQueue` and a deadline in seconds, returns a dict
+        with `backlog` and `oldest_task_age`, or None if unknown
+    """
+    global backlog_provider
+
+    backlog_provider = provider
+    _statistics_cache.clear()
+
+
+# queue name -> (backlog figures, previous counters and time)
+_statistics_cache = {}
+_statistics_lock = threading.Lock()
+
+
+class QQueueAddSummary(object):
+    """
+    Outcome of `QQueue.add_many`
+
+    ...
+
+    Attributes
+    ----------
+    total : int
+        Number of tasks read from the iterable
+    published : int
+        Number of tasks accepted by pubsub
+    failed : int
+        Number of tasks which could not be published
+    failed_indexes : list
+        Positions of the failed tasks in the iterable
+    elapsed : float
+        Seconds spent publishing
+    """
+    def __init__(self):
+        self.total = 0
+        self.published = 0
+        self.failed = 0
+        self.failed_indexes = []
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """Published tasks per second"""
+        return self.published / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return (
+            f'{self.__class__.__name__} : {self.published}/{self.total} published, '
+            f'{self.failed} failed, {self.throughput:.0f} tasks/s'
+        )
+
+
+class QQueueConsumer(object):
+    """
+    A running streaming pull consumer, returned by `QQueue.consume`,
+    with one stream per shard of the queue
+
+    Tasks are acknowledged once the callback returns and negatively
+    acknowledged (redelivered) if it raises.
+
+    ...
+
+    Attributes
+    ----------
+    queue_name : str
+        Name of the consumed queue
+    processed : int
+        Number of tasks successfully handled
+    failed : int
+        Number of tasks whose callback raised
+    """
+    def __init__(self, queue_name, callback):
+        self.queue_name = queue_name
+        self.processed = 0
+        self.failed = 0
+
+        self._callback = callback
+        self._futures = []
+        self._stopping = False
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def _start(self, subscriber, source, flow_control):
+        self._futures.append(subscriber.subscribe(
+            source, self._on_message, flow_control=flow_control
+        ))
+
+    def _on_message(self, message):
+        with self._condition:
+            if self._stopping:
+                # Draining, let another consumer pick it up
+                message.nack()
+                return
+
+            self._in_flight += 1
+
+        queue_counters.increment(self.queue_name, leased=1)
+
+        try:
+            task = Task.from_message(message)
+            self._callback(task)
+        except Exception as e:
+            logging.exception(f'{self.queue_name}: task failed: {e}')
+            message.nack()
+            queue_counters.increment(self.queue_name, nacked=1)
+
+            with self._condition:
+                self.failed += 1
+        else:
+            message.ack()
+            queue_counters.increment(self.queue_name, acked=1)
+
+            with self._condition:
+                self.processed += 1
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    @property
+    def running(self):
+        return not self._stopping and not any(future.done() for future in self._futures)
+
+    def stop(self, timeout=None):
+        """Stops pulling and waits for in-flight tasks to complete
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum seconds to wait for in-flight tasks (default is forever)
+
+        Returns
+        -------
+        True if every in-flight task was drained
+        """
+        with self._condition:
+            self._stopping = True
+
+            # Keep the stream open while draining so that acks of the
+            # in-flight tasks are still delivered
+            drained = self._condition.wait_for(
+                lambda: self._in_flight == 0, timeout=timeout
+            )
+
+        for future in self._futures:
+            future.cancel()
+
+        if not drained:
+            logging.warning(
+                f'{self.queue_name}: {self._in_flight} task(s) still running')
+
+        return drained
+
+    def result(self, timeout=None):
+        """Blocks until the consumer stops or fails"""
+        for future in self._futures:
+            future.result(timeout=timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class QQueueLeaseKeeper(object):
+    """
+    Extends the leases of pulled tasks until they are deleted
+
+    A single background thread batches `modify_ack_deadline` calls for
+    every task held by the process. Leases are extended shortly before
+    they expire, by the 99th percentile of the observed processing time,
+    so that a crashed worker's tasks are redelivered quickly while slow
+    tasks are not.
+
+    Use the process-wide `lease_keeper`, through
+    `QQueue.lease_tasks(..., keep_lease=True)`.
+    """
+    def __init__(self, margin=QQUEUE_LEASE_EXTENSION_MARGIN,
+                 max_lease_duration=QQUEUE_MAX_LEASE_DURATION):
+        self.margin = margin
+        self.max_lease_duration = max_lease_duration
+        self.extensions = 0
+
+        self._condition = threading.Condition()
+        self._leases = {}
+        self._durations = collections.deque(maxlen=1000)
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def hold(self, subscriber, source, tasks, lease_seconds):
+        """Starts extending the lease of tasks pulled from `source`"""
+        now = time.monotonic()
+
+        with self._condition:
+            self.__ensure_thread()
+
+            for task in tasks:
+                self._leases[task.ack_id] = {
+                    'subscriber': subscriber,
+                    'source': source,
+                    'leased_at': now,
+                    'expires_at': now + lease_seconds
+                }
+
+            self._condition.notify()
+
+    def release(self, tasks):
+        """Stops extending the lease of tasks, once deleted or returned"""
+        now = time.monotonic()
+
+        with self._condition:
+            for task in tasks:
+                lease = self._leases.pop(getattr(task, 'ack_id', None), None)
+
+                if lease:
+                    self._durations.append(now - lease['leased_at'])
+
+    def held(self):
+        with self._condition:
+            return len(self._leases)
+
+    def extension_seconds(self):
+        """Lease extension, the 99th percentile of processing times"""
+        with self._condition:
+            durations = sorted(self._durations)
+
+        if not durations:
+            return QQUEUE_MAX_LEASE_SECONDS
+
+        p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+
+        return int(min(max(p99 + self.margin, QQUEUE_MIN_LEASE_SECONDS), QQUEUE_MAX_LEASE_SECONDS))
+
+    def __ensure_thread(self):
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        if self._pid != os.getpid():
+            # Leases held by a parent process are not ours to extend
+            self._leases = {}
+            self._durations.clear()
+
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self.__run, name='qqueue-lease-keeper', daemon=True)
+        self._thread.start()
+
+    def __run(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+
+                timeout = self.__next_wakeup()
+                self._condition.wait(timeout=timeout)
+
+                if self._stopping:
+                    return
+
+                due = self.__collect_due()
+
+            if due:
+                self.__extend(due)
+
+    def __next_wakeup(self):
+        if not self._leases:
+            return None
+
+        next_expiry = min(lease['expires_at'] for lease in self._leases.values())
+
+        return max(next_expiry - self.margin - time.monotonic(), 0)
+
+    def __collect_due(self):
+        now = time.monotonic()
+        extension = None
+        due = {}
+
+        for ack_id, lease in list(self._leases.items()):
+            if now - lease['leased_at'] > self.max_lease_duration:
+                logging.warning(f'Lease of {ack_id} held too long, no longer extended')
+                del self._leases[ack_id]
+                continue
+
+            if lease['expires_at'] - self.margin > now:
+                continue
+
+            if extension is None:
+                # Condition is reentrant
+                extension = self.extension_seconds()
+
+            lease['expires_at'] = now + extension
+
+            key = (id(lease['subscriber']), lease['source'])
+            batch = due.setdefault(key, (lease['subscriber'], lease['source'], extension, []))
+            batch[3].append(ack_id)
+
+        return due
+
+    def __extend(self, due):
+        for subscriber, source, extension, ack_ids in due.values():
+            for n in range(0, len(ack_ids), QQUEUE_MAX_ACK_IDS_PER_REQUEST):
+                try:
+                    subscriber.modify_ack_deadline(
+                        request={
+                            "subscription": source,
+                            "ack_ids": ack_ids[n:n + QQUEUE_MAX_ACK_IDS_PER_REQUEST],
+                            "ack_deadline_seconds": extension
+                        }
+                    )
+                    self.extensions += 1
+                except Exception as e:
+                    logging.warning(f'Unable to extend leases on {source}: {e}')
+
+    def stop(self):
+        """Stops extending every lease, held tasks will be redelivered"""
+        with self._condition:
+            self._stopping = True
+            self._leases = {}
+            self._condition.notify()
+
+        if self._thread and self._pid == os.getpid():
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+lease_keeper = QQueueLeaseKeeper()
+atexit.register(lease_keeper.stop)
+
+
+def _gather_futures(futures):
+    """Returns a future which completes once all `futures` have"""
+    gathered = concurrent.futures.Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0
+
+        if done:
+            errors = [f.exception() for f in futures if f.exception()]
+
+            if errors:
+                gathered.set_exception(errors[0])
+            else:
+                gathered.set_result(None)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+    return gathered
+
+
+class QQueueAckCoalescer(object):
+    """
+    Buffers acknowledgements and sends them in bulk
+
+    Ack ids are flushed by a background thread in one `acknowledge`
+    call per subscription once `batch_size` are pending or the oldest
+    waited `max_latency` seconds, and on process exit.
+
+    Use the process-wide `ack_coalescer`, through
+    `QQueue.delete_tasks_async`.
+
+    ...
+
+    Attributes
+    ----------
+    stats : dict
+        Number of ack ids acknowledged and of requests sent
+    """
+    def __init__(self, batch_size=QQUEUE_ACK_BATCH_SIZE, max_latency=QQUEUE_ACK_MAX_LATENCY):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.stats = {'acknowledged': 0, 'requests': 0}
+
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._size = 0
+        self._oldest = None
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def acknowledge(self, subscriber, source, ack_ids):
+        """Buffers ack ids of `source`
+
+        Returns
+        -------
+        A future which results to None once the ack ids are acknowledged
+        """
+        future = concurrent.futures.Future()
+
+        with self._condition:
+            self.__ensure_thread()
+
+            key = (id(subscriber), source)
+            batch = self._pending.setdefault(key, (subscriber, source, [], []))
+            batch[2].extend(ack_ids)
+            batch[3].append(future)
+
+            self._size += len(ack_ids)
+
+            if self._oldest is None or self._size >= self.batch_size:
+                # Start the latency timer, or flush a full batch
+                self._oldest = self._oldest or time.monotonic()
+                self._condition.notify()
+
+        return future
+
+    def flush(self):
+        """Sends every buffered ack id now, from the calling thread"""
+        with self._condition:
+            batches = self.__take()
+
+        self.__send(batches)
+
+    def __ensure_thread(self):
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        if self._pid != os.getpid():
+            # Acks buffered by a parent process are sent by the parent
+            self._pending = {}
+            self._size = 0
+            self._oldest = None
+
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self.__run, name='qqueue-ack-coalescer', daemon=True)
+        self._thread.start()
+
+    def __take(self):
+        batches, self._pending = self._pending, {}
+        self._size = 0
+        self._oldest = None
+
+        return list(batches.values())
+
+    def __run(self):
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    if self._size >= self.batch_size:
+                        break
+
+                    if self._oldest is None:
+                        self._condition.wait()
+                        continue
+
+                    remaining = self._oldest + self.max_latency - time.monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self._condition.wait(timeout=remaining)
+
+                stopping = self._stopping
+                batches = self.__take()
+
+            self.__send(batches)
+
+            if stopping:
+                return
+
+    def __send(self, batches):
+        for subscriber, source, ack_ids, futures in batches:
+            try:
+                for n in range(0, len(ack_ids), QQUEUE_MAX_ACK_IDS_PER_REQUEST):
+                    subscriber.acknowledge(
+                        subscription=source,
+                        ack_ids=ack_ids[n:n + QQUEUE_MAX_ACK_IDS_PER_REQUEST]
+                    )
+
+                    with self._condition:
+                        self.stats['requests'] += 1
+            except Exception as e:
+                logging.error(f'Unable to acknowledge {len(ack_ids)} task(s) on {source}: {e}')
+
+                for future in futures:
+                    future.set_exception(e)
+
+                continue
+
+            with self._condition:
+                self.stats['acknowledged'] += len(ack_ids)
+
+            for future in futures:
+                future.set_result(None)
+
+    def stop(self):
+        """Flushes the buffered acks and stops the background thread"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+        if self._thread and self._pid == os.getpid():
+            self._thread.join()
+
+        self.flush()
+
+
+ack_coalescer = QQueueAckCoalescer()
+atexit.register(ack_coalescer.stop)
+
+
+class QQueue(object):
+    """
+    A class to add or lease message to-and-from queue 
+
+    ...
+
+    Attributes
+    ----------
+    """
+    def __init__(self, name, **kwargs):
+        self.project_id = os.environ.get('QQUEUE_PROJECT_ID')
+        self.name = name
+
+        if os.environ.get('GKE_SOFTWARE_ID'):
+            self.queue_name = f'{os.environ.get("GKE_SOFTWARE_ID")}-{name}'
+        else:
+            self.queue_name = name
+
+        if not self.project_id:
+            raise QQUEUE_INVALID_PROJECT_ID
+
+        initialize_queue = kwargs.pop('initialize_queue', False)
+
+        if initialize_queue:
+            configure_queue(name, **kwargs)
+
+        self.settings = dict(QQUEUE_SETTINGS.get(name, {}))
+        self.settings.update(kwargs)
+
+        self.codec = self.settings.get('codec') or QQUEUE_DEFAULT_CODEC
+        self.compression = self.settings.get('compression', QQUEUE_DEFAULT_COMPRESSION)
+        self.compress_threshold = self.settings.get(
+            'compress_threshold', QQUEUE_COMPRESS_THRESHOLD)
+        self.offload_threshold = self.settings.get(
+            'offload_threshold', QQUEUE_OFFLOAD_THRESHOLD)
+        self.offload_provider = self.settings.get(
+            'offload_provider') or os.environ.get('QQUEUE_OFFLOAD_PROVIDER')
+        self.offload_bucket = self.settings.get(
+            'offload_bucket') or os.environ.get('QQUEUE_OFFLOAD_BUCKET')
+        self.shards = max(int(self.settings.get('shards', 1)), 1)
+        self.ordering = bool(self.settings.get('ordering', False))
+        self.backend = queue_backend_name(self.settings)
+
+        # Fail early on unknown backends
+        get_queue_backend(self.backend)
+
+        if initialize_queue:
+            # Create queue
+            self.__create_queue()
+            # Create enduser
+            self.__create_enduser(**self.settings)
+        elif name in _lazy_provisioning:
+            self.__provision_lazily(name)
+
+    def __provision_lazily(self, name):
+        with _provisioning_lock:
+            if name not in _lazy_provisioning:
+                return
+
+            self.__create_queue()
+            self.__create_enduser(**self.settings)
+
+            _lazy_provisioning.discard(name)
+
+    def __get_credentials_key(self):
+        if os.environ.get('PUBSUB_EMULATOR_HOST'):
+            return f'emulator:{os.environ.get("PUBSUB_EMULATOR_HOST")}'
+
+        return f'service-key:{os.environ.get("QQUEUE_SERVICE_KEY")}'
+
+    def __get_credentials(self):
+        if os.environ.get('PUBSUB_EMULATOR_HOST'):
+            # As pubsub_v1 looks for this env variable,
+            # We will also use the same to create mock credentials
+            return mock.Mock(spec=google.auth.credentials.Credentials)
+
+        if self.project_id == os.environ.get('QQUEUE_PROJECT_ID') and os.environ.get('QQUEUE_SERVICE_KEY'):
+            # Getting default qqueue service account
+            return google.auth.credentials.Credentials.from_service_account_file(
+                    os.environ.get('QQUEUE_SERVICE_KEY'),
+                    scopes=SCOPES
+                )
+
+        raise QQUEUE_AUTHENTICATION_ERROR
+
+    def __get_subscriber(self):
+        subscriber = client_registry.get_subscriber(
+                (self.backend, self.project_id, self.__get_credentials_key()),
+                lambda: get_queue_backend(self.backend).subscriber(self)
+            )
+
+        return (
+            subscriber,
+            subscriber.subscription_path(self.project_id, self.queue_name)
+        )
+
+    def _shard_name(self, shard=0):
+        """Topic name of a shard. The first shard keeps the queue name,
+        so that an existing queue can be sharded in place
+        """
+        if shard == 0:
+            return self.queue_name
+
+        return f'{self.queue_name}-shard-{shard}'
+
+    def __get_tag_subscription_name(self, tag, shard=0):
+        return f'{self._shard_name(shard)}-tag-{urllib.parse.quote(str(tag), safe="")}'
+
+    def _subscription_name(self, tag=None, shard=0):
+        """Name of a shard subscription, or of one of its tag subscriptions"""
+        if tag is None:
+            return self._shard_name(shard)
+
+        return self.__get_tag_subscription_name(tag, shard)
+
+    def _subscription_names(self, tag=None):
+        """Names of the subscriptions of every shard"""
+        return [self._subscription_name(tag, shard) for shard in range(self.shards)]
+
+    def __get_shard(self, task):
+        """Shard of a task: by hash of its ordering key, else round robin"""
+        if self.shards == 1:
+            return 0
+
+        ordering_key = getattr(task, 'ordering_key', None)
+
+        if ordering_key is None:
+            return next(_publish_cursors[self.queue_name]) % self.shards
+
+        # Stable across processes, unlike hash()
+        return zlib.crc32(str(ordering_key).encode('utf-8')) % self.shards
+
+    def _credentials(self):
+        return self.__get_credentials()
+
+    def __get_batch_settings(self):
+        """Publisher batching, from the batch_max_* queue settings"""
+        return types.BatchSettings(
+            max_bytes=self.settings.get('batch_max_bytes', 1000 * 1000),
+            max_latency=self.settings.get('batch_max_latency', 0.01),
+            max_messages=self.settings.get('batch_max_messages', QQUEUE_MAX_BATCH_LIMIT)
+        )
+
+    def __get_publisher_options(self):
+        """Publisher flow control, from the flow_control_* queue settings.
+        Publishing blocks once the limits of pending messages are reached.
+        Ordering keys are enabled by the `ordering` queue setting
+        """
+        options = {}
+
+        if self.ordering:
+            options['enable_message_ordering'] = True
+
+        if any(key in self.settings for key in ('flow_control_messages', 'flow_control_bytes')):
+            options['flow_control'] = types.PublishFlowControl(
+                message_limit=self.settings.get('flow_control_messages', 10 * QQUEUE_MAX_BATCH_LIMIT),
+                byte_limit=self.settings.get('flow_control_bytes', 10 * 1000 * 1000),
+                limit_exceeded_behavior=types.LimitExceededBehavior.BLOCK
+            )
+
+        return types.PublisherOptions(**options)
+
+    def __get_publisher(self):
+        batch_settings = self.__get_batch_settings()
+        publisher_options = self.__get_publisher_options()
+
+        publisher = client_registry.get_publisher(
+                (self.backend, self.project_id, self.__get_credentials_key(), batch_settings, publisher_options),
+                lambda: get_queue_backend(self.backend).publisher(self, batch_settings, publisher_options)
+            )
+
+        return (
+            publisher,
+            publisher.topic_path(self.project_id, self.queue_name)
+        )
+
+    def __create_queue(self):
+        """ Creates a pubsub topic per shard
+        """
+        publisher, _ = self.__get_publisher()
+
+        for shard in range(self.shards):
+            source = publisher.topic_path(self.project_id, self._shard_name(shard))
+
+            # Check if topic exists
+            try:
+                publisher.get_topic(topic=source)
+                logging.info(f'Queue {source} exists. Skipping creation')
+                continue
+            except google.api_core.exceptions.NotFound:
+                pass
+
+            topic = publisher.create_topic(request={'name': source})
+
+            logging.info(f'Created queue: {topic.name}')
+
+    def _dead_letter_queue_name(self):
+        """Name of the dead letter queue, None when tasks are never
+        dead-lettered. Set by the `dead_letter_queue` setting, or
+        `<name>-dead-letter` when only `max_attempts` is set
+        """
+        name = self.settings.get('dead_letter_queue')
+
+        if name or not self.settings.get('max_attempts'):
+            return name or None
+
+        return f'{self.name}-{QQUEUE_DEAD_LETTER_SUFFIX}'
+
+    def __get_delivery_policies(self, publisher, **kwargs):
+        """ Retry and dead letter policies of the queue subscriptions
+
+        Push queues back off failed tasks by default, pull queues when
+        `min_backoff` or `max_backoff` is set. Dead letters are published
+        to a pull queue, created along with the policy.
+
+        Note: On Pub/Sub, the service account of the project needs the
+        publisher role on the dead letter topic, and the subscriber role
+        on the queue subscriptions
+        """
+        policies = {}
+
+        if (kwargs.get('mode', 'push') == 'push'
+                or 'min_backoff' in kwargs or 'max_backoff' in kwargs):
+            policies['retry_policy'] = pubsub_v1.types.RetryPolicy(
+                minimum_backoff=datetime.timedelta(
+                    seconds=kwargs.get('min_backoff', QQUEUE_MIN_BACKOFF)),
+                maximum_backoff=datetime.timedelta(
+                    seconds=kwargs.get('max_backoff', QQUEUE_MAX_BACKOFF))
+            )
+
+        dead_letter_name = self._dead_letter_queue_name()
+
+        if dead_letter_name:
+            settings = QQUEUE_SETTINGS.get(dead_letter_name) or {
+                'mode': 'pull', 'backend': self.backend
+            }
+            dead_letter = QQueue(dead_letter_name, initialize_queue=True, **settings)
+
+            policies['dead_letter_policy'] = pubsub_v1.types.DeadLetterPolicy(
+                dead_letter_topic=publisher.topic_path(self.project_id, dead_letter.queue_name),
+                max_delivery_attempts=kwargs.get('max_attempts', QQUEUE_MAX_ATTEMPTS)
+            )
+
+        return policies
+
+    def __create_enduser(self, **kwargs):
+        """ Creates a pubsub subscriber for each shard topic, and a
+        filtered pull subscriber for each of the queue `tags`
+        """
+        publisher, _ = self.__get_publisher()
+        subscriber, _ = self.__get_subscriber()
+
+        tags = kwargs.get('tags') or []
+        policies = self.__get_delivery_policies(publisher, **kwargs)
+
+        for tag in tags:
+            # Tags are quoted as is in the subscription filters
+            if any(c in str(tag) for c in '"\\') or not str(tag).isprintable():
+                raise QQUEUE_INVALID_TAG_ERROR(
+                    f'Tag {tag!r} of {self.queue_name} contains quotes, backslashes or control characters')
+
+        for shard in range(self.shards):
+            p_source = publisher.topic_path(self.project_id, self._shard_name(shard))
+
+            request={
+                'name': subscriber.subscription_path(self.project_id, self._subscription_name(shard=shard)),
+                'topic': p_source
+            }
+
+            if self.ordering:
+                request['enable_message_ordering'] = True
+
+            request.update(policies)
+
+            if kwargs.get('mode', 'push') == 'push':
+                host = f'{os.environ.get("HTTP_SCHEME")}://{os.environ.get("HTTP_HOST")}'
+                path = kwargs.get('path', '/_ah/queue/deferred')
+                endpoint = f'{host}{path}'
+                endpoint = kwargs.get('endpoint', endpoint)
+
+                push_config = pubsub_v1.types.PushConfig(push_endpoint=endpoint)
+                request['push_config'] = push_config
+
+            if tags:
+                # Tagged tasks are only delivered to their tag subscriber
+                request['filter'] = ' AND '.join(
+                    f'NOT attributes.{QQUEUE_TAG_ATTRIBUTE} = "{tag}"' for tag in tags
+                )
+
+            self.__create_subscription(subscriber, request)
+
+            for tag in tags:
+                tag_request = {
+                    'name': subscriber.subscription_path(
+                        self.project_id, self.__get_tag_subscription_name(tag, shard)),
+                    'topic': p_source,
+                    'filter': f'attributes.{QQUEUE_TAG_ATTRIBUTE} = "{tag}"'
+                }
+
+                if self.ordering:
+                    tag_request['enable_message_ordering'] = True
+
+                tag_request.update(policies)
+
+                self.__create_subscription(subscriber, tag_request)
+
+    def __create_subscription(self, subscriber, request):
+        try:
+            current = subscriber.get_subscription(subscription=request['name'])
+            logging.info (f'End user for {request["name"]} exists')
+            self.__update_subscription(subscriber, current, request)
+            return
+        except google.api_core.exceptions.NotFound:
+            pass
+
+        subscription = subscriber.create_subscription(
+            request=request
+        )
+
+        logging.info(f'Queue enduser: {subscription}')
+
+    def __update_subscription(self, subscriber, current, request):
+        """Applies changed retry and dead letter policies to an existing
+        subscription, filters of existing subscriptions can not be changed
+        """
+        wanted = request.get('filter') or ''
+        actual = getattr(current, 'filter', None) or ''
+
+        if wanted != actual:
+            # Adding tags to a queue would otherwise deliver tagged tasks twice
+            message = (
+                f'Subscription {request["name"]} is filtered by {actual!r} instead of '
+                f'{wanted!r}. Filters can not be updated: drain and delete the '
+                f'subscription to have it created again'
+            )
+            logging.error(message)
+            raise QQUEUE_SUBSCRIPTION_FILTER_ERROR(message)
+
+        paths = [
+            field for field in ('retry_policy', 'dead_letter_policy')
+            if (request.get(field) or None) != (getattr(current, field, None) or None)
+        ]
+
+        if not paths:
+            return
+
+        subscriber.update_subscription(request={
+            'subscription': pubsub_v1.types.Subscription(**request),
+            'update_mask': {'paths': paths}
+        })
+
+        logging.info(f'Updated {", ".join(paths)} of {request["name"]}')
+
+    def __sanitize_tasks(self, tasks):
+        if not tasks:
+            raise QQUEUE_EMPTY_TASKS_ERROR
+
+        if isinstance(tasks, list):
+            if len(tasks) > QQUEUE_MAX_TASKS_LIMIT:
+                raise QQUEUE_TASKS_MAX_LIMIT_ERROR
+
+            if type(tasks[0]) is not Task:
+                raise QQUEUE_TASK_TYPE_ERROR
+        elif type(tasks) is not Task:
+            raise QQUEUE_TASK_TYPE_ERROR
+
+    def lease_tasks_by_tag(self, tag, lease_seconds=600, max_tasks=100, keep_lease=False):
+        """Lease tasks of a given tag
+        ...
+        Parameters
+        ----------
+        tag : str
+            One of the `tags` declared for the queue in queue.yaml,
+            its tasks are filtered server side
+        lease_seconds : int
+            Between 10 and 600
+        max_tasks : int
+            Maximum number of tasks to lease
+        keep_lease : bool
+            See `lease_tasks`
+
+        Returns
+        -------
+        A list of Task
+        """
+        try:
+            return self.__lease_shards(tag, lease_seconds, max_tasks, keep_lease)
+        except google.api_core.exceptions.NotFound:
+            raise QQUEUE_TAG_NOT_PROVISIONED_ERROR(tag)
+
+    def lease_tasks(self, lease_seconds=600, max_tasks=100, keep_lease=False):
+        """Lease tasks from queue
+        ...
+        Parameters
+        ----------
+        lease_seconds : int
+            Between 10 and 600
+        max_tasks : int
+            Maximum number of tasks to lease
+        keep_lease : bool
+            Let `lease_keeper` extend the leases in background until
+            the tasks are deleted. Use a short `lease_seconds` so that
+            tasks of a crashed worker are redelivered quickly
+
+        Returns
+        -------
+        A list of Task
+        """
+        return self.__lease_shards(None, lease_seconds, max_tasks, keep_lease)
+
+    def __lease_shards(self, tag, lease_seconds, max_tasks, keep_lease):
+        """Leases from every shard, starting from the next shard in turn.
+        Each shard is offered an even share of the tasks still wanted,
+        so that a busy shard can not starve the others
+        """
+        subscriber, _ = self.__get_subscriber()
+
+        start = next(_lease_cursors[self.queue_name]) if self.shards > 1 else 0
+        tasks = []
+        filled = []
+
+        for n in range(self.shards):
+            wanted = max_tasks - len(tasks)
+
+            if wanted <= 0:
+                break
+
+            shard = (start + n) % self.shards
+            source = subscriber.subscription_path(self.project_id, self._subscription_name(tag, shard))
+            share = -(-wanted // (self.shards - n))
 
-        with subscriber:
-            subscription = subscriber.create_subscription(
-                request=request
-            )
+            leased = self.__lease(subscriber, source, lease_seconds, share, keep_lease)
+            tasks.extend(leased)
 
-        logging.info(f'Queue default enduser: {subscription}')
+            if len(leased) == share:
+                filled.append(source)
 
-    def __sanitize_tasks(self, tasks):
-        if not tasks:
-            raise QQUEUE_EMPTY_TASKS_ERROR
+        # Shards which filled their share may hold more
+        for source in filled:
+            wanted = max_tasks - len(tasks)
 
-        if isinstance(tasks, list):
-            if len(tasks) > QQUEUE_MAX_TASKS_LIMIT:
-                raise QQUEUE_TASKS_MAX_LIMIT_ERROR
+            if wanted <= 0:
+                break
 
-            if type(tasks[0]) is not Task:
-                raise QQUEUE_TASK_TYPE_ERROR
-        elif type(tasks) is not Task:
-            raise QQUEUE_TASK_TYPE_ERROR
+            tasks.extend(self.__lease(subscriber, source, lease_seconds, wanted, keep_lease))
 
-    def lease_tasks_by_tag(self, lease_seconds=600, max_tasks=100):
-        pass
+        return tasks
 
-    def lease_tasks(self, lease_seconds=600, max_tasks=100):
-        subscriber, source = self.__get_subscriber()
+    def __lease(self, subscriber, source, lease_seconds, max_tasks, keep_lease=False):
+        started = time.monotonic()
 
-        with subscriber:
-            response = subscriber.pull(
-                subscription=source,
-                max_messages=max_tasks,
-                return_immediately=True,
-                retry=retry.Retry(deadline=300)
-            )
+        response = subscriber.pull(
+            subscription=source,
+            max_messages=max_tasks,
+            return_immediately=True,
+            retry=retry.Retry(deadline=300)
+        )
 
-            if not response.received_messages:
-                return []
+        if not response.received_messages:
+            return []
 
-            ack_ids = [received_message.ack_id for received_message in response.received_messages]
+        ack_ids = [received_message.ack_id for received_message in response.received_messages]
 
-            subscriber.modify_ack_deadline(
-                request={
-                    "subscription": source,
-                    "ack_ids": ack_ids,
-                    # Must be between 10 and 600.
-                    "ack_deadline_seconds": lease_seconds
-                }
-            )
+        subscriber.modify_ack_deadline(
+            request={
+                "subscription": source,
+                "ack_ids": ack_ids,
+                # Must be between 10 and 600.
+                "ack_deadline_seconds": lease_seconds
+            }
+        )
 
-        return list(map(
+        queue_counters.observe(self.queue_name, 'lease_latency', time.monotonic() - started)
+        queue_counters.increment(self.queue_name, leased=len(response.received_messages))
+
+        tasks = list(map(
             lambda x: Task.from_grpc_response(x), response.received_messages
         ))
 
+        for task in tasks:
+            # Ack ids are only valid on the subscription they come from
+            task.subscription = source
+
+        if keep_lease:
+            lease_keeper.hold(subscriber, source, tasks, lease_seconds)
+
+        return tasks
+
+    def consume(self,
+                callback,
+                max_outstanding_messages=QQUEUE_MAX_OUTSTANDING_MESSAGES,
+                max_outstanding_bytes=QQUEUE_MAX_OUTSTANDING_BYTES,
+                tag=None):
+        """Continuously delivers tasks to `callback` using streaming pull
+        ...
+        Parameters
+        ----------
+        callback : a callable
+            Called with each `Task`, from a pool of worker threads.
+            The task is acknowledged when it returns and redelivered
+            if it raises
+        max_outstanding_messages : int
+            Maximum number of tasks held by the consumer at once
+        max_outstanding_bytes : int
+            Maximum size of the messages held by the consumer at once
+        tag : str
+            Only consume the tasks of a tag declared in queue.yaml
+
+        The outstanding limits are shared evenly by the shards streams
+
+        Returns
+        -------
+        A running `QQueueConsumer`, call `stop()` to drain it
+        """
+        subscriber, _ = self.__get_subscriber()
+
+        flow_control = types.FlowControl(
+            max_messages=max(max_outstanding_messages // self.shards, 1),
+            max_bytes=max(max_outstanding_bytes // self.shards, 1)
+        )
+
+        consumer = QQueueConsumer(self.queue_name, callback)
+
+        for name in self._subscription_names(tag):
+            consumer._start(subscriber, subscriber.subscription_path(self.project_id, name), flow_control)
+
+        return consumer
+
     def add(self, tasks):
         futures = self.add_async(tasks)
 
@@ -270,64 +2124,630 @@ class QQueue(object):
         """
         self.__sanitize_tasks(tasks)
 
-        publisher, source = self.__get_publisher()
+        publisher, _ = self.__get_publisher()
 
         futures = []
 
         if isinstance(tasks, list):
             for tasks in tasks:
-                future = publisher.publish(
-                    source, tasks.to_pickle()
-                )
+                future = self.__publish(publisher, tasks)
                 futures.append(future)
 
         else:
-            futures = publisher.publish(
-                source, tasks.to_pickle()
-            )
+            futures = self.__publish(publisher, tasks)
 
         return futures
 
+    def __publish(self, publisher, task):
+        data, attributes = self.__encode_task(task)
+        source = publisher.topic_path(self.project_id, self._shard_name(self.__get_shard(task)))
+        started = time.monotonic()
+
+        ordering_key = getattr(task, 'ordering_key', None)
+
+        if self.ordering and ordering_key is not None:
+            ordering_key = str(ordering_key)
+            future = publisher.publish(
+                source, data, ordering_key=ordering_key, **attributes
+            )
+        else:
+            ordering_key = None
+            future = publisher.publish(
+                source, data, **attributes
+            )
+
+        def on_done(future):
+            queue_counters.observe(self.queue_name, 'publish_latency', time.monotonic() - started)
+
+            if future.exception():
+                queue_counters.increment(self.queue_name, publish_failed=1)
+
+                if ordering_key is not None:
+                    # Publishes of a key are paused after a failure,
+                    # the caller decides whether to publish it again
+                    publisher.resume_publish(source, ordering_key)
+            else:
+                queue_counters.increment(self.queue_name, published=1)
+
+        future.add_done_callback(on_done)
+
+        return future
+
+    def add_many(self, tasks, max_in_flight=QQUEUE_MAX_IN_FLIGHT):
+        """Add any number of tasks to queue
+        ...
+        Parameter
+        ---------
+        tasks : an iterable of Task
+            Consumed lazily, can be a generator
+        max_in_flight : int
+            Maximum number of publishes awaiting confirmation,
+            bounds the memory held by the publisher
+
+        Returns
+        -------
+        A `QQueueAddSummary` once every task is confirmed or failed
+        """
+        publisher, _ = self.__get_publisher()
+
+        summary = QQueueAddSummary()
+        window = threading.BoundedSemaphore(max_in_flight)
+        lock = threading.Lock()
+
+        def on_failure(index, error):
+            logging.error(f'{self.queue_name}: unable to publish task {index}: {error}')
+
+            with lock:
+                summary.failed += 1
+                summary.failed_indexes.append(index)
+
+        def on_done(index, future):
+            try:
+                future.result()
+            except Exception as e:
+                on_failure(index, e)
+            else:
+                with lock:
+                    summary.published += 1
+            finally:
+                window.release()
+
+        started = time.monotonic()
+
+        for index, task in enumerate(tasks):
+            if type(task) is not Task:
+                raise QQUEUE_TASK_TYPE_ERROR
+
+            window.acquire()
+            summary.total += 1
+
+            try:
+                future = self.__publish(publisher, task)
+            except Exception as e:
+                window.release()
+                on_failure(index, e)
+                continue
+
+            future.add_done_callback(functools.partial(on_done, index))
+
+        # Wait for the outstanding publishes
+        for _ in range(max_in_flight):
+            window.acquire()
+
+        summary.elapsed = time.monotonic() - started
+        summary.failed_indexes.sort()
+
+        return summary
+
+    def __encode_task(self, task):
+        """Returns the message data and attributes of a task"""
+        data = task.encode(self.codec)
+        attributes = {}
+
+        if task.tag is not None:
+            attributes[QQUEUE_TAG_ATTRIBUTE] = str(task.tag)
+
+        # Absent from tasks pickled by earlier versions
+        idempotency_key = getattr(task, 'idempotency_key', None)
+
+        if idempotency_key is not None:
+            attributes[QQUEUE_IDEMPOTENCY_ATTRIBUTE] = str(idempotency_key)
+
+        if self.compression and self.compression != 'none' and len(data) > self.compress_threshold:
+            compress, _ = get_task_compressor(self.compression)
+            compressed = compress(data)
+
+            if len(compressed) < len(data):
+                queue_counters.increment(
+                    self.queue_name,
+                    compressed_tasks=1,
+                    bytes_saved=len(data) - len(compressed)
+                )
+
+                attributes[QQUEUE_ENCODING_ATTRIBUTE] = self.compression
+                data = compressed
+
+        if self.offload_provider and self.offload_bucket and len(data) > self.offload_threshold:
+            attributes.update(self.__offload(data))
+
+            queue_counters.increment(
+                self.queue_name, offloaded_tasks=1, offloaded_bytes=len(data))
+
+            data = b''
+
+        queue_counters.increment(self.queue_name, published_bytes=len(data))
+
+        return data, attributes
+
+    def __offload(self, data):
+        """Stores a task body and returns the claim-check attributes"""
+        filename = f'qqueue/{self.queue_name}/{uuid.uuid4().hex}'
+
+        cloudstorage.upload_blob(
+            filename, io.BytesIO(data), bucket=self.offload_bucket, provider=self.offload_provider
+        )
+
+        return {
+            QQUEUE_CLAIM_ATTRIBUTE: filename,
+            QQUEUE_CLAIM_BUCKET_ATTRIBUTE: self.offload_bucket,
+            QQUEUE_CLAIM_PROVIDER_ATTRIBUTE: self.offload_provider
+        }
+
+    def __group_ack_ids(self, source, tasks):
+        """Returns the ack ids of tasks by subscription"""
+        ack_ids = {}
+
+        for task in tasks:
+            ack_ids.setdefault(getattr(task, 'subscription', None) or source, []).append(task.ack_id)
+
+        return ack_ids
+
     def modify_task_lease(self, tasks, lease_seconds=600):
         self.__sanitize_tasks(tasks)
         tasks = tasks if isinstance(tasks, list) else [tasks]
-        ack_ids = [task.ack_id for task in tasks]
 
         subscriber, source = self.__get_subscriber()
-        subscriber.modify_ack_deadline(
-            request={
-                "subscription": source,
-                "ack_ids": ack_ids,
-                # Must be between 10 and 600.
-                "ack_deadline_seconds": lease_seconds
-            }
-        )
+
+        if lease_seconds == 0:
+            # Returned to queue
+            lease_keeper.release(tasks)
+            queue_counters.increment(self.queue_name, nacked=len(tasks))
+
+        for subscription, ack_ids in self.__group_ack_ids(source, tasks).items():
+            subscriber.modify_ack_deadline(
+                request={
+                    "subscription": subscription,
+                    "ack_ids": ack_ids,
+                    # Must be between 10 and 600.
+                    "ack_deadline_seconds": lease_seconds
+                }
+            )
 
     def delete_tasks(self, tasks):
         self.__sanitize_tasks(tasks)
         subscriber, source = self.__get_subscriber()
 
         tasks = tasks if isinstance(tasks, list) else [tasks]
-        ack_ids = [task.ack_id for task in tasks]
+        lease_keeper.release(tasks)
 
-        subscriber.acknowledge(subscription=source, ack_ids=ack_ids)
+        for subscription, ack_ids in self.__group_ack_ids(source, tasks).items():
+            subscriber.acknowledge(subscription=subscription, ack_ids=ack_ids)
 
-    def delete_tasks_async(self):
-        pass
+        queue_counters.increment(self.queue_name, acked=len(tasks))
 
-    def purge(self):
-        pass
+        for task in tasks:
+            task.discard_claim()
+
+    def delete_tasks_async(self, tasks):
+        """Delete task(s) from queue without waiting for it
+        ...
+        Acknowledgements are buffered process-wide by `ack_coalescer`
+        and sent in bulk
+
+        Parameter
+        ---------
+        tasks : Task or list of Task
+
+        Returns
+        -------
+        A future which results to None once the tasks are deleted
+        """
+        self.__sanitize_tasks(tasks)
+        subscriber, source = self.__get_subscriber()
+
+        tasks = tasks if isinstance(tasks, list) else [tasks]
+        lease_keeper.release(tasks)
+
+        futures = [
+            ack_coalescer.acknowledge(subscriber, subscription, ack_ids)
+            for subscription, ack_ids in self.__group_ack_ids(source, tasks).items()
+        ]
+
+        future = futures[0] if len(futures) == 1 else _gather_futures(futures)
+
+        def discard_claims(future):
+            if not future.exception():
+                queue_counters.increment(self.queue_name, acked=len(tasks))
+
+                for task in tasks:
+                    task.discard_claim()
+
+        future.add_done_callback(discard_claims)
+
+        return future
+
+    def purge(self, before=None, snapshot=None):
+        """Discards the queue backlog server side, by seeking its
+        subscriptions (of every shard, including tag subscriptions)
+        ...
+        Parameters
+        ----------
+        before : datetime or float
+            Only discard tasks published before this time, as a datetime
+            or a UNIX timestamp (default is now)
+        snapshot : str
+            Name of a snapshot to restore instead, tasks acknowledged
+            after it was taken are delivered again
+
+        Returns
+        -------
+        A dict with the purged subscriptions and the seconds the seek took
+        """
+        subscriber, _ = self.__get_subscriber()
+
+        sources = [
+            subscriber.subscription_path(self.project_id, name)
+            for tag in [None] + list(self.settings.get('tags') or [])
+            for name in self._subscription_names(tag)
+        ]
+
+        if snapshot:
+            target = {'snapshot': subscriber.snapshot_path(self.project_id, snapshot)}
+        else:
+            if before is None:
+                before = datetime.datetime.now(tz=datetime.timezone.utc)
+            elif not isinstance(before, datetime.datetime):
+                before = datetime.datetime.fromtimestamp(before, tz=datetime.timezone.utc)
+
+            target = {'time': before}
+
+        started = time.monotonic()
+
+        for subscription in sources:
+            subscriber.seek(request=dict(target, subscription=subscription))
+
+        elapsed = time.monotonic() - started
+
+        logging.info(f'Purged {self.queue_name} ({len(sources)} subscription(s)) in {elapsed:.3f}s')
+
+        return {
+            'subscriptions': sources,
+            'elapsed': elapsed
+        }
 
     def fetch_statistics(self, deadline=None):
-        pass
+        """Returns the queue `QQueueStatistics`
+        ...
+        Parameters
+        ----------
+        deadline : float
+            Seconds to wait for the backend backlog figures
+        """
+        now = time.time()
+        counters = queue_counters.snapshot(self.queue_name)
+
+        with _statistics_lock:
+            cached = _statistics_cache.get(self.queue_name, {})
+
+        backlog = cached.get('backlog')
+
+        if backlog is None or now - backlog['fetched_at'] >= QQUEUE_STATISTICS_TTL:
+            try:
+                backlog = dict(backlog_provider(self, deadline) or {}, fetched_at=now)
+            except Exception as e:
+                logging.warning(f'Unable to fetch backlog of {self.queue_name}: {e}')
+                backlog = dict(backlog or {}, fetched_at=now)
+
+        rates = {}
+        previous = cached.get('counters')
+
+        if previous is not None and now > cached['at']:
+            elapsed = now - cached['at']
+            rates = {
+                'publish_rate': (counters.get('published', 0) - previous.get('published', 0)) / elapsed,
+                'ack_rate': (counters.get('acked', 0) - previous.get('acked', 0)) / elapsed
+            }
+
+        with _statistics_lock:
+            _statistics_cache[self.queue_name] = {
+                'backlog': backlog,
+                'counters': counters,
+                'at': now
+            }
+
+        return QQueueStatistics(
+            self.queue_name,
+            counters,
+            queue_counters.histograms(self.queue_name),
+            backlog=backlog,
+            rates=rates
+        )
+
+    def counters(self):
+        """Returns the process-wide counters of this queue"""
+        return queue_counters.snapshot(self.queue_name)
+
+    @staticmethod
+    def client_statistics():
+        """Returns the process-wide pubsub client pool counters"""
+        return client_registry.statistics()
+
+
+def _wrap_future(future, loop=None):
+    """Bridges a pubsub or concurrent future into an asyncio future,
+    without blocking a thread on it
+    """
+    loop = loop or asyncio.get_event_loop()
+    wrapped = loop.create_future()
+
+    def transfer(future):
+        if wrapped.cancelled():
+            return
+
+        error = future.exception()
+
+        if error is not None:
+            wrapped.set_exception(error)
+        else:
+            wrapped.set_result(future.result())
+
+    future.add_done_callback(lambda future: loop.call_soon_threadsafe(transfer, future))
+
+    return wrapped
+
+
+def _make_async_subscriber(queue):
+    return get_queue_backend(queue.backend).async_subscriber(queue)
+
+
+# asyncio channels are bound to their event loop: event loop -> clients
+_async_subscribers = weakref.WeakKeyDictionary()
+
+
+class AsyncQQueue(object):
+    """
+    asyncio version of `QQueue`
+
+    Publishes go through the pooled publisher and are awaited without
+    blocking a thread, subscriber calls use grpc.aio.
+
+        async for task in AsyncQQueue('data-pull'):
+            ...
+            await queue.delete_tasks(task)
+
+    ...
+
+    Attributes
+    ----------
+    queue : QQueue
+        The synchronous queue sharing settings and counters
+    """
+    def __init__(self, name, **kwargs):
+        self.queue = QQueue(name, **kwargs)
+        self.queue_name = self.queue.queue_name
+
+    def __get_subscriber(self):
+        clients = _async_subscribers.setdefault(asyncio.get_event_loop(), {})
+        key = (self.queue.backend, self.queue.project_id, os.environ.get('PUBSUB_EMULATOR_HOST'))
+
+        if key not in clients:
+            clients[key] = _make_async_subscriber(self.queue)
+
+        return clients[key]
+
+    async def add(self, tasks):
+        """Add task(s) to queue, see `QQueue.add`"""
+        futures = self.queue.add_async(tasks)
+
+        if isinstance(futures, list):
+            return list(await asyncio.gather(*[_wrap_future(x) for x in futures]))
+
+        return await _wrap_future(futures)
+
+    async def add_many(self, tasks, max_in_flight=QQUEUE_MAX_IN_FLIGHT):
+        """Add any number of tasks to queue, see `QQueue.add_many`
+
+        `tasks` can also be an asynchronous iterable
+        """
+        summary = QQueueAddSummary()
+        window = asyncio.Semaphore(max_in_flight)
+        pending = set()
+
+        async def publish(index, task):
+            try:
+                await _wrap_future(self.queue.add_async(task))
+                summary.published += 1
+            except Exception as e:
+                logging.error(f'{self.queue_name}: unable to publish task {index}: {e}')
+                summary.failed += 1
+                summary.failed_indexes.append(index)
+            finally:
+                window.release()
+
+        async def schedule(index, task):
+            if type(task) is not Task:
+                raise QQUEUE_TASK_TYPE_ERROR
+
+            await window.acquire()
+            summary.total += 1
+
+            future = asyncio.ensure_future(publish(index, task))
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+
+        started = time.monotonic()
+
+        if hasattr(tasks, '__aiter__'):
+            index = 0
+
+            async for task in tasks:
+                await schedule(index, task)
+                index += 1
+        else:
+            for index, task in enumerate(tasks):
+                await schedule(index, task)
+
+        if pending:
+            await asyncio.gather(*pending)
+
+        summary.elapsed = time.monotonic() - started
+        summary.failed_indexes.sort()
+
+        return summary
+
+    async def lease_tasks(self, lease_seconds=600, max_tasks=100, tag=None):
+        """Lease tasks from queue, or from one of its tags
+
+        Shards are pulled concurrently, `max_tasks` is split between them
+        """
+        shards = self.queue.shards
+        start = next(_lease_cursors[self.queue_name]) if shards > 1 else 0
+
+        results = await asyncio.gather(*[
+            self.__lease(lease_seconds, max_tasks // shards + (n < max_tasks % shards),
+                         tag, return_immediately=True, shard=(start + n) % shards)
+            for n in range(min(shards, max_tasks))
+        ])
+
+        return [task for tasks in results for task in tasks]
 
+    async def __lease(self, lease_seconds, max_tasks, tag, return_immediately, timeout=None, shard=0):
+        subscriber = self.__get_subscriber()
+        source = subscriber.subscription_path(
+            self.queue.project_id, self.queue._subscription_name(tag, shard))
 
+        started = time.monotonic()
 
+        response = await subscriber.pull(
+            request={
+                'subscription': source,
+                'max_messages': max_tasks,
+                'return_immediately': return_immediately
+            },
+            timeout=timeout
+        )
+
+        if not response.received_messages:
+            return []
+
+        await subscriber.modify_ack_deadline(
+            request={
+                'subscription': source,
+                'ack_ids': [x.ack_id for x in response.received_messages],
+                # Must be between 10 and 600.
+                'ack_deadline_seconds': lease_seconds
+            }
+        )
+
+        queue_counters.observe(self.queue_name, 'lease_latency', time.monotonic() - started)
+        queue_counters.increment(self.queue_name, leased=len(response.received_messages))
+
+        tasks = [Task.from_grpc_response(x) for x in response.received_messages]
+
+        for task in tasks:
+            task.subscription = source
+
+        return tasks
+
+    async def modify_task_lease(self, tasks, lease_seconds=600):
+        tasks = tasks if isinstance(tasks, list) else [tasks]
+
+        if not tasks:
+            raise QQUEUE_EMPTY_TASKS_ERROR
+
+        subscriber = self.__get_subscriber()
+        default = subscriber.subscription_path(self.queue.project_id, self.queue_name)
+        ack_ids = {}
+
+        for task in tasks:
+            ack_ids.setdefault(getattr(task, 'subscription', None) or default, []).append(task.ack_id)
+
+        if lease_seconds == 0:
+            lease_keeper.release(tasks)
+            queue_counters.increment(self.queue_name, nacked=len(tasks))
+
+        await asyncio.gather(*[
+            subscriber.modify_ack_deadline(
+                request={
+                    'subscription': subscription,
+                    'ack_ids': ids,
+                    'ack_deadline_seconds': lease_seconds
+                }
+            )
+            for subscription, ids in ack_ids.items()
+        ])
+
+    async def delete_tasks(self, tasks):
+        """Delete task(s), acknowledgements are batched by `ack_coalescer`"""
+        await _wrap_future(self.queue.delete_tasks_async(tasks))
+
+    async def consume(self, lease_seconds=60, max_tasks=100, tag=None, wait=30):
+        """Yields leased tasks as they arrive
+
+        Pulls wait up to `wait` seconds for tasks server side instead of
+        polling. Tasks must be deleted once processed.
 
+        Shards are pulled by one coroutine each, their tasks are yielded
+        in arrival order
+        """
+        if self.queue.shards == 1:
+            while True:
+                try:
+                    tasks = await self.__lease(
+                        lease_seconds, max_tasks, tag, return_immediately=False, timeout=wait)
+                except google.api_core.exceptions.DeadlineExceeded:
+                    continue
+
+                for task in tasks:
+                    yield task
+
+        # Bounded, a shard waits while the consumer is busy
+        arrived = asyncio.Queue(maxsize=max_tasks)
+        share = max(max_tasks // self.queue.shards, 1)
+
+        async def pull(shard):
+            while True:
+                try:
+                    tasks = await self.__lease(
+                        lease_seconds, share, tag, return_immediately=False, timeout=wait, shard=shard)
+                except google.api_core.exceptions.DeadlineExceeded:
+                    continue
+                except Exception as e:
+                    await arrived.put(e)
+                    return
+
+                for task in tasks:
+                    await arrived.put(task)
+
+        pulls = [asyncio.ensure_future(pull(shard)) for shard in range(self.queue.shards)]
+
+        try:
+            while True:
+                task = await arrived.get()
 
+                if isinstance(task, Exception):
+                    raise task
 
+                yield task
+        finally:
+            for future in pulls:
+                future.cancel()
 
+    def __aiter__(self):
+        return self.consume()
 
+    def fetch_statistics(self, deadline=None):
+        return self.queue.fetch_statistics(deadline=deadline)
 
 
 if __name__ == "__main__":
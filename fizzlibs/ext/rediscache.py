@@ -1,57 +1,896 @@
 import os
 import json
+import math
+import time
+import uuid
+import zlib
 import redis
+import pickle
+import random
+import hashlib
+import logging
+import datetime
+import functools
+import threading
+import collections
 
 
 class RADIS_AUTHENTICATION_ERROR(Exception):
     pass
 
 
-def __get_radis__():
-    if not all([os.environ.get('REDIS_SERVICE_HOST'), os.environ.get('REDIS_SERVICE_PORT')]):
+class RADIS_SERIALIZER_ERROR(Exception):
+    pass
+
+
+# Connections shared by the clients of the process. Socket timeouts
+# are unset by default, blocking commands wait longer than any default
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+# Seconds a command waits for a connection of a saturated pool, before
+# raising `redis.ConnectionError`
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 20))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get('REDIS_SOCKET_CONNECT_TIMEOUT', 5))
+REDIS_SOCKET_TIMEOUT = float(os.environ['REDIS_SOCKET_TIMEOUT']) if os.environ.get('REDIS_SOCKET_TIMEOUT') else None
+REDIS_SOCKET_KEEPALIVE = os.environ.get('REDIS_SOCKET_KEEPALIVE', 'on') == 'on'
+# Seconds a connection can stay idle before it is checked on use
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+# Optional in-process layer in front of Redis, see `NearCache`
+REDIS_NEAR_CACHE = os.environ.get('REDIS_NEAR_CACHE', 'off') == 'on'
+REDIS_NEAR_CACHE_ENTRIES = int(os.environ.get('REDIS_NEAR_CACHE_ENTRIES', 1024))
+REDIS_NEAR_CACHE_BYTES = int(os.environ.get('REDIS_NEAR_CACHE_BYTES', 16 * 1024 * 1024))
+REDIS_NEAR_CACHE_TTL = float(os.environ.get('REDIS_NEAR_CACHE_TTL', 5))
+# Keys per round trip of the *_multi functions
+REDIS_MULTI_CHUNK = int(os.environ.get('REDIS_MULTI_CHUNK', 500))
+
+# Value format: MAGIC | SERIALIZER ID | COMPRESSOR ID (0 for none) | body
+# The magic byte can not start a JSON text, which tells framed values
+# apart from the plain JSON ones written by earlier versions
+REDIS_CACHE_MAGIC = b'\xfc'
+REDIS_CACHE_SERIALIZER = os.environ.get('REDIS_CACHE_SERIALIZER', 'json')
+# Values larger than the threshold (in bytes) are compressed
+REDIS_CACHE_COMPRESS_THRESHOLD = int(os.environ.get('REDIS_CACHE_COMPRESS_THRESHOLD', 4 * 1024))
+REDIS_CACHE_COMPRESSION = os.environ.get('REDIS_CACHE_COMPRESSION', 'zlib')
+
+# `memoize` defaults: seconds a result is fresh, seconds a recompute
+# holds its lock, and poll interval of the workers waiting for it
+REDIS_MEMOIZE_TTL = 60
+REDIS_MEMOIZE_LOCK_TIMEOUT = 10
+REDIS_MEMOIZE_POLL_INTERVAL = 0.05
+
+# Releases a lock only if it is still held by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+
+return 0
+"""
+
+_pool = None
+# Address and process of the pool, rebuilt when either changes
+_pool_key = None
+_pool_lock = threading.Lock()
+
+_near_cache = None
+_near_cache_lock = threading.Lock()
+
+# Reads served by Redis, the near cache counts its own
+_counters = {
+    'redis_hits': 0, 'redis_misses': 0,
+    'memoize_hits': 0, 'memoize_misses': 0, 'memoize_refreshes': 0, 'memoize_stale': 0
+}
+_counters_lock = threading.Lock()
+
+
+class _CountingConnectionPool(redis.BlockingConnectionPool):
+    """Blocking pool counting its connections through the public pool
+    methods, for `pool_statistics`
+    """
+    def __init__(self, **kwargs):
+        self._stats_lock = threading.Lock()
+        self._created = 0
+        # `set` is shadowed by the module function
+        self._checked_out = {}
+
+        super().__init__(**kwargs)
+
+    def make_connection(self):
+        connection = super().make_connection()
+
+        with self._stats_lock:
+            self._created += 1
+
+        return connection
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+
+        with self._stats_lock:
+            self._checked_out[id(connection)] = True
+
+        return connection
+
+    def release(self, connection):
+        with self._stats_lock:
+            self._checked_out.pop(id(connection), None)
+
+        super().release(connection)
+
+    def statistics(self):
+        with self._stats_lock:
+            return {
+                'max_connections': self.max_connections,
+                'created': self._created,
+                'in_use': len(self._checked_out),
+                'available': self._created - len(self._checked_out)
+            }
+
+
+def __get_pool__():
+    global _pool, _pool_key
+
+    address = (os.environ.get('REDIS_SERVICE_HOST'), os.environ.get('REDIS_SERVICE_PORT'))
+
+    if not all(address):
         raise RADIS_AUTHENTICATION_ERROR
 
-    return redis.Redis(
-            host=os.environ.get('REDIS_SERVICE_HOST'),
-            port=os.environ.get('REDIS_SERVICE_PORT'),
-            db=0
-        )
+    key = (address, os.getpid())
+
+    if _pool_key == key:
+        return _pool
+
+    with _pool_lock:
+        if _pool_key != key:
+            # Connections inherited from a parent process are left to it.
+            # Commands wait for a connection of a saturated pool, rather
+            # than failing as soon as it is exhausted
+            _pool = _CountingConnectionPool(
+                host=address[0],
+                port=address[1],
+                db=0,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                timeout=REDIS_POOL_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_keepalive=REDIS_SOCKET_KEEPALIVE,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL
+            )
+            _pool_key = key
+
+        return _pool
+
+
+def __get_radis__():
+    return redis.Redis(connection_pool=__get_pool__())
+
+
+def pool_statistics():
+    """Connections of the pool of this process: created, in use and idle"""
+    pool = _pool if _pool_key and _pool_key[1] == os.getpid() else None
+
+    if pool is None:
+        return {'max_connections': REDIS_MAX_CONNECTIONS, 'created': 0, 'in_use': 0, 'available': 0}
+
+    return pool.statistics()
+
+
+def __invalidation_channel__():
+    suffix = os.environ.get('GKE_SOFTWARE_ID')
+
+    return f'{suffix}-fizzlibs:cache:invalidate' if suffix else 'fizzlibs:cache:invalidate'
+
+
+class NearCache(object):
+    """
+    In-process LRU of decoded values in front of Redis
+
+    Entries are bounded in number and in bytes (of their Redis value),
+    and live `ttl` seconds at most, never past their Redis TTL. `set`
+    and `delete` publish the keys they change on a Redis channel, which
+    a listener thread of each process evicts.
+
+    Values are only served while the listener is subscribed, and are
+    not stored when an invalidation arrives during their read, so that
+    they are never staler than Redis. Values are shared by the readers
+    of the process, do not mutate them.
+
+    Enable it with REDIS_NEAR_CACHE=on, every process writing the keys
+    must use `rediscache.set` and `rediscache.delete`
+
+    ...
+
+    Attributes
+    ----------
+    stats : dict
+        Local hits, misses, evictions and invalidations
+    """
+    def __init__(self, max_entries=REDIS_NEAR_CACHE_ENTRIES,
+                 max_bytes=REDIS_NEAR_CACHE_BYTES, ttl=REDIS_NEAR_CACHE_TTL, channel=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.channel = channel or __invalidation_channel__()
+        self.stats = {'local_hits': 0, 'local_misses': 0, 'evictions': 0, 'invalidations': 0}
+
+        # key -> (value, size, expiry)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        # Incremented by invalidations, reads started before are not stored
+        self._epoch = 0
+        self._listening = False
+
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __remove(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def get(self, key):
+        """Returns (found, value)"""
+        with self._lock:
+            entry = self._entries.get(key) if self._listening else None
+
+            if entry is None or entry[2] <= time.monotonic():
+                if entry is not None:
+                    self.__remove(key)
+
+                self.stats['local_misses'] += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.stats['local_hits'] += 1
+
+            return True, entry[0]
+
+    def put(self, key, value, size, ttl, epoch):
+        """Stores a value read from Redis when the `epoch` was current"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+
+        with self._lock:
+            if epoch != self._epoch or not self._listening or size > self.max_bytes or ttl <= 0:
+                return
+
+            self.__remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.stats['evictions'] += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._epoch += 1
+
+            for key in keys:
+                self.__remove(key)
+
+            self.stats['invalidations'] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def start(self):
+        """Listens to invalidations from a background thread"""
+        self._thread = threading.Thread(
+            target=self.__run, name='fizzlibs-near-cache', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+        if self._thread:
+            self._thread.join()
+
+    def __run(self):
+        while not self._stopping.is_set():
+            pubsub = None
+
+            try:
+                pubsub = __get_radis__().pubsub()
+                pubsub.subscribe(self.channel)
+
+                while not self._stopping.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+
+                    if message is None:
+                        continue
+
+                    if message['type'] == 'subscribe':
+                        # Invalidations may have been missed until now
+                        with self._lock:
+                            self._entries.clear()
+                            self._bytes = 0
+                            self._epoch += 1
+                            self._listening = True
+                    elif message['type'] == 'message':
+                        self.invalidate(json.loads(message['data']))
+            except Exception as e:
+                logging.warning(f'Near cache invalidations interrupted: {e}')
+                self._stopping.wait(1)
+            finally:
+                with self._lock:
+                    self._listening = False
+                    self._entries.clear()
+                    self._bytes = 0
+
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+
+def __get_near_cache__():
+    """The near cache of this process, None unless REDIS_NEAR_CACHE is on"""
+    global _near_cache
+
+    if not REDIS_NEAR_CACHE:
+        return None
+
+    near_cache = _near_cache
+
+    if near_cache is not None and near_cache._pid == os.getpid():
+        return near_cache
+
+    with _near_cache_lock:
+        if _near_cache is None or _near_cache._pid != os.getpid():
+            # The listener thread is not inherited by forked children
+            _near_cache = NearCache()
+            _near_cache.start()
+
+        return _near_cache
+
+
+def cache_statistics():
+    """Hits and misses of each tier, near cache evictions and
+    `memoize` outcomes
+    """
+    with _counters_lock:
+        stats = dict(_counters)
+
+    near_cache = _near_cache
+
+    if near_cache is not None:
+        stats.update(near_cache.stats)
+        stats['local_entries'] = len(near_cache)
+
+    return stats
+
+
+def __count__(name, count=1):
+    with _counters_lock:
+        _counters[name] += count
+
+
+def __invalidate__(keys):
+    """Evicts keys changed by this process, once Redis has them"""
+    near_cache = __get_near_cache__()
+
+    if near_cache is not None:
+        near_cache.invalidate(keys)
 
 
 def __sanitize_key__(key):
     suffix = os.environ.get('GKE_SOFTWARE_ID')
 
     if suffix:
-        return f'{suffix}-key'
+        return f'{suffix}-{key}'
 
     return key
 
 
-def set(key, value, **kwargs):
-    key = __sanitize_key__(key)
-    value = json.dumps(value) if value else value
+class CacheSerializer(object):
+    """
+    Base class of cache value serializers
+
+    ...
+
+    Attributes
+    ----------
+    name : str
+        Name used to select the serializer
+    serializer_id : int
+        Identifier written in the value header, between 1 and 255
+    """
+    name = None
+    serializer_id = None
+
+    def dumps(self, value):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class JsonCacheSerializer(CacheSerializer):
+    """Values made of JSON types only"""
+    name = 'json'
+    serializer_id = 1
+
+    def dumps(self, value):
+        try:
+            return json.dumps(value, separators=(',', ':')).encode('utf-8')
+        except TypeError as e:
+            raise RADIS_SERIALIZER_ERROR(e)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+_MSGPACK_DATETIME = 1
+_MSGPACK_DATE = 2
+
+
+def _msgpack_default(value):
+    import msgpack
+
+    if isinstance(value, datetime.datetime):
+        return msgpack.ExtType(_MSGPACK_DATETIME, value.isoformat().encode('utf-8'))
+
+    if isinstance(value, datetime.date):
+        return msgpack.ExtType(_MSGPACK_DATE, value.isoformat().encode('utf-8'))
+
+    raise TypeError(f'Can not serialize {type(value).__name__}')
+
+
+def _msgpack_ext_hook(code, data):
+    import msgpack
+
+    if code == _MSGPACK_DATETIME:
+        return datetime.datetime.fromisoformat(data.decode('utf-8'))
+
+    if code == _MSGPACK_DATE:
+        return datetime.date.fromisoformat(data.decode('utf-8'))
+
+    return msgpack.ExtType(code, data)
+
+
+class MsgpackCacheSerializer(CacheSerializer):
+    """Compact binary encoding of JSON types, bytes, dates and
+    datetimes, tuples are loaded as lists. Requires `msgpack`
+    """
+    name = 'msgpack'
+    serializer_id = 2
+
+    def dumps(self, value):
+        import msgpack
+
+        try:
+            return msgpack.packb(value, use_bin_type=True, default=_msgpack_default)
+        except TypeError as e:
+            raise RADIS_SERIALIZER_ERROR(e)
+
+    def loads(self, data):
+        import msgpack
+
+        return msgpack.unpackb(data, raw=False, ext_hook=_msgpack_ext_hook)
+
+
+class PickleCacheSerializer(CacheSerializer):
+    """Any picklable value, only load values written by trusted code"""
+    name = 'pickle'
+    serializer_id = 3
+
+    def dumps(self, value):
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+CACHE_SERIALIZERS = {}
+_CACHE_SERIALIZER_IDS = {}
+
+
+def register_cache_serializer(serializer):
+    """Makes a `CacheSerializer` available by name and by header identifier"""
+    if not 0 < serializer.serializer_id < 256:
+        raise RADIS_SERIALIZER_ERROR(f'Invalid serializer id {serializer.serializer_id}')
+
+    CACHE_SERIALIZERS[serializer.name] = serializer
+    _CACHE_SERIALIZER_IDS[serializer.serializer_id] = serializer
+
+
+def get_cache_serializer(key):
+    """Returns a registered `CacheSerializer` by name or header identifier"""
+    serializers = _CACHE_SERIALIZER_IDS if isinstance(key, int) else CACHE_SERIALIZERS
+
+    try:
+        return serializers[key]
+    except KeyError:
+        raise RADIS_SERIALIZER_ERROR(f'Unknown cache serializer: {key}')
+
+
+register_cache_serializer(JsonCacheSerializer())
+register_cache_serializer(MsgpackCacheSerializer())
+register_cache_serializer(PickleCacheSerializer())
+
+
+CACHE_COMPRESSORS = {}
+_CACHE_COMPRESSOR_IDS = {}
+
+
+def register_cache_compressor(name, compressor_id, compress, decompress):
+    """Makes a compressor available to cache writes and reads
+
+    Parameters
+    ----------
+    name : str
+        Name used to select the compressor
+    compressor_id : int
+        Identifier written in the value header, between 1 and 255
+    compress : a callable
+        Takes and returns bytes
+    decompress : a callable
+        Reverse of `compress`
+    """
+    if not 0 < compressor_id < 256:
+        raise RADIS_SERIALIZER_ERROR(f'Invalid compressor id {compressor_id}')
+
+    CACHE_COMPRESSORS[name] = (compressor_id, compress, decompress)
+    _CACHE_COMPRESSOR_IDS[compressor_id] = (compressor_id, compress, decompress)
+
+
+def get_cache_compressor(key):
+    """Returns (id, compress, decompress) by name or header identifier"""
+    compressors = _CACHE_COMPRESSOR_IDS if isinstance(key, int) else CACHE_COMPRESSORS
+
+    try:
+        return compressors[key]
+    except KeyError:
+        raise RADIS_SERIALIZER_ERROR(f'Unknown cache compressor: {key}')
+
+
+register_cache_compressor('zlib', 1, lambda data: zlib.compress(data, 6), zlib.decompress)
+
+
+def __encode__(value, serializer=None):
+    serializer = get_cache_serializer(serializer or REDIS_CACHE_SERIALIZER)
+    data = serializer.dumps(value)
+    compressor_id = 0
+
+    if REDIS_CACHE_COMPRESSION != 'none' and len(data) > REDIS_CACHE_COMPRESS_THRESHOLD:
+        candidate, compress, _ = get_cache_compressor(REDIS_CACHE_COMPRESSION)
+        compressed = compress(data)
+
+        if len(compressed) < len(data):
+            compressor_id = candidate
+            data = compressed
+
+    return REDIS_CACHE_MAGIC + bytes((serializer.serializer_id, compressor_id)) + data
+
+
+def __decode__(raw):
+    if raw is None:
+        return None
+
+    if not raw.startswith(REDIS_CACHE_MAGIC):
+        # Written by an earlier version, falsy values were stored as is
+        return json.loads(raw) if raw else raw
+
+    data = raw[3:]
+
+    if raw[2]:
+        _, _, decompress = get_cache_compressor(raw[2])
+        data = decompress(data)
+
+    return get_cache_serializer(raw[1]).loads(data)
+
+
+def __chunks__(items):
+    for start in range(0, len(items), REDIS_MULTI_CHUNK):
+        yield items[start:start + REDIS_MULTI_CHUNK]
+
+
+def __read__(keys):
+    """Values of sanitized keys, None when missing. Keys absent from
+    the near cache are read in one round trip per chunk
+    """
+    near_cache = __get_near_cache__()
+    values = [None] * len(keys)
+
+    if near_cache is None:
+        missing = list(range(len(keys)))
+    else:
+        missing = []
+
+        for index, key in enumerate(keys):
+            found, value = near_cache.get(key)
+
+            if found:
+                values[index] = value
+            else:
+                missing.append(index)
+
+    if not missing:
+        return values
 
     r = __get_radis__()
-    r.set(key, value)
 
-    if kwargs.get('time'):
-        r.expire(key, **kwargs)
+    for chunk in __chunks__(missing):
+        chunk_keys = [keys[index] for index in chunk]
 
+        if near_cache is None:
+            raws = r.mget(chunk_keys)
+        else:
+            epoch = near_cache.epoch
 
-def get(key):
-    key = __sanitize_key__(key)
-    value = __get_radis__().get(key)
+            with r.pipeline(transaction=False) as pipe:
+                pipe.mget(chunk_keys)
+
+                for key in chunk_keys:
+                    pipe.pttl(key)
+
+                raws, *pttls = pipe.execute()
+
+        hits = 0
 
-    if value:
-        return json.loads(value)
+        for position, (index, raw) in enumerate(zip(chunk, raws)):
+            value = __decode__(raw)
+            values[index] = value
+
+            if raw is not None:
+                hits += 1
+
+            if near_cache is not None:
+                pttl = pttls[position]
+                near_cache.put(
+                    keys[index], value, len(raw) if raw else 0,
+                    pttl / 1000 if pttl >= 0 else None, epoch
+                )
+
+        __count__('redis_hits', hits)
+        __count__('redis_misses', len(chunk) - hits)
+
+    return values
+
+
+def set_multi(mapping, **kwargs):
+    """Sets every key of `mapping`, with the TTL given by `time`,
+    in one round trip per chunk of keys. Values are written with the
+    `serializer` given by name (default is REDIS_CACHE_SERIALIZER)
+    """
+    serializer = kwargs.get('serializer')
+    items = [
+        (__sanitize_key__(key), __encode__(value, serializer)) for key, value in mapping.items()
+    ]
+    r = __get_radis__()
 
-    return value
+    for chunk in __chunks__(items):
+        # Values, TTLs and invalidation in one round trip
+        with r.pipeline(transaction=False) as pipe:
+            for key, value in chunk:
+                pipe.set(key, value, ex=kwargs.get('time') or None)
+
+            pipe.publish(__invalidation_channel__(), json.dumps([key for key, _ in chunk]))
+            pipe.execute()
+
+        __invalidate__([key for key, _ in chunk])
+
+
+def get_multi(keys):
+    """Values of `keys`, as a dict of the keys found"""
+    keys = list(keys)
+    values = __read__([__sanitize_key__(key) for key in keys])
+
+    return {key: value for key, value in zip(keys, values) if value is not None}
+
+
+def delete_multi(keys):
+    """Deletes `keys`, returns the number of keys deleted"""
+    keys = [__sanitize_key__(key) for key in keys]
+    r = __get_radis__()
+    deleted = 0
+
+    for chunk in __chunks__(keys):
+        with r.pipeline(transaction=False) as pipe:
+            pipe.delete(*chunk)
+            pipe.publish(__invalidation_channel__(), json.dumps(chunk))
+            count, _ = pipe.execute()
+
+        __invalidate__(chunk)
+        deleted += count
+
+    return deleted
+
+
+def set(key, value, **kwargs):
+    set_multi({key: value}, **kwargs)
+
+
+def get(key):
+    return __read__([__sanitize_key__(key)])[0]
 
 
 def delete(key):
-    key = __sanitize_key__(key)
-    return __get_radis__().delete(key)
+    return delete_multi([key])
+
+
+def __memoize_key__(prefix, args, kwargs):
+    """Stable key of a call, arguments must be JSON types or have a
+    stable repr
+    """
+    arguments = json.dumps([args, kwargs], sort_keys=True, default=repr)
+
+    return f'memoize:{prefix}:{hashlib.sha1(arguments.encode("utf-8")).hexdigest()}'
+
+
+def __acquire_lock__(key, timeout):
+    """Returns the token of the acquired lock, None when it is held"""
+    token = uuid.uuid4().hex
+
+    if __get_radis__().set(__sanitize_key__(f'{key}:lock'), token, nx=True, px=int(timeout * 1000)):
+        return token
+
+    return None
+
+
+def __release_lock__(key, token):
+    r = __get_radis__()
+    r.register_script(RELEASE_LOCK_SCRIPT)(keys=[__sanitize_key__(f'{key}:lock')], args=[token])
+
+
+def memoize(ttl=REDIS_MEMOIZE_TTL, key=None, stale_ttl=0, beta=1.0,
+            lock_timeout=REDIS_MEMOIZE_LOCK_TIMEOUT, serializer=None):
+    """
+    Caches the results of a function in Redis
+
+    Concurrent misses are computed once: the first worker takes a short
+    Redis lock, the others wait for its result. Results are refreshed
+    before their expiry with a probability growing as it nears, and
+    weighted by the time they took to compute (XFetch), so that hot
+    keys are refreshed by a single worker before they expire.
+
+        @rediscache.memoize(ttl=300, stale_ttl=60)
+        def report(account_id):
+            ...
+
+    Without Redis, the function is called on every call.
+
+    ...
+
+    Parameters
+    ----------
+    ttl : int
+        Seconds a result is fresh
+    key : str or a callable
+        Prefix of the keys (default is the module and name of the
+        function), or a callable building the key from the arguments
+    stale_ttl : int
+        Seconds an expired result is still served while one worker
+        computes it again
+    beta : float
+        Eagerness of the early refresh, 0 disables it
+    lock_timeout : int
+        Seconds a worker holds the computation of a key
+    serializer : str
+        Name of the `CacheSerializer` of the results
+
+    The decorated function has `key(*args, **kwargs)` and
+    `invalidate(*args, **kwargs)` attributes
+    """
+    # Raised by Redis, or by the serializer of the results
+    errors = (RADIS_AUTHENTICATION_ERROR, RADIS_SERIALIZER_ERROR, redis.RedisError)
+
+    def decorator(func):
+        prefix = key if isinstance(key, str) else f'{func.__module__}.{func.__qualname__}'
+
+        def build_key(*args, **kwargs):
+            if callable(key):
+                return key(*args, **kwargs)
+
+            return __memoize_key__(prefix, args, kwargs)
+
+        def compute(cache_key, args, kwargs):
+            started = time.time()
+            value = func(*args, **kwargs)
+            now = time.time()
+
+            try:
+                # [value, seconds to compute, expiry], kept for the stale window
+                set(cache_key, [value, now - started, now + ttl],
+                    time=int(math.ceil(ttl + stale_ttl)), serializer=serializer)
+            except errors as e:
+                logging.warning(f'Memoized {prefix} not cached: {e}')
+
+            return value
+
+        def compute_locked(cache_key, token, args, kwargs):
+            try:
+                return compute(cache_key, args, kwargs)
+            finally:
+                try:
+                    __release_lock__(cache_key, token)
+                except errors as e:
+                    # Expires after `lock_timeout`
+                    logging.warning(f'Memoized {prefix} lock not released: {e}')
+
+        def wait(cache_key, args, kwargs):
+            """Waits for the worker computing the key, computes it
+            if the lock expires first
+            """
+            deadline = time.monotonic() + lock_timeout
+
+            while time.monotonic() < deadline:
+                time.sleep(REDIS_MEMOIZE_POLL_INTERVAL)
+
+                try:
+                    entry = get(cache_key)
+                    token = __acquire_lock__(cache_key, lock_timeout) if entry is None else None
+                except errors as e:
+                    logging.warning(f'Memoized {prefix} not cached: {e}')
+                    return func(*args, **kwargs)
+
+                if entry is not None:
+                    return entry[0]
+
+                if token:
+                    return compute_locked(cache_key, token, args, kwargs)
+
+            return compute(cache_key, args, kwargs)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = build_key(*args, **kwargs)
+
+            try:
+                entry = get(cache_key)
+                now = time.time()
+
+                # [value, seconds to compute, expiry], refreshed early
+                # with XFetch, log of (0, 1] is negative
+                fresh = entry is not None and now - entry[1] * beta * math.log(1 - random.random()) < entry[2]
+                token = None if fresh else __acquire_lock__(cache_key, lock_timeout)
+            except errors as e:
+                logging.warning(f'Memoized {prefix} not cached: {e}')
+                return func(*args, **kwargs)
+
+            if fresh:
+                __count__('memoize_hits')
+                return entry[0]
+
+            if entry is None:
+                __count__('memoize_misses')
+            elif token:
+                __count__('memoize_refreshes')
+            elif now >= entry[2]:
+                __count__('memoize_stale')
+            else:
+                __count__('memoize_hits')
+
+            if token:
+                return compute_locked(cache_key, token, args, kwargs)
+
+            if entry is None:
+                return wait(cache_key, args, kwargs)
+
+            # Computed by another worker meanwhile
+            return entry[0]
+
+        wrapper.key = build_key
+        wrapper.invalidate = lambda *args, **kwargs: delete(build_key(*args, **kwargs))
+
+        return wrapper
 
+    return decorator
 
 
 if __name__ == "__main__":
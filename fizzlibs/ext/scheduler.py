@@ -0,0 +1,266 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import rediscache
+
+
+SCHEDULER_BATCH_SIZE = 500
+# Claimed tasks not published within this delay are scheduled again
+SCHEDULER_VISIBILITY_TIMEOUT = 60
+# Longest sleep between two checks of the next due time
+SCHEDULER_MAX_IDLE = 30
+
+# Moves due tasks to the in-flight set and returns them
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local result = {}
+
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+
+    result[#result + 1] = id
+    result[#result + 1] = redis.call('HGET', KEYS[3], id)
+end
+
+return result
+"""
+
+# Schedules again the claimed tasks which were never published
+RECOVER_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], ARGV[1], id)
+end
+
+return #ids
+"""
+
+
+class DelayScheduler(object):
+    """
+    Publishes deferred tasks once their countdown is over
+
+    Pending tasks are kept in Redis: a sorted set of task ids scored by
+    due time, and a hash of task bodies. Scheduling is a single ZADD,
+    O(log n). Any number of processes can run the scheduler loop, due
+    tasks are claimed atomically in batches and published with
+    `QQueue.add_async`. The loop sleeps until the next due time, and is
+    woken up when an earlier task is scheduled.
+
+    ...
+
+    Attributes
+    ----------
+    prefix : str
+        Prefix of the Redis keys
+    stats : dict
+        Number of tasks scheduled, published and failed by this process
+    """
+    def __init__(self, prefix=None, batch_size=SCHEDULER_BATCH_SIZE,
+                 visibility_timeout=SCHEDULER_VISIBILITY_TIMEOUT,
+                 max_idle=SCHEDULER_MAX_IDLE):
+        if prefix is None:
+            suffix = os.environ.get('GKE_SOFTWARE_ID')
+            prefix = f'{suffix}-fizzlibs:delayed' if suffix else 'fizzlibs:delayed'
+
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.visibility_timeout = visibility_timeout
+        self.max_idle = max_idle
+        self.stats = {'scheduled': 0, 'published': 0, 'failed': 0}
+
+        self.due_key = f'{prefix}:due'
+        self.inflight_key = f'{prefix}:inflight'
+        self.tasks_key = f'{prefix}:tasks'
+        self.wakeup_key = f'{prefix}:wakeup'
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+
+    def schedule(self, queue_name, task, countdown):
+        """Publishes `task` to `queue_name` in `countdown` seconds
+
+        Returns
+        -------
+        Id of the scheduled task
+        """
+        task_id = uuid.uuid4().hex
+        due = time.time() + countdown
+        data = queue_name.encode('utf-8') + b'\0' + task.encode()
+
+        r = rediscache.__get_radis__()
+
+        with r.pipeline(transaction=True) as pipe:
+            pipe.hset(self.tasks_key, task_id, data)
+            pipe.zadd(self.due_key, {task_id: due})
+            pipe.zrange(self.due_key, 0, 0)
+            _, _, head = pipe.execute()
+
+        if head and head[0].decode('utf-8') == task_id:
+            # New earliest task, wake a sleeping scheduler up
+            with r.pipeline(transaction=False) as pipe:
+                pipe.lpush(self.wakeup_key, 1)
+                pipe.ltrim(self.wakeup_key, 0, 0)
+                pipe.execute()
+
+        with self._lock:
+            self.stats['scheduled'] += 1
+
+        return task_id
+
+    def cancel(self, task_id):
+        """Cancels a task which is not due yet"""
+        r = rediscache.__get_radis__()
+
+        with r.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.due_key, task_id)
+            pipe.hdel(self.tasks_key, task_id)
+            removed, _ = pipe.execute()
+
+        return bool(removed)
+
+    def pending(self):
+        """Number of tasks waiting for their due time"""
+        return rediscache.__get_radis__().zcard(self.due_key)
+
+    def run_once(self):
+        """Publishes due tasks, one batch per queue
+
+        Returns
+        -------
+        Number of tasks published
+        """
+        r = rediscache.__get_radis__()
+        now = time.time()
+
+        r.register_script(RECOVER_SCRIPT)(
+            keys=[self.due_key, self.inflight_key],
+            args=[now, self.batch_size]
+        )
+
+        claimed = r.register_script(CLAIM_SCRIPT)(
+            keys=[self.due_key, self.inflight_key, self.tasks_key],
+            args=[now, self.batch_size, now + self.visibility_timeout]
+        )
+
+        if not claimed:
+            return 0
+
+        queues = {}
+        # Orphans and undecodable tasks, removed without being published
+        dropped = []
+
+        for task_id, item in zip(claimed[0::2], claimed[1::2]):
+            if item is None:
+                dropped.append(task_id)
+                continue
+
+            try:
+                queue_name, data = item.split(b'\0', 1)
+                task = qqueue.Task.decode(data)
+            except Exception as e:
+                # Would fail again on every recovery, and block its batch
+                logging.error(f'Dropping undecodable delayed task {task_id}: {e}')
+                dropped.append(task_id)
+                continue
+
+            queues.setdefault(queue_name.decode('utf-8'), []).append((task_id, task))
+
+        published = list(dropped)
+
+        for queue_name, items in queues.items():
+            published.extend(self.__publish(queue_name, items))
+
+        if published:
+            with r.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.inflight_key, *published)
+                pipe.hdel(self.tasks_key, *published)
+                pipe.execute()
+
+        return len(published) - len(dropped)
+
+    def __publish(self, queue_name, items):
+        queue = qqueue.QQueue(queue_name)
+        futures = [(task_id, queue.add_async(task)) for task_id, task in items]
+        published = []
+
+        for task_id, future in futures:
+            try:
+                future.result()
+                published.append(task_id)
+            except Exception as e:
+                # Left in flight, scheduled again after the visibility timeout
+                logging.error(f'Unable to publish delayed task {task_id} to {queue_name}: {e}')
+
+        with self._lock:
+            self.stats['published'] += len(published)
+            self.stats['failed'] += len(items) - len(published)
+
+        return published
+
+    def next_wakeup(self):
+        """Seconds until the next task is due, bounded by `max_idle`"""
+        head = rediscache.__get_radis__().zrange(self.due_key, 0, 0, withscores=True)
+
+        if not head:
+            return self.max_idle
+
+        return min(max(head[0][1] - time.time(), 0), self.max_idle)
+
+    def run_forever(self):
+        """Runs the scheduler loop until `stop` is called"""
+        while not self._stopping.is_set():
+            try:
+                if self.run_once() >= self.batch_size:
+                    # Backlog of due tasks, do not wait
+                    continue
+
+                timeout = self.next_wakeup()
+
+                if timeout > 0:
+                    rediscache.__get_radis__().blpop(self.wakeup_key, timeout=max(timeout, 0.01))
+            except Exception as e:
+                logging.error(f'Delay scheduler error: {e}')
+                self._stopping.wait(1)
+
+    def start(self):
+        """Runs the scheduler loop in a background thread of this process"""
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self.run_forever, name='fizzlibs-delay-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+        if self._thread and self._pid == os.getpid():
+            # Interrupt a blocking wait
+            try:
+                rediscache.__get_radis__().lpush(self.wakeup_key, 1)
+            except Exception:
+                pass
+
+            self._thread.join()
+
+
+delay_scheduler = DelayScheduler()
+
+
+if __name__ == "__main__":
+    # Dedicated scheduler worker
+    logging.basicConfig(level=logging.INFO)
+    delay_scheduler.run_forever()
@@ -2,6 +2,7 @@ import os
 import yaml
 import logging
 
+from flask import g
 from flask import Flask
 from flask import Config
 
@@ -28,8 +29,25 @@ class FlaskApplication(Flask):
         self._add_api_routes(routes)
         self._add_deferred_route()
 
+        if os.environ.get('DEFERRED_BATCHING', 'off') == 'on':
+            # Tasks deferred by a request are published once it is handled,
+            # publish errors are reported to `deferred.publish_error_hook`
+            self.before_request(self.__start_deferred_batch)
+            self.teardown_request(self.__publish_deferred_batch)
+
         self.__load_queue()
 
+        # Tasks of in-process queues are pushed to this application,
+        # in background unless QQUEUE_MEMORY_PUSH is off
+        from fizzlibs.ext import memqueue
+        memqueue.broker.attach_app(
+            self, background=os.environ.get('QQUEUE_MEMORY_PUSH', 'on') == 'on')
+
+        if os.environ.get('QQUEUE_DELAY_SCHEDULER') == 'on':
+            # Publish tasks deferred with a countdown from this process
+            from fizzlibs.ext.scheduler import delay_scheduler
+            delay_scheduler.start()
+
     def make_config(self, instance_relative=False):
         root_path = self.root_path
         if instance_relative:
@@ -46,13 +64,28 @@ class FlaskApplication(Flask):
         if not os.path.isfile(queue_conf_yaml_path):
             return
 
-        with open(queue_conf_yaml_path) as f:
-            queues_conf = yaml.load(f, Loader=yaml.SafeLoader)
+        with open(queue_conf_yaml_path, 'rb') as f:
+            queue_yaml = f.read()
+
+        queues_conf = yaml.load(queue_yaml, Loader=yaml.SafeLoader)
 
         queues = queues_conf.get('queue')
 
-        for queue in queues:
-            qqueue.QQueue(**queue, initialize_queue=True)
+        qqueue.provision_queues(
+            queues, fingerprint=qqueue.topology_fingerprint(queue_yaml))
+
+    @staticmethod
+    def __start_deferred_batch():
+        from fizzlibs.ext.deferred import DeferredBatch
+
+        g.deferred_batch = DeferredBatch().__enter__()
+
+    @staticmethod
+    def __publish_deferred_batch(error=None):
+        batch = g.pop('deferred_batch', None)
+
+        if batch is not None:
+            batch.__exit__(None, None, None)
 
     def _add_api_routes(self, routes):
         api_id = 1
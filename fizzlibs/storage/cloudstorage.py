@@ -1,13 +1,68 @@
-from finwiz.extras import applenv
-from finwiz.storage.providers import gcloud_storage
+import os
+
+
+class STORAGE_PROVIDER_ERROR(Exception):
+    pass
+
+
+def __get_provider__(provider):
+    return provider or os.environ.get('FILE_STORAGE_PROVIDER', 'gcloud_storage')
 
 
 def upload_blob(filename, blob, bucket=None, project=None, provider=None):
-    provider = provider or applenv.FILE_STORAGE_PROVIDER
+    provider = __get_provider__(provider)
 
     if provider == 'gcloud_storage':
+        from fizzlibs.storage.providers import gcloud_storage
+
         return gcloud_storage.gcs_upload(
             filename,
             blob,
             bucket=bucket,
-            project=(project or applenv.FILE_STORAGE_APP_ID))
+            project=(project or os.environ.get('FILE_STORAGE_APP_ID')))
+
+    if provider == 'local_storage':
+        from fizzlibs.storage.providers import local_storage
+
+        return local_storage.local_upload(filename, blob, bucket=bucket)
+
+    raise STORAGE_PROVIDER_ERROR(provider)
+
+
+def download_blob(filename, bucket=None, project=None, provider=None):
+    """Returns the content of a blob as bytes"""
+    provider = __get_provider__(provider)
+
+    if provider == 'gcloud_storage':
+        from fizzlibs.storage.providers import gcloud_storage
+
+        return gcloud_storage.gcs_download(
+            filename,
+            bucket=bucket,
+            project=(project or os.environ.get('FILE_STORAGE_APP_ID')))
+
+    if provider == 'local_storage':
+        from fizzlibs.storage.providers import local_storage
+
+        return local_storage.local_download(filename, bucket=bucket)
+
+    raise STORAGE_PROVIDER_ERROR(provider)
+
+
+def delete_blob(filename, bucket=None, project=None, provider=None):
+    provider = __get_provider__(provider)
+
+    if provider == 'gcloud_storage':
+        from fizzlibs.storage.providers import gcloud_storage
+
+        return gcloud_storage.gcs_delete(
+            filename,
+            bucket=bucket,
+            project=(project or os.environ.get('FILE_STORAGE_APP_ID')))
+
+    if provider == 'local_storage':
+        from fizzlibs.storage.providers import local_storage
+
+        return local_storage.local_delete(filename, bucket=bucket)
+
+    raise STORAGE_PROVIDER_ERROR(provider)
@@ -1,5 +1,5 @@
 from google.cloud import storage
-from finwiz.storage.blob import FinwizBlob
+from fizzlibs.storage.blob import FinwizBlob
 
 
 def gcs_upload(filname, blob, bucket, project):
@@ -12,6 +12,20 @@ def gcs_upload(filname, blob, bucket, project):
     return gcs_blob.id
 
 
+def gcs_download(filename, bucket, project):
+    client = storage.Client(project=project)
+    bucket = client.bucket(bucket)
+
+    return bucket.blob(filename).download_as_bytes()
+
+
+def gcs_delete(filename, bucket, project):
+    client = storage.Client(project=project)
+    bucket = client.bucket(bucket)
+
+    bucket.blob(filename).delete()
+
+
 def gcs_fileserving_url(blob_id):
     client = storage.Client(project=project)
     bucket = client.get_bucket(bucket)
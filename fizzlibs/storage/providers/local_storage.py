@@ -0,0 +1,45 @@
+import os
+import shutil
+
+
+def __get_path__(filename, bucket):
+    root = os.environ.get('FILE_STORAGE_LOCAL_ROOT', '/tmp/fizzlibs-storage')
+    path = os.path.abspath(os.path.join(root, bucket or 'default', filename))
+
+    if not path.startswith(os.path.abspath(root) + os.sep):
+        raise ValueError(f'Invalid blob name: {filename}')
+
+    return path
+
+
+def local_upload(filename, blob, bucket=None):
+    """Stores a file-like object or bytes on the local filesystem
+    under FILE_STORAGE_LOCAL_ROOT
+    """
+    path = __get_path__(filename, bucket)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write then rename so that readers never see a partial blob
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        if isinstance(blob, (bytes, bytearray)):
+            f.write(blob)
+        else:
+            shutil.copyfileobj(blob, f)
+
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def local_download(filename, bucket=None):
+    with open(__get_path__(filename, bucket), 'rb') as f:
+        return f.read()
+
+
+def local_delete(filename, bucket=None):
+    try:
+        os.remove(__get_path__(filename, bucket))
+    except FileNotFoundError:
+        pass
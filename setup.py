@@ -17,4 +17,8 @@ setuptools.setup(
         'mock==4.0.3',
         'redis==3.5.3'
     ],
+    extras_require={
+        'msgpack': ['msgpack==1.0.2'],
+        'monitoring': ['google-cloud-monitoring==2.2.1'],
+    },
 )
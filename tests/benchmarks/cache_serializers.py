@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of the `rediscache` value serializers
+
+Compares the legacy plain JSON format with every registered
+serializer, with and without compression, for a small and a large
+value. Values are framed as `rediscache.set` writes them, Redis is
+not needed.
+
+    python tests/benchmarks/cache_serializers.py
+"""
+import json
+import timeit
+
+from fizzlibs.ext import rediscache
+
+
+ROUNDS = 5000
+
+
+def values():
+    document = {'rows': [{'id': n, 'name': f'row {n}', 'value': n * 1.5} for n in range(2000)]}
+
+    return {
+        'small': {'user': 42, 'name': 'A small value', 'roles': ['admin', 'editor']},
+        'large': document
+    }
+
+
+def legacy_encode(value):
+    return json.dumps(value).encode('utf-8')
+
+
+def legacy_decode(data):
+    return json.loads(data)
+
+
+def bench(name, encode, decode, value, rounds):
+    try:
+        data = encode(value)
+    except (rediscache.RADIS_SERIALIZER_ERROR, ImportError) as e:
+        print(f'{name:>16} | unavailable: {e}')
+        return
+
+    encode_us = timeit.timeit(lambda: encode(value), number=rounds) / rounds * 1e6
+    decode_us = timeit.timeit(lambda: decode(data), number=rounds) / rounds * 1e6
+
+    print(f'{name:>16} | {len(data):>10} | {encode_us:>10.1f} | {decode_us:>10.1f}')
+
+
+def framed(serializer, compression):
+    def encode(value):
+        previous = rediscache.REDIS_CACHE_COMPRESSION
+        rediscache.REDIS_CACHE_COMPRESSION = compression
+
+        try:
+            return rediscache.__encode__(value, serializer)
+        finally:
+            rediscache.REDIS_CACHE_COMPRESSION = previous
+
+    return encode
+
+
+def main():
+    for label, value in values().items():
+        rounds = ROUNDS if label == 'small' else ROUNDS // 50
+
+        print(f'\n{label} value')
+        print(f'{"serializer":>16} | {"bytes":>10} | {"encode us":>10} | {"decode us":>10}')
+
+        bench('legacy', legacy_encode, legacy_decode, value, rounds)
+
+        for name in rediscache.CACHE_SERIALIZERS:
+            bench(name, framed(name, 'none'), rediscache.__decode__, value, rounds)
+
+            for compression in rediscache.CACHE_COMPRESSORS:
+                bench(f'{name}+{compression}', framed(name, compression),
+                      rediscache.__decode__, value, rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Throughput of the in-process `QQueue` backend
+
+Measures the broker alone (pre-encoded messages, one subscription) and
+`QQueue` end to end (task encoding, publish, lease and delete).
+
+    python tests/benchmarks/memory_backend.py
+"""
+import os
+import time
+
+os.environ.setdefault('QQUEUE_PROJECT_ID', 'benchmark')
+os.environ['QQUEUE_BACKEND'] = 'memory'
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import memqueue
+
+
+MESSAGES = 1000 * 1000
+TASKS = 200 * 1000
+BATCH = 1000
+
+
+def report(name, count, elapsed):
+    print(f'{name:>28} | {count:>9} | {elapsed:>8.3f}s | {count / elapsed:>12,.0f} /s')
+
+
+def broker_throughput():
+    broker = memqueue.MemoryBroker()
+    publisher = memqueue.MemoryPublisherClient(memory_broker=broker)
+    subscriber = memqueue.MemorySubscriberClient(memory_broker=broker)
+
+    topic = publisher.topic_path('benchmark', 'broker')
+    subscription = subscriber.subscription_path('benchmark', 'broker')
+
+    publisher.create_topic(request={'name': topic})
+    subscriber.create_subscription(request={'name': subscription, 'topic': topic})
+
+    data = b'x' * 64
+
+    started = time.perf_counter()
+
+    for _ in range(MESSAGES):
+        publisher.publish(topic, data)
+
+    report('broker publish', MESSAGES, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    pulled = 0
+
+    while True:
+        response = subscriber.pull(subscription=subscription, max_messages=BATCH, return_immediately=True)
+
+        if not response.received_messages:
+            break
+
+        subscriber.acknowledge(
+            subscription=subscription, ack_ids=[x.ack_id for x in response.received_messages])
+        pulled += len(response.received_messages)
+
+    report('broker pull + ack', pulled, time.perf_counter() - started)
+
+
+def queue_throughput():
+    queue = qqueue.QQueue('benchmark', mode='pull', initialize_queue=True)
+    tasks = [qqueue.Task(payload=str(n), method='PULL') for n in range(TASKS)]
+
+    summary = queue.add_many(tasks)
+    report('QQueue.add_many', summary.published, summary.elapsed)
+
+    started = time.perf_counter()
+    leased = 0
+
+    while True:
+        batch = queue.lease_tasks(max_tasks=BATCH)
+
+        if not batch:
+            break
+
+        queue.delete_tasks(batch)
+        leased += len(batch)
+
+    report('QQueue.lease + delete', leased, time.perf_counter() - started)
+
+
+def main():
+    print(f'{"":>28} | {"messages":>9} | {"elapsed":>9} | {"throughput":>14}')
+
+    broker_throughput()
+    queue_throughput()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of the `Task` wire codecs
+
+Compares the legacy base64(pickle protocol 2) format with every
+registered codec, for a small and a bytes heavy task.
+
+    python tests/benchmarks/task_codecs.py
+"""
+import os
+import json
+import base64
+import pickle
+import timeit
+
+os.environ.setdefault('QQUEUE_PROJECT_ID', 'benchmark')
+
+from fizzlibs.ext import qqueue
+
+
+ROUNDS = 2000
+
+
+def legacy_encode(task):
+    return base64.b64encode(pickle.dumps(task, protocol=2, fix_imports=True))
+
+
+def legacy_decode(data):
+    return pickle.loads(base64.b64decode(data), fix_imports=True)
+
+
+def tasks():
+    document = {'rows': [{'id': n, 'name': f'row {n}', 'value': n * 1.5} for n in range(2000)]}
+
+    return {
+        'small': qqueue.Task(payload=json.dumps({'a': 'A huge task'}), method='PULL', tag='t'),
+        'large': qqueue.Task(payload=json.dumps(document), method='PULL', tag='t')
+    }
+
+
+def bench(name, encode, decode, task, rounds):
+    try:
+        data = encode(task)
+    except (qqueue.QQUEUE_CODEC_ERROR, ImportError) as e:
+        print(f'{name:>10} | unavailable: {e}')
+        return
+
+    encode_us = timeit.timeit(lambda: encode(task), number=rounds) / rounds * 1e6
+    decode_us = timeit.timeit(lambda: decode(data), number=rounds) / rounds * 1e6
+
+    print(f'{name:>10} | {len(data):>10} | {encode_us:>10.1f} | {decode_us:>10.1f}')
+
+
+def main():
+    for label, task in tasks().items():
+        rounds = ROUNDS if label == 'small' else ROUNDS // 20
+
+        print(f'\n{label} task')
+        print(f'{"codec":>10} | {"bytes":>10} | {"encode us":>10} | {"decode us":>10}')
+
+        bench('legacy', legacy_encode, legacy_decode, task, rounds)
+
+        for name in qqueue.TASK_CODECS:
+            bench(name,
+                  lambda t, n=name: t.encode(n),
+                  qqueue.Task.decode,
+                  task,
+                  rounds)
+
+
+if __name__ == "__main__":
+    main()
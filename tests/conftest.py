@@ -3,6 +3,13 @@ import tempfile
 
 import pytest
 
+if not os.environ.get('PUBSUB_EMULATOR_HOST'):
+    # Without the emulator, queues run in process. Push queues are
+    # only delivered on demand, as the tests pull from them
+    os.environ.setdefault('QQUEUE_BACKEND', 'memory')
+    os.environ.setdefault('QQUEUE_MEMORY_PUSH', 'off')
+    os.environ.setdefault('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+
 from app import create_app
 
 @pytest.fixture(scope='session')
@@ -0,0 +1,128 @@
+import pytest
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import memqueue
+from fizzlibs.ext import webapp
+from fizzlibs.ext import deferred
+from fizzlibs.ext.handler import AuthHandler
+
+
+def noop(value):
+    pass
+
+
+class Fan_Out_API(AuthHandler):
+    def get(self):
+        for n in range(50):
+            deferred.defer(noop, n, _queue='batched')
+
+        # Published once the request is handled
+        return {'pending': len(deferred.current_batch()),
+                'backlog': backlog('batched')}
+
+
+class Defer_API(AuthHandler):
+    def get(self):
+        deferred.defer(noop, 1, _queue='batched')
+
+        return {'batch': deferred.current_batch() is not None,
+                'backlog': backlog('batched')}
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = memqueue.MemoryBroker()
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'memory')
+    monkeypatch.setenv('HTTP_SCHEME', 'http')
+    monkeypatch.setenv('HTTP_HOST', 'localhost')
+    monkeypatch.delenv('GKE_SOFTWARE_ID', raising=False)
+    monkeypatch.delenv('FLASK_APP', raising=False)
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(memqueue, 'broker', broker)
+
+    qqueue.QQueue('batched', mode='pull', initialize_queue=True)
+    qqueue.QQueue('other', mode='pull', initialize_queue=True)
+
+    return broker
+
+
+def backlog(name):
+    # Read from the broker, statistics are cached
+    return memqueue.broker.backlog([f'projects/pubsub-emulator/subscriptions/{name}'])['backlog']
+
+
+def test_published_when_batch_exits(broker, monkeypatch):
+    calls = []
+    add_async = qqueue.QQueue.add_async
+
+    def counting_add_async(self, tasks):
+        calls.append((self.queue_name, len(tasks)))
+        return add_async(self, tasks)
+
+    monkeypatch.setattr(qqueue.QQueue, 'add_async', counting_add_async)
+
+    with deferred.DeferredBatch() as batch:
+        for n in range(5):
+            deferred.defer(noop, n, _queue='batched')
+
+        deferred.defer(noop, 'x', _queue='other')
+
+        assert len(batch) == 6
+        assert backlog('batched') == 0
+
+    assert deferred.current_batch() is None
+    assert calls == [('batched', 5), ('other', 1)]
+    assert backlog('batched') == 5
+    assert backlog('other') == 1
+
+
+def test_flush_reports_failures(broker):
+    errors = []
+
+    with deferred.DeferredBatch(on_error=lambda *error: errors.append(error)):
+        deferred.defer(noop, 1, _queue='batched')
+        deferred.defer(noop, 2, _queue='missing')
+
+        failures = deferred.flush()
+
+        assert [(queue_name, task.args) for queue_name, task, _ in failures] == [('missing', (2,))]
+        assert backlog('batched') == 1
+
+    assert [(queue_name, task.args) for queue_name, task, _ in errors] == [('missing', (2,))]
+    assert deferred.flush() == []
+
+
+def test_publish_error_hook(broker):
+    errors = []
+    deferred.set_publish_error_hook(lambda *error: errors.append(error))
+
+    try:
+        with deferred.DeferredBatch():
+            deferred.defer(noop, 1, _queue='missing')
+    finally:
+        deferred.set_publish_error_hook(None)
+
+    assert len(errors) == 1
+    assert deferred.publish_error_hook is deferred._log_publish_error
+
+
+def test_request_batch(broker, monkeypatch):
+    monkeypatch.setenv('DEFERRED_BATCHING', 'on')
+    app = webapp.FlaskApplication(__name__, [webapp.Route('/fan-out', Fan_Out_API)])
+
+    response = app.test_client().get('/fan-out')
+
+    assert response.get_json() == {'pending': 50, 'backlog': 0}
+    assert backlog('batched') == 50
+    assert deferred.current_batch() is None
+
+
+def test_requests_not_batched_by_default(broker, monkeypatch):
+    monkeypatch.delenv('DEFERRED_BATCHING', raising=False)
+    app = webapp.FlaskApplication(__name__, [webapp.Route('/defer', Defer_API)])
+
+    # Published, and its errors raised, from defer
+    assert app.test_client().get('/defer').get_json() == {'batch': False, 'backlog': 1}
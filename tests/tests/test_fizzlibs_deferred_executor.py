@@ -0,0 +1,143 @@
+import time
+import base64
+import threading
+import pytest
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import webapp
+from fizzlibs.ext import deferred
+
+
+STARTED = threading.Event()
+RELEASE = threading.Event()
+
+
+def blocking(value):
+    STARTED.set()
+    RELEASE.wait(5)
+
+
+def noop(value):
+    pass
+
+
+def encoded(handler, *args):
+    task = qqueue.Task(handler=handler, *args)
+    payload = task.encode()
+
+    return qqueue.Task.from_data(payload), payload
+
+
+@pytest.fixture
+def events():
+    STARTED.clear()
+    RELEASE.clear()
+
+    yield
+
+    RELEASE.set()
+
+
+def test_backpressure_and_drain(events):
+    executor = deferred.DeferredExecutor(max_workers=1, max_pending=1)
+
+    task, payload = encoded(blocking, 1)
+
+    assert executor.submit(task, payload, None) == 200
+    assert STARTED.wait(5)
+
+    # Saturated
+    assert executor.submit(task, payload, None) == 429
+    assert executor.in_flight == 1
+
+    # In-flight task is not drained yet
+    assert not executor.shutdown(timeout=0.01)
+    assert executor.submit(task, payload, None) == 503
+
+    RELEASE.set()
+
+    assert executor.shutdown(timeout=5)
+    assert executor.stats == {'accepted': 1, 'rejected': 2, 'succeeded': 1, 'failed': 0}
+
+
+def test_process_workers():
+    executor = deferred.DeferredExecutor(max_workers=1, max_pending=3, processes=True)
+
+    for n in range(3):
+        task, payload = encoded(noop, n)
+        assert executor.submit(task, payload, None, attempt=1) == 200
+
+    assert executor.shutdown(timeout=30)
+    assert executor.stats['succeeded'] == 3
+
+
+def test_push_acknowledged_before_execution(events, monkeypatch):
+    monkeypatch.setenv('DEFERRED_EXECUTION', 'thread')
+    monkeypatch.setenv('DEFERRED_WORKERS', '1')
+    monkeypatch.setenv('DEFERRED_MAX_PENDING', '1')
+    monkeypatch.setattr(deferred, '_executor', None)
+
+    app = webapp.FlaskApplication(__name__, [])
+    client = app.test_client()
+
+    def push(handler):
+        _, payload = encoded(handler, 1)
+
+        return client.post('/_ah/queue/deferred', json={
+            'message': {'data': base64.b64encode(payload).decode('utf-8'), 'attributes': {}},
+            'deliveryAttempt': 1
+        })
+
+    response = push(blocking)
+
+    assert response.status_code == 200
+    assert response.get_json() == {'message': 'accepted'}
+    assert STARTED.wait(5)
+
+    assert push(noop).status_code == 429
+
+    RELEASE.set()
+
+    executor = deferred.get_executor()
+
+    assert deferred.shutdown(timeout=5)
+    assert executor.stats['succeeded'] == 1
+
+
+def test_push_rejected_while_draining(events, monkeypatch):
+    monkeypatch.setenv('DEFERRED_EXECUTION', 'thread')
+    monkeypatch.setenv('DEFERRED_WORKERS', '1')
+    monkeypatch.setattr(deferred, '_executor', None)
+
+    app = webapp.FlaskApplication(__name__, [])
+    client = app.test_client()
+
+    def push(handler):
+        _, payload = encoded(handler, 1)
+
+        return client.post('/_ah/queue/deferred', json={
+            'message': {'data': base64.b64encode(payload).decode('utf-8'), 'attributes': {}},
+            'deliveryAttempt': 1
+        })
+
+    assert push(blocking).status_code == 200
+    assert STARTED.wait(5)
+
+    executor = deferred.get_executor()
+    drained = []
+    drain = threading.Thread(target=lambda: drained.append(deferred.shutdown(timeout=5)))
+    drain.start()
+
+    while not executor._draining:
+        time.sleep(0.01)
+
+    # Not handed to a new pool, which the drain would not cover
+    assert push(noop).status_code == 503
+    assert deferred.get_executor() is executor
+
+    RELEASE.set()
+    drain.join()
+
+    assert drained == [True]
+    assert executor.stats['rejected'] == 1
+    assert deferred._executor is None
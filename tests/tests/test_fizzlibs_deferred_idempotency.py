@@ -0,0 +1,81 @@
+import os
+import uuid
+import base64
+import pytest
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import webapp
+from fizzlibs.ext import idempotency
+
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+
+
+RUNS = []
+
+
+def expensive(value):
+    RUNS.append(value)
+
+
+def flaky(value):
+    RUNS.append(value)
+    raise ValueError(value)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = idempotency.IdempotencyStore(prefix=f'test-{uuid.uuid4().hex}')
+    monkeypatch.setattr(idempotency, 'idempotency_store', store)
+    monkeypatch.delenv('DEFERRED_EXECUTION', raising=False)
+    RUNS.clear()
+
+    return store
+
+
+def envelope(handler, key):
+    task = qqueue.Task(handler=handler, idempotency_key=key, *['x'])
+
+    return {
+        'message': {
+            'data': base64.b64encode(task.encode()).decode('utf-8'),
+            'attributes': {qqueue.QQUEUE_IDEMPOTENCY_ATTRIBUTE: key}
+        }
+    }
+
+
+def test_claim_states(store):
+    assert store.claim('a') == idempotency.CLAIMED
+    assert store.claim('a') == idempotency.RUNNING
+
+    store.release('a')
+    assert store.claim('a') == idempotency.CLAIMED
+
+    store.complete('a')
+    assert store.claim('a') == idempotency.DONE
+    assert store.claim('a') == idempotency.DONE
+
+    assert store.suppressed() == 2
+    assert store.stats == {'claimed': 2, 'suppressed': 2, 'running': 1, 'unavailable': 0}
+
+
+def test_duplicates_suppressed(store):
+    client = webapp.FlaskApplication(__name__, []).test_client()
+    message = envelope(expensive, 'job-1')
+
+    assert client.post('/_ah/queue/deferred', json=message).get_json() == {'message': 'success'}
+    assert client.post('/_ah/queue/deferred', json=message).get_json() == {'message': 'duplicate'}
+
+    assert RUNS == ['x']
+    assert store.stats['suppressed'] == 1
+
+
+def test_failed_task_runs_again(store):
+    client = webapp.FlaskApplication(__name__, []).test_client()
+    message = envelope(flaky, 'job-2')
+
+    assert client.post('/_ah/queue/deferred', json=message).status_code == 500
+    assert client.post('/_ah/queue/deferred', json=message).status_code == 500
+
+    assert RUNS == ['x', 'x']
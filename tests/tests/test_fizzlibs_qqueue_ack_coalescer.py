@@ -0,0 +1,86 @@
+import time
+import threading
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+class FakeSubscriber(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def acknowledge(self, subscription, ack_ids):
+        if self.error:
+            raise self.error
+
+        with self.lock:
+            self.requests.append((subscription, list(ack_ids)))
+
+
+def test_acks_coalesced():
+    subscriber = FakeSubscriber()
+    coalescer = qqueue.QQueueAckCoalescer(batch_size=100, max_latency=0.05)
+
+    futures = [
+        coalescer.acknowledge(subscriber, 'source', [f'ack-{n}'])
+        for n in range(250)
+    ]
+
+    for future in futures:
+        assert future.result(timeout=5) is None
+
+    coalescer.stop()
+
+    acked = [ack_id for _, ack_ids in subscriber.requests for ack_id in ack_ids]
+
+    assert sorted(acked) == sorted(f'ack-{n}' for n in range(250))
+    assert len(subscriber.requests) <= 10
+    assert coalescer.stats['acknowledged'] == 250
+
+
+def test_acks_flushed_on_stop():
+    subscriber = FakeSubscriber()
+    coalescer = qqueue.QQueueAckCoalescer(batch_size=100, max_latency=60)
+
+    future = coalescer.acknowledge(subscriber, 'source', ['ack-0'])
+    coalescer.stop()
+
+    assert future.done()
+    assert subscriber.requests == [('source', ['ack-0'])]
+
+
+def test_ack_failure_reported():
+    subscriber = FakeSubscriber(error=ValueError('unavailable'))
+    coalescer = qqueue.QQueueAckCoalescer(max_latency=0.01)
+
+    future = coalescer.acknowledge(subscriber, 'source', ['ack-0'])
+
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
+
+    coalescer.stop()
+
+
+def test_delete_tasks_async_flushed_by_latency(monkeypatch):
+    subscriber = FakeSubscriber()
+    coalescer = qqueue.QQueueAckCoalescer(batch_size=100, max_latency=0.05)
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setattr(qqueue, 'ack_coalescer', coalescer)
+    monkeypatch.setattr(qqueue.QQueue, '_QQueue__get_subscriber', lambda self: (subscriber, 'source'))
+
+    q = qqueue.QQueue('acked')
+
+    for n in range(2):
+        task = qqueue.Task(payload=n, method='PULL')
+        task.ack_id = f'ack-{n}'
+
+        # Small batches, sent once the latency elapses
+        assert q.delete_tasks_async(task).result(timeout=5) is None
+        time.sleep(0.1)
+
+    assert subscriber.requests == [('source', ['ack-0']), ('source', ['ack-1'])]
+
+    coalescer.stop()
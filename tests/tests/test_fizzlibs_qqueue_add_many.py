@@ -0,0 +1,85 @@
+import threading
+import pytest
+from concurrent import futures
+
+from fizzlibs.ext import qqueue
+
+
+class FakePublisher(object):
+    def __init__(self, **kwargs):
+        self.batch_settings = kwargs.get('batch_settings')
+        self.executor = futures.ThreadPoolExecutor(max_workers=4)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.max_pending = 0
+        self.published = []
+
+    def topic_path(self, project_id, name):
+        return f'projects/{project_id}/topics/{name}'
+
+    def publish(self, topic, data, **attributes):
+        with self.lock:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+        return self.executor.submit(self.__publish, data)
+
+    def __publish(self, data):
+        task = qqueue.Task.decode(data)
+
+        with self.lock:
+            self.pending -= 1
+
+        if task.payload == 'poison':
+            raise ValueError(task.payload)
+
+        self.published.append(task.payload)
+
+        return str(len(self.published))
+
+
+@pytest.fixture
+def publishers(monkeypatch):
+    created = []
+
+    def factory(**kwargs):
+        created.append(FakePublisher(**kwargs))
+        return created[-1]
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'pubsub')
+    monkeypatch.setenv('PUBSUB_EMULATOR_HOST', 'localhost:8080')
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(qqueue.pubsub_v1, 'PublisherClient', factory)
+
+    return created
+
+
+def test_add_many_generator(publishers):
+    def tasks():
+        for n in range(5000):
+            yield qqueue.Task(payload='poison' if n in (7, 4000) else str(n), method='PULL')
+
+    summary = qqueue.QQueue('bulk').add_many(tasks(), max_in_flight=50)
+
+    assert summary.total == 5000
+    assert summary.published == 4998
+    assert summary.failed_indexes == [7, 4000]
+    assert summary.throughput > 0
+    assert publishers[0].max_pending <= 50
+
+
+def test_add_many_rejects_non_tasks(publishers):
+    with pytest.raises(qqueue.QQUEUE_TASK_TYPE_ERROR):
+        qqueue.QQueue('bulk').add_many(['not a task'])
+
+
+def test_batch_settings_from_queue_settings(publishers, monkeypatch):
+    monkeypatch.setitem(qqueue.QQUEUE_SETTINGS, 'batched', {
+        'batch_max_messages': 50, 'batch_max_latency': 0.5
+    })
+
+    qqueue.QQueue('batched').add_many([qqueue.Task(payload='a', method='PULL')])
+
+    assert publishers[0].batch_settings.max_messages == 50
+    assert publishers[0].batch_settings.max_latency == 0.5
@@ -0,0 +1,125 @@
+import asyncio
+import pytest
+from concurrent import futures
+from types import SimpleNamespace
+
+from fizzlibs.ext import qqueue
+
+
+class FakePublisher(object):
+    executor = futures.ThreadPoolExecutor(max_workers=4)
+
+    def __init__(self, **kwargs):
+        self.count = 0
+
+    def topic_path(self, project_id, name):
+        return f'projects/{project_id}/topics/{name}'
+
+    def publish(self, topic, data, **attributes):
+        self.count += 1
+        return self.executor.submit(lambda n: str(n), self.count)
+
+
+class FakeAsyncSubscriber(object):
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.deadlines = []
+
+    def subscription_path(self, project_id, name):
+        return f'projects/{project_id}/subscriptions/{name}'
+
+    async def pull(self, request, timeout=None):
+        await asyncio.sleep(0)
+
+        messages = [
+            SimpleNamespace(
+                ack_id=f'ack-{n}',
+                message=SimpleNamespace(data=task.encode(), attributes={})
+            )
+            for n, task in enumerate(self.tasks[:request['max_messages']])
+        ]
+        self.tasks = self.tasks[request['max_messages']:]
+
+        return SimpleNamespace(received_messages=messages)
+
+    async def modify_ack_deadline(self, request):
+        self.deadlines.append(request)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    subscriber = FakeAsyncSubscriber([
+        qqueue.Task(payload=f'task {n}', method='PULL') for n in range(3)
+    ])
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'pubsub')
+    monkeypatch.setenv('PUBSUB_EMULATOR_HOST', 'localhost:8080')
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(qqueue.pubsub_v1, 'PublisherClient', FakePublisher)
+    monkeypatch.setattr(qqueue, '_make_async_subscriber', lambda queue: subscriber)
+
+    return qqueue.AsyncQQueue('async')
+
+
+def test_async_add(queue):
+    async def main():
+        single = await queue.add(qqueue.Task(payload='a', method='PULL'))
+        many = await queue.add([qqueue.Task(payload='b', method='PULL')] * 3)
+
+        return single, many
+
+    single, many = asyncio.run(main())
+
+    assert single == '1'
+    assert sorted(many) == ['2', '3', '4']
+
+
+def test_async_add_many(queue):
+    async def tasks():
+        for n in range(100):
+            yield qqueue.Task(payload=str(n), method='PULL')
+
+    summary = asyncio.run(queue.add_many(tasks(), max_in_flight=10))
+
+    assert summary.total == 100
+    assert summary.published == 100
+
+
+def test_async_lease_and_iterate(queue):
+    async def main():
+        leased = await queue.lease_tasks(lease_seconds=30, max_tasks=2)
+        consumed = []
+
+        async for task in queue:
+            consumed.append(task)
+            break
+
+        return leased, consumed
+
+    leased, consumed = asyncio.run(main())
+
+    assert [task.payload for task in leased] == ['task 0', 'task 1']
+    assert [task.payload for task in consumed] == ['task 2']
+    assert leased[0].subscription == 'projects/pubsub-emulator/subscriptions/async'
+
+
+def test_async_lease_across_shards(queue, monkeypatch):
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {'sharded': {'shards': 2}})
+    sharded = qqueue.AsyncQQueue('sharded')
+
+    async def main():
+        leased = await sharded.lease_tasks(max_tasks=2)
+        consumed = []
+
+        async for task in sharded:
+            consumed.append(task)
+            break
+
+        return leased, consumed
+
+    leased, consumed = asyncio.run(main())
+
+    assert len(leased) == 2
+    assert {task.subscription.rsplit('/', 1)[1] for task in leased} == {'sharded', 'sharded-shard-1'}
+    assert [task.payload for task in consumed] == ['task 2']
@@ -0,0 +1,70 @@
+import os
+import json
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+@pytest.fixture
+def queue(monkeypatch, tmp_path):
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_OFFLOAD_PROVIDER', 'local_storage')
+    monkeypatch.setenv('QQUEUE_OFFLOAD_BUCKET', 'tasks')
+    monkeypatch.setenv('FILE_STORAGE_LOCAL_ROOT', str(tmp_path))
+    qqueue.queue_counters.reset()
+
+    return qqueue.QQueue('claim-check', compression='none', offload_threshold=1024)
+
+
+def stored_blobs(root):
+    return [f for _, _, files in os.walk(root) for f in files]
+
+
+def test_large_task_offloaded(queue, tmp_path):
+    payload = json.dumps({'data': 'x' * 4096})
+    task = qqueue.Task(payload=payload, method='PULL', tag='t')
+
+    data, attributes = queue._QQueue__encode_task(task)
+
+    assert data == b''
+    assert attributes[qqueue.QQUEUE_CLAIM_ATTRIBUTE]
+    assert len(stored_blobs(tmp_path)) == 1
+    assert queue.counters()['offloaded_tasks'] == 1
+
+    received = qqueue.Task.from_data(data, attributes)
+
+    # Body is only fetched on first access
+    assert 'payload' not in received.__dict__
+    assert received.payload == payload
+    assert received.tag == 't'
+
+    # Leased tasks survive the text round trip used by the APIs
+    copy = qqueue.Task.from_pickle(received.to_pickle().decode('utf-8'))
+
+    copy.discard_claim()
+
+    assert stored_blobs(tmp_path) == []
+
+
+def test_small_task_published_inline(queue, tmp_path):
+    task = qqueue.Task(payload='small', method='PULL')
+
+    data, attributes = queue._QQueue__encode_task(task)
+
+    assert qqueue.QQUEUE_CLAIM_ATTRIBUTE not in attributes
+    assert qqueue.Task.from_data(data, attributes).payload == 'small'
+    assert stored_blobs(tmp_path) == []
+
+
+def test_offload_requires_provider_and_bucket(queue, monkeypatch, tmp_path):
+    monkeypatch.delenv('QQUEUE_OFFLOAD_BUCKET')
+    monkeypatch.setenv('FILE_STORAGE_PROVIDER', 'gcloud_storage')
+
+    task = qqueue.Task(payload='x' * 4096, method='PULL')
+    data, attributes = qqueue.QQueue(
+        'claim-check', compression='none', offload_threshold=1024)._QQueue__encode_task(task)
+
+    # Published inline, as without claim-check
+    assert qqueue.QQUEUE_CLAIM_ATTRIBUTE not in attributes
+    assert qqueue.Task.from_data(data, attributes).payload == 'x' * 4096
+    assert stored_blobs(tmp_path) == []
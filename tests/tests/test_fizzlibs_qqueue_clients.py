@@ -0,0 +1,58 @@
+from fizzlibs.ext import qqueue
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.stopped = False
+        self.closed = False
+
+    def stop(self):
+        self.stopped = True
+
+    def close(self):
+        self.closed = True
+
+
+def test_registry_reuses_clients():
+    registry = qqueue.QQueueClientRegistry()
+
+    a = registry.get_publisher(('p', 'c', 1), FakeClient)
+    b = registry.get_publisher(('p', 'c', 1), FakeClient)
+    c = registry.get_publisher(('p', 'c', 2), FakeClient)
+
+    assert a is b
+    assert a is not c
+
+    stats = registry.statistics()
+
+    assert stats['publisher_created'] == 2
+    assert stats['publisher_reused'] == 1
+    assert stats['publisher_active'] == 2
+
+
+def test_registry_shutdown():
+    registry = qqueue.QQueueClientRegistry()
+
+    publisher = registry.get_publisher('p', FakeClient)
+    subscriber = registry.get_subscriber('s', FakeClient)
+
+    registry.shutdown()
+
+    assert publisher.stopped
+    assert subscriber.closed
+    assert registry.statistics()['subscriber_active'] == 0
+
+
+def test_registry_forget_clients_after_fork():
+    registry = qqueue.QQueueClientRegistry()
+
+    a = registry.get_subscriber('s', FakeClient)
+
+    # Simulate being a forked child
+    registry._pid = -1
+
+    b = registry.get_subscriber('s', FakeClient)
+
+    assert a is not b
+    assert not a.closed
+    assert registry.statistics()['subscriber_created'] == 1
@@ -0,0 +1,52 @@
+import base64
+import pickle
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+def pull_task():
+    return qqueue.Task('x', payload='{"a": "A huge task"}', method='PULL', tag='t')
+
+
+@pytest.mark.parametrize('codec', ['pickle', 'json', 'msgpack'])
+def test_codec_round_trip(codec):
+    if codec == 'msgpack':
+        pytest.importorskip('msgpack')
+
+    task = pull_task()
+    data = task.encode(codec)
+
+    assert data[:1] == qqueue.QQUEUE_WIRE_MAGIC
+    assert qqueue.get_task_codec(data[2]).name == codec
+
+    decoded = qqueue.Task.decode(data)
+
+    assert decoded.payload == task.payload
+    assert decoded.tag == 't'
+    assert decoded.args == ('x',)
+
+    # Text safe form, as embedded in JSON
+    assert qqueue.Task.from_pickle(task.to_pickle(codec).decode('utf-8')).payload == task.payload
+
+
+def test_legacy_messages_decode():
+    task = pull_task()
+    legacy = base64.b64encode(pickle.dumps(task, protocol=2, fix_imports=True))
+
+    assert qqueue.Task.from_pickle(legacy).payload == task.payload
+    assert qqueue.Task.decode(legacy).payload == task.payload
+
+
+def test_plain_codecs_reject_handlers():
+    task = qqueue.Task(handler=test_legacy_messages_decode)
+
+    with pytest.raises(qqueue.QQUEUE_CODEC_ERROR):
+        task.encode('json')
+
+    assert qqueue.Task.decode(task.encode('pickle')).handler is test_legacy_messages_decode
+
+
+def test_unknown_codec():
+    with pytest.raises(qqueue.QQUEUE_CODEC_ERROR):
+        pull_task().encode('yaml')
@@ -0,0 +1,48 @@
+import json
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    qqueue.queue_counters.reset()
+
+    return qqueue.QQueue('compressed', compress_threshold=1024)
+
+
+def document(rows):
+    return json.dumps({'rows': [{'id': n, 'name': f'row {n}'} for n in range(rows)]})
+
+
+def test_large_task_compressed(queue):
+    task = qqueue.Task(payload=document(1000), method='PULL')
+
+    data, attributes = queue._QQueue__encode_task(task)
+
+    assert attributes[qqueue.QQUEUE_ENCODING_ATTRIBUTE] == 'zlib'
+    assert len(data) < len(task.encode(queue.codec))
+    assert qqueue.Task.from_data(data, attributes).payload == task.payload
+
+    counters = queue.counters()
+
+    assert counters['compressed_tasks'] == 1
+    assert counters['bytes_saved'] > 0
+
+
+def test_small_task_not_compressed(queue):
+    task = qqueue.Task(payload=document(1), method='PULL')
+
+    data, attributes = queue._QQueue__encode_task(task)
+
+    assert attributes == {}
+    assert qqueue.Task.from_data(data, attributes).payload == task.payload
+    assert 'compressed_tasks' not in queue.counters()
+
+
+def test_queue_settings_registered(monkeypatch):
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setitem(qqueue.QQUEUE_SETTINGS, 'configured', {'compression': 'none'})
+
+    assert qqueue.QQueue('configured').compression == 'none'
@@ -0,0 +1,97 @@
+import threading
+
+from fizzlibs.ext import qqueue
+
+
+class FakeMessage(object):
+    def __init__(self, task, ack_id):
+        self.data = task.encode()
+        self.attributes = {}
+        self.ack_id = ack_id
+        self.acked = False
+        self.nacked = False
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.nacked = True
+
+
+class FakeFuture(object):
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def done(self):
+        return self.cancelled
+
+    def result(self, timeout=None):
+        return None
+
+
+class FakeSubscriber(object):
+    def subscribe(self, source, callback, flow_control=()):
+        self.callback = callback
+        self.flow_control = flow_control
+        return FakeFuture()
+
+
+def start_consumer(callback):
+    subscriber = FakeSubscriber()
+    consumer = qqueue.QQueueConsumer('default', callback)
+    consumer._start(subscriber, 'source', qqueue.types.FlowControl(max_messages=1))
+
+    return consumer, subscriber
+
+
+def test_consume_ack_and_nack():
+    def callback(task):
+        if task.payload == 'bad':
+            raise ValueError(task.payload)
+
+    consumer, subscriber = start_consumer(callback)
+
+    good = FakeMessage(qqueue.Task(payload='good', method='PULL'), 'a')
+    bad = FakeMessage(qqueue.Task(payload='bad', method='PULL'), 'b')
+
+    subscriber.callback(good)
+    subscriber.callback(bad)
+
+    assert good.acked and not good.nacked
+    assert bad.nacked and not bad.acked
+    assert consumer.processed == 1
+    assert consumer.failed == 1
+
+
+def test_consume_drain_on_stop():
+    started = threading.Event()
+    release = threading.Event()
+
+    def callback(task):
+        started.set()
+        release.wait()
+
+    consumer, subscriber = start_consumer(callback)
+
+    message = FakeMessage(qqueue.Task(payload='slow', method='PULL'), 'a')
+    worker = threading.Thread(target=subscriber.callback, args=(message,))
+    worker.start()
+    assert started.wait(5)
+
+    # In-flight task is not drained yet
+    assert not consumer.stop(timeout=0.01)
+
+    # Tasks received while draining are handed back
+    late = FakeMessage(qqueue.Task(payload='late', method='PULL'), 'b')
+    subscriber.callback(late)
+    assert late.nacked
+
+    release.set()
+    worker.join()
+
+    assert consumer.stop(timeout=1)
+    assert message.acked
+    assert not consumer.running
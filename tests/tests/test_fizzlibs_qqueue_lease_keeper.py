@@ -0,0 +1,56 @@
+import threading
+from types import SimpleNamespace
+
+from fizzlibs.ext import qqueue
+
+
+class FakeSubscriber(object):
+    def __init__(self):
+        self.requests = []
+        self.extended = threading.Event()
+
+    def modify_ack_deadline(self, request):
+        self.requests.append(request)
+        self.extended.set()
+
+
+def test_leases_extended_in_batches():
+    subscriber = FakeSubscriber()
+    tasks = [SimpleNamespace(ack_id=f'ack-{n}') for n in range(3)]
+
+    with qqueue.QQueueLeaseKeeper(margin=1) as keeper:
+        keeper.hold(subscriber, 'source', tasks, lease_seconds=1)
+
+        assert subscriber.extended.wait(5)
+
+        request = subscriber.requests[0]
+
+        assert request['subscription'] == 'source'
+        assert sorted(request['ack_ids']) == ['ack-0', 'ack-1', 'ack-2']
+        assert request['ack_deadline_seconds'] == qqueue.QQUEUE_MAX_LEASE_SECONDS
+
+
+def test_released_leases_not_extended():
+    subscriber = FakeSubscriber()
+    tasks = [SimpleNamespace(ack_id='ack-0')]
+
+    with qqueue.QQueueLeaseKeeper(margin=1) as keeper:
+        keeper.hold(subscriber, 'source', tasks, lease_seconds=1.5)
+        keeper.release(tasks)
+
+        assert keeper.held() == 0
+        assert not subscriber.extended.wait(1)
+
+
+def test_extension_follows_processing_time():
+    keeper = qqueue.QQueueLeaseKeeper(margin=5)
+
+    for n in range(100):
+        keeper._durations.append(30)
+
+    assert keeper.extension_seconds() == 35
+
+    for n in range(5):
+        keeper._durations.append(10000)
+
+    assert keeper.extension_seconds() == qqueue.QQUEUE_MAX_LEASE_SECONDS
@@ -0,0 +1,137 @@
+import time
+import threading
+import pytest
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import memqueue
+from fizzlibs.ext import webapp
+from fizzlibs.ext import deferred
+
+
+RECEIVED = []
+
+
+def record(value):
+    RECEIVED.append(value)
+
+
+def fail(value):
+    raise ValueError(value)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = memqueue.MemoryBroker()
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'memory')
+    monkeypatch.setenv('HTTP_SCHEME', 'http')
+    monkeypatch.setenv('HTTP_HOST', 'localhost')
+    monkeypatch.delenv('GKE_SOFTWARE_ID', raising=False)
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(memqueue, 'broker', broker)
+
+    yield broker
+
+    broker.stop_push()
+
+
+def test_add_lease_delete(broker):
+    q = qqueue.QQueue('memory', mode='pull', initialize_queue=True)
+
+    q.add([qqueue.Task(payload=str(n), method='PULL') for n in range(5)])
+
+    tasks = q.lease_tasks(max_tasks=3)
+    assert [task.payload for task in tasks] == ['0', '1', '2']
+
+    q.delete_tasks(tasks)
+
+    assert [task.payload for task in q.lease_tasks()] == ['3', '4']
+    assert q.lease_tasks() == []
+
+
+def test_expired_lease_redelivered(broker):
+    q = qqueue.QQueue('memory', mode='pull', initialize_queue=True)
+    q.add(qqueue.Task(payload='a', method='PULL'))
+
+    first = q.lease_tasks(lease_seconds=0.05)
+    assert q.lease_tasks() == []
+
+    time.sleep(0.1)
+    again = q.lease_tasks()
+
+    assert [task.payload for task in again] == ['a']
+    assert again[0].ack_id != first[0].ack_id
+
+    # The expired ack id is no longer valid
+    q.delete_tasks(first)
+    q.modify_task_lease(again, lease_seconds=0)
+
+    assert [task.payload for task in q.lease_tasks()] == ['a']
+
+
+def test_tags_filtered(broker):
+    q = qqueue.QQueue('memory', mode='pull', tags=['etl'], initialize_queue=True)
+
+    q.add([
+        qqueue.Task(payload='plain', method='PULL'),
+        qqueue.Task(payload='tagged', method='PULL', tag='etl')
+    ])
+
+    assert [task.payload for task in q.lease_tasks()] == ['plain']
+    assert [task.payload for task in q.lease_tasks_by_tag('etl')] == ['tagged']
+
+
+def test_ordering_key_delivered_in_turn(broker):
+    q = qqueue.QQueue('memory', mode='pull', ordering=True, initialize_queue=True)
+
+    q.add([qqueue.Task(payload=str(n), method='PULL', ordering_key='k') for n in range(3)])
+    q.add(qqueue.Task(payload='other', method='PULL', ordering_key='j'))
+
+    first = q.lease_tasks()
+    assert [task.payload for task in first] == ['0', 'other']
+
+    q.delete_tasks(first)
+
+    assert [task.payload for task in q.lease_tasks()] == ['1']
+
+
+def test_consume(broker):
+    q = qqueue.QQueue('memory', mode='pull', initialize_queue=True)
+    done = threading.Event()
+    seen = []
+
+    def callback(task):
+        seen.append(task.payload)
+
+        if len(seen) == 10:
+            done.set()
+
+    q.add([qqueue.Task(payload=str(n), method='PULL') for n in range(10)])
+
+    with q.consume(callback, max_outstanding_messages=2) as consumer:
+        assert done.wait(5)
+
+    assert sorted(seen, key=int) == [str(n) for n in range(10)]
+    assert consumer.processed == 10
+    assert q.fetch_statistics().backlog == 0
+
+
+def test_push_to_deferred_route(broker):
+    RECEIVED.clear()
+
+    app = webapp.FlaskApplication(__name__, [])
+    app.testing = False
+    broker.attach_app(app, background=False)
+
+    qqueue.QQueue('pushed', mode='push', initialize_queue=True)
+
+    deferred.defer(record, 'ok', _queue='pushed')
+    deferred.defer(fail, 'ko', _queue='pushed')
+
+    assert broker.deliver_push() == 1
+    assert RECEIVED == ['ok']
+
+    # Not acknowledged, delivered again after the ack deadline
+    assert qqueue.QQueue('pushed').fetch_statistics().backlog == 1
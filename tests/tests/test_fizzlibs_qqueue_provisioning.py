@@ -0,0 +1,79 @@
+import threading
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+QUEUES = [
+    {'name': 'provisioned-a', 'mode': 'pull'},
+    {'name': 'provisioned-b', 'mode': 'push'},
+]
+
+
+@pytest.fixture
+def created(monkeypatch, tmp_path):
+    calls = []
+    lock = threading.Lock()
+
+    def create_queue(self):
+        with lock:
+            calls.append(self.queue_name)
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'pubsub')
+    monkeypatch.setenv('QQUEUE_PROVISION_MARKER_DIR', str(tmp_path))
+    monkeypatch.delenv('REDIS_SERVICE_HOST', raising=False)
+    monkeypatch.delenv('GKE_SOFTWARE_ID', raising=False)
+    monkeypatch.setattr(qqueue.QQueue, '_QQueue__create_queue', create_queue)
+    monkeypatch.setattr(qqueue.QQueue, '_QQueue__create_enduser', lambda self, **kwargs: None)
+
+    return calls
+
+
+def test_eager_provisioning_uses_marker(created):
+    fingerprint = qqueue.topology_fingerprint(b'queue: []')
+
+    qqueue.provision_queues(QUEUES, fingerprint=fingerprint, mode='eager')
+    assert sorted(created) == ['provisioned-a', 'provisioned-b']
+    assert qqueue.QQUEUE_SETTINGS['provisioned-b'] == {'mode': 'push'}
+
+    # Same topology, skipped
+    qqueue.provision_queues(QUEUES, fingerprint=fingerprint, mode='eager')
+    assert len(created) == 2
+
+    qqueue.provision_queues(QUEUES, fingerprint=fingerprint, mode='always')
+    assert len(created) == 4
+
+
+def test_fingerprint_depends_on_environment(monkeypatch):
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'a')
+    a = qqueue.topology_fingerprint(b'queue: []')
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'b')
+    b = qqueue.topology_fingerprint(b'queue: []')
+
+    assert a != b
+    assert b != qqueue.topology_fingerprint(b'queue: [{name: x}]')
+
+
+def test_lazy_provisioning_on_first_use(created):
+    qqueue.provision_queues(QUEUES, mode='lazy')
+    assert created == []
+
+    qqueue.QQueue('provisioned-a')
+    qqueue.QQueue('provisioned-a')
+
+    assert created == ['provisioned-a']
+
+
+def test_provisioning_error_is_raised(created, monkeypatch):
+    def create_queue(self):
+        raise qqueue.QQUEUE_AUTHENTICATION_ERROR('denied')
+
+    monkeypatch.setattr(qqueue.QQueue, '_QQueue__create_queue', create_queue)
+    fingerprint = qqueue.topology_fingerprint(b'failing')
+
+    with pytest.raises(qqueue.QQUEUE_AUTHENTICATION_ERROR):
+        qqueue.provision_queues(QUEUES, fingerprint=fingerprint)
+
+    assert not qqueue._is_provisioned(fingerprint)
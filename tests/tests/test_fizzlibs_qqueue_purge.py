@@ -0,0 +1,59 @@
+import datetime
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+class FakeSubscriber(object):
+    def __init__(self, **kwargs):
+        self.seeks = []
+
+    def subscription_path(self, project_id, name):
+        return f'projects/{project_id}/subscriptions/{name}'
+
+    def snapshot_path(self, project_id, name):
+        return f'projects/{project_id}/snapshots/{name}'
+
+    def seek(self, request):
+        self.seeks.append(request)
+
+
+@pytest.fixture
+def subscriber(monkeypatch):
+    subscriber = FakeSubscriber()
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'pubsub')
+    monkeypatch.setenv('PUBSUB_EMULATOR_HOST', 'localhost:8080')
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(qqueue.pubsub_v1, 'SubscriberClient', lambda **kwargs: subscriber)
+
+    return subscriber
+
+
+def test_purge_seeks_to_now(subscriber):
+    before = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    result = qqueue.QQueue('backlog', tags=['etl']).purge()
+
+    assert result['elapsed'] >= 0
+    assert [seek['subscription'] for seek in subscriber.seeks] == [
+        'projects/pubsub-emulator/subscriptions/backlog',
+        'projects/pubsub-emulator/subscriptions/backlog-tag-etl'
+    ]
+    assert subscriber.seeks[0]['time'] >= before
+
+
+def test_partial_purge(subscriber):
+    qqueue.QQueue('backlog').purge(before=0)
+
+    assert subscriber.seeks[0]['time'] == datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_purge_to_snapshot(subscriber):
+    qqueue.QQueue('backlog').purge(snapshot='nightly')
+
+    assert subscriber.seeks == [{
+        'subscription': 'projects/pubsub-emulator/subscriptions/backlog',
+        'snapshot': 'projects/pubsub-emulator/snapshots/nightly'
+    }]
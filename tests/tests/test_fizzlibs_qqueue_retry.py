@@ -0,0 +1,118 @@
+import time
+import pytest
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import memqueue
+from fizzlibs.ext import webapp
+from fizzlibs.ext import deferred
+
+
+ATTEMPTS = []
+
+
+def flaky(value):
+    ATTEMPTS.append(deferred.delivery_attempt())
+    raise ValueError(value)
+
+
+def poison(value):
+    ATTEMPTS.append(deferred.delivery_attempt())
+    raise deferred.PermanentTaskFailure(value)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = memqueue.MemoryBroker()
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'memory')
+    monkeypatch.setenv('HTTP_SCHEME', 'http')
+    monkeypatch.setenv('HTTP_HOST', 'localhost')
+    monkeypatch.delenv('GKE_SOFTWARE_ID', raising=False)
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(memqueue, 'broker', broker)
+
+    yield broker
+
+    broker.stop_push()
+
+
+@pytest.fixture
+def app(broker):
+    ATTEMPTS.clear()
+
+    app = webapp.FlaskApplication(__name__, [])
+    app.testing = False
+    broker.attach_app(app, background=False)
+
+    return app
+
+
+def test_nacked_task_backs_off(broker):
+    q = qqueue.QQueue('retried', mode='pull', min_backoff=0.1, max_backoff=0.1, initialize_queue=True)
+    q.add(qqueue.Task(payload='a', method='PULL'))
+
+    q.modify_task_lease(q.lease_tasks(), lease_seconds=0)
+
+    assert q.lease_tasks() == []
+    assert q.fetch_statistics().backlog == 1
+
+    time.sleep(0.15)
+    tasks = q.lease_tasks()
+
+    assert [task.payload for task in tasks] == ['a']
+    assert tasks[0].delivery_attempt == 2
+
+
+def test_pull_queue_requeues_immediately_by_default(broker):
+    q = qqueue.QQueue('requeued', mode='pull', initialize_queue=True)
+    q.add(qqueue.Task(payload='a', method='PULL'))
+
+    q.modify_task_lease(q.lease_tasks(), lease_seconds=0)
+
+    assert [task.payload for task in q.lease_tasks()] == ['a']
+
+
+def test_failed_push_dead_lettered(app, broker):
+    qqueue.QQueue('poisoned', mode='push', min_backoff=0.01, max_backoff=0.01,
+                  max_attempts=5, initialize_queue=True)
+
+    deferred.defer(flaky, 'ko', _queue='poisoned')
+
+    for _ in range(5):
+        assert broker.deliver_push() == 0
+        time.sleep(0.02)
+
+    assert ATTEMPTS == [1, 2, 3, 4, 5]
+    assert qqueue.QQueue('poisoned').fetch_statistics().backlog == 0
+
+    dead = qqueue.QQueue('poisoned-dead-letter').lease_tasks()
+
+    assert len(dead) == 1
+    assert dead[0].handler is flaky
+    assert dead[0].args == ('ko',)
+
+
+def test_permanent_failure_acknowledged(app, broker):
+    qqueue.QQueue('permanent', mode='push', initialize_queue=True)
+
+    deferred.defer(poison, 'ko', _queue='permanent')
+
+    assert broker.deliver_push() == 1
+    assert ATTEMPTS == [1]
+    assert qqueue.QQueue('permanent').fetch_statistics().backlog == 0
+
+
+def test_existing_subscription_updated(broker):
+    qqueue.QQueue('updated', mode='pull', initialize_queue=True)
+    subscription = broker.subscription('projects/pubsub-emulator/subscriptions/updated')
+
+    assert subscription.backoff is None
+    assert subscription.max_attempts is None
+
+    qqueue.QQueue('updated', mode='pull', min_backoff=1, max_attempts=7, initialize_queue=True)
+
+    assert subscription.backoff == (1, qqueue.QQUEUE_MAX_BACKOFF)
+    assert subscription.max_attempts == 7
+    assert subscription.dead_letter_topic == 'projects/pubsub-emulator/topics/updated-dead-letter'
@@ -0,0 +1,169 @@
+import pytest
+import google.api_core.exceptions
+from concurrent import futures
+from types import SimpleNamespace
+
+from fizzlibs.ext import qqueue
+
+
+class FakePublisher(object):
+    def __init__(self, **kwargs):
+        self.publisher_options = kwargs.get('publisher_options')
+        self.published = []
+        self.topics = []
+        self.resumed = []
+
+    def topic_path(self, project_id, name):
+        return f'projects/{project_id}/topics/{name}'
+
+    def get_topic(self, topic):
+        raise google.api_core.exceptions.NotFound(topic)
+
+    def create_topic(self, request):
+        self.topics.append(request['name'])
+        return SimpleNamespace(name=request['name'])
+
+    def publish(self, topic, data, ordering_key='', **attributes):
+        payload = qqueue.Task.decode(data).payload
+        self.published.append((topic, ordering_key, payload))
+
+        future = futures.Future()
+
+        if payload == 'poison':
+            future.set_exception(ValueError('poison'))
+        else:
+            future.set_result(str(len(self.published)))
+
+        return future
+
+    def resume_publish(self, topic, ordering_key):
+        self.resumed.append((topic, ordering_key))
+
+
+class FakeSubscriber(object):
+    def __init__(self):
+        self.subscriptions = {}
+        self.messages = {}
+        self.pulls = []
+
+    def subscription_path(self, project_id, name):
+        return f'projects/{project_id}/subscriptions/{name}'
+
+    def get_subscription(self, subscription):
+        raise google.api_core.exceptions.NotFound(subscription)
+
+    def create_subscription(self, request):
+        self.subscriptions[request['name']] = request
+        self.messages[request['name']] = []
+
+    def pull(self, subscription, max_messages, **kwargs):
+        self.pulls.append((subscription, max_messages))
+        messages = self.messages[subscription][:max_messages]
+        self.messages[subscription] = self.messages[subscription][max_messages:]
+
+        return SimpleNamespace(received_messages=messages)
+
+    def modify_ack_deadline(self, request):
+        pass
+
+    def deliver(self, subscription, payload):
+        message = SimpleNamespace(data=qqueue.Task(payload=payload, method='PULL').encode(), attributes={})
+        self.messages[subscription].append(SimpleNamespace(message=message, ack_id=payload))
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    publishers = []
+    subscriber = FakeSubscriber()
+
+    def publisher_factory(**kwargs):
+        publishers.append(FakePublisher(**kwargs))
+        return publishers[-1]
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'pubsub')
+    monkeypatch.setenv('PUBSUB_EMULATOR_HOST', 'localhost:8080')
+    monkeypatch.delenv('GKE_SOFTWARE_ID', raising=False)
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(qqueue.pubsub_v1, 'PublisherClient', publisher_factory)
+    monkeypatch.setattr(qqueue.pubsub_v1, 'SubscriberClient', lambda **kwargs: subscriber)
+
+    return publishers, subscriber
+
+
+def test_shards_provisioned(clients):
+    publishers, subscriber = clients
+
+    qqueue.QQueue('hot', mode='pull', shards=3, ordering=True, tags=['etl'], initialize_queue=True)
+
+    assert publishers[0].topics == [
+        'projects/pubsub-emulator/topics/hot',
+        'projects/pubsub-emulator/topics/hot-shard-1',
+        'projects/pubsub-emulator/topics/hot-shard-2'
+    ]
+    assert publishers[0].publisher_options.enable_message_ordering
+
+    names = sorted(name.rsplit('/', 1)[1] for name in subscriber.subscriptions)
+
+    assert names == ['hot', 'hot-shard-1', 'hot-shard-1-tag-etl', 'hot-shard-2',
+                     'hot-shard-2-tag-etl', 'hot-tag-etl']
+    assert all(request['enable_message_ordering'] for request in subscriber.subscriptions.values())
+
+
+def test_ordering_key_pins_shard(clients):
+    publishers, _ = clients
+    q = qqueue.QQueue('hot', shards=4, ordering=True)
+
+    q.add([qqueue.Task(payload=str(n), method='PULL', ordering_key='customer-1') for n in range(10)])
+
+    topics = {topic for topic, _, _ in publishers[0].published}
+    keys = {key for _, key, _ in publishers[0].published}
+
+    assert len(topics) == 1
+    assert keys == {'customer-1'}
+    assert [payload for _, _, payload in publishers[0].published] == [str(n) for n in range(10)]
+
+
+def test_tasks_without_key_spread(clients):
+    publishers, _ = clients
+    q = qqueue.QQueue('hot', shards=4)
+
+    q.add([qqueue.Task(payload=str(n), method='PULL') for n in range(8)])
+
+    topics = [topic for topic, _, _ in publishers[0].published]
+
+    assert {topics.count(topic) for topic in set(topics)} == {2}
+    assert len(set(topics)) == 4
+
+
+def test_failed_ordered_publish_resumed(clients):
+    publishers, _ = clients
+    q = qqueue.QQueue('hot', shards=2, ordering=True)
+
+    future = q.add_async(qqueue.Task(payload='poison', method='PULL', ordering_key='k'))
+
+    with pytest.raises(ValueError):
+        future.result()
+
+    assert publishers[0].resumed[0][1] == 'k'
+
+
+def test_lease_fans_in_fairly(clients):
+    _, subscriber = clients
+    q = qqueue.QQueue('hot', mode='pull', shards=2, initialize_queue=True)
+
+    busy = 'projects/pubsub-emulator/subscriptions/hot'
+    quiet = 'projects/pubsub-emulator/subscriptions/hot-shard-1'
+
+    for n in range(10):
+        subscriber.deliver(busy, f'busy-{n}')
+
+    subscriber.deliver(quiet, 'quiet-0')
+
+    tasks = q.lease_tasks(max_tasks=4)
+
+    # The quiet shard is not starved by the busy one
+    assert 'quiet-0' in [task.payload for task in tasks]
+    assert len(tasks) == 4
+    assert {task.subscription for task in tasks} == {busy, quiet}
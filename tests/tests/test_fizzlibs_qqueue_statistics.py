@@ -0,0 +1,61 @@
+import pytest
+
+from fizzlibs.ext import qqueue
+
+
+@pytest.fixture
+def backlog(monkeypatch):
+    calls = []
+
+    def provider(queue, deadline=None):
+        calls.append(queue.queue_name)
+        return {'backlog': 42, 'oldest_task_age': 12.5}
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setattr(qqueue, 'backlog_provider', provider)
+    monkeypatch.setattr(qqueue, '_statistics_cache', {})
+    qqueue.queue_counters.reset()
+
+    return calls
+
+
+def test_statistics_combine_counters_and_backlog(backlog):
+    q = qqueue.QQueue('stats')
+
+    qqueue.queue_counters.increment(q.queue_name, published=10, acked=4, published_bytes=1000)
+    qqueue.queue_counters.observe(q.queue_name, 'publish_latency', 0.004)
+    qqueue.queue_counters.observe(q.queue_name, 'publish_latency', 0.150)
+
+    stats = q.fetch_statistics()
+
+    assert stats.published == 10
+    assert stats.acked == 4
+    assert stats.published_bytes == 1000
+    assert stats.backlog == 42
+    assert stats.oldest_task_age == 12.5
+    assert stats.publish_latency['count'] == 2
+    assert stats.publish_latency['p50_ms'] == 5
+    assert stats.publish_latency['p99_ms'] == 200
+    assert stats.lease_latency is None
+    assert stats.to_dict()['backlog'] == 42
+
+
+def test_backlog_cached(backlog):
+    q = qqueue.QQueue('stats')
+
+    q.fetch_statistics()
+    qqueue.queue_counters.increment(q.queue_name, published=5)
+    stats = q.fetch_statistics()
+
+    assert backlog == [q.queue_name]
+    assert stats.published == 5
+    assert stats.publish_rate > 0
+
+
+def test_backlog_failure_tolerated(backlog, monkeypatch):
+    def provider(queue, deadline=None):
+        raise TimeoutError()
+
+    monkeypatch.setattr(qqueue, 'backlog_provider', provider)
+
+    assert qqueue.QQueue('stats').fetch_statistics().backlog is None
@@ -0,0 +1,134 @@
+import pytest
+import google.api_core.exceptions
+from types import SimpleNamespace
+
+from fizzlibs.ext import qqueue
+
+
+class FakePublisher(object):
+    def __init__(self, **kwargs):
+        pass
+
+    def topic_path(self, project_id, name):
+        return f'projects/{project_id}/topics/{name}'
+
+    def get_topic(self, topic):
+        return SimpleNamespace(name=topic)
+
+
+class FakeSubscriber(object):
+    def __init__(self, **kwargs):
+        self.subscriptions = {}
+        self.messages = {}
+        self.acked = {}
+
+    def subscription_path(self, project_id, name):
+        return f'projects/{project_id}/subscriptions/{name}'
+
+    def get_subscription(self, subscription):
+        if subscription not in self.subscriptions:
+            raise google.api_core.exceptions.NotFound(subscription)
+
+        return self.subscriptions[subscription]
+
+    def create_subscription(self, request):
+        self.subscriptions[request['name']] = request
+        self.messages[request['name']] = []
+
+        return request
+
+    def pull(self, subscription, max_messages, **kwargs):
+        if subscription not in self.subscriptions:
+            raise google.api_core.exceptions.NotFound(subscription)
+
+        messages, self.messages[subscription] = self.messages[subscription], []
+
+        return SimpleNamespace(received_messages=messages)
+
+    def modify_ack_deadline(self, request):
+        pass
+
+    def acknowledge(self, subscription, ack_ids):
+        self.acked.setdefault(subscription, []).extend(ack_ids)
+
+    def deliver(self, subscription, task, ack_id):
+        message = SimpleNamespace(data=task.encode(), attributes={})
+        self.messages[subscription].append(SimpleNamespace(message=message, ack_id=ack_id))
+
+
+@pytest.fixture
+def subscriber(monkeypatch):
+    subscriber = FakeSubscriber()
+
+    monkeypatch.setenv('QQUEUE_PROJECT_ID', 'pubsub-emulator')
+    monkeypatch.setenv('QQUEUE_BACKEND', 'pubsub')
+    monkeypatch.setenv('PUBSUB_EMULATOR_HOST', 'localhost:8080')
+    monkeypatch.setattr(qqueue, 'client_registry', qqueue.QQueueClientRegistry())
+    monkeypatch.setattr(qqueue.pubsub_v1, 'PublisherClient', FakePublisher)
+    monkeypatch.setattr(qqueue.pubsub_v1, 'SubscriberClient', lambda **kwargs: subscriber)
+
+    return subscriber
+
+
+def test_tag_published_as_attribute(subscriber):
+    q = qqueue.QQueue('tagged')
+
+    _, attributes = q._QQueue__encode_task(qqueue.Task(payload='a', method='PULL', tag='etl'))
+
+    assert attributes[qqueue.QQUEUE_TAG_ATTRIBUTE] == 'etl'
+
+
+def test_tag_subscriptions_provisioned(subscriber, monkeypatch):
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+
+    qqueue.QQueue('tagged', mode='pull', tags=['etl', 'report job'], initialize_queue=True)
+
+    main = subscriber.subscriptions['projects/pubsub-emulator/subscriptions/tagged']
+    etl = subscriber.subscriptions['projects/pubsub-emulator/subscriptions/tagged-tag-etl']
+    report = subscriber.subscriptions['projects/pubsub-emulator/subscriptions/tagged-tag-report%20job']
+
+    assert etl['filter'] == 'attributes.qqueue_tag = "etl"'
+    assert report['filter'] == 'attributes.qqueue_tag = "report job"'
+    assert main['filter'] == 'NOT attributes.qqueue_tag = "etl" AND NOT attributes.qqueue_tag = "report job"'
+
+
+def test_lease_tasks_by_tag(subscriber, monkeypatch):
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+
+    q = qqueue.QQueue('tagged', mode='pull', tags=['etl'], initialize_queue=True)
+    source = 'projects/pubsub-emulator/subscriptions/tagged-tag-etl'
+
+    subscriber.deliver(source, qqueue.Task(payload='a', method='PULL', tag='etl'), 'ack-a')
+
+    tasks = q.lease_tasks_by_tag('etl')
+
+    assert [task.payload for task in tasks] == ['a']
+
+    q.delete_tasks(tasks)
+
+    # Acknowledged on the subscription the task was leased from
+    assert subscriber.acked == {source: ['ack-a']}
+
+    with pytest.raises(qqueue.QQUEUE_TAG_NOT_PROVISIONED_ERROR):
+        q.lease_tasks_by_tag('unknown')
+
+
+def test_tags_added_to_existing_queue_refused(subscriber, monkeypatch):
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+
+    # Created before the queue declared tags
+    main = 'projects/pubsub-emulator/subscriptions/tagged'
+    subscriber.subscriptions[main] = SimpleNamespace(name=main, filter='')
+
+    with pytest.raises(qqueue.QQUEUE_SUBSCRIPTION_FILTER_ERROR):
+        qqueue.QQueue('tagged', mode='pull', tags=['etl'], initialize_queue=True)
+
+
+@pytest.mark.parametrize('tag', ['say "hi"', 'back\\slash', 'line\nbreak'])
+def test_invalid_tags_refused(subscriber, monkeypatch, tag):
+    monkeypatch.setattr(qqueue, 'QQUEUE_SETTINGS', {})
+
+    with pytest.raises(qqueue.QQUEUE_INVALID_TAG_ERROR):
+        qqueue.QQueue('tagged', mode='pull', tags=[tag], initialize_queue=True)
+
+    assert subscriber.subscriptions == {}
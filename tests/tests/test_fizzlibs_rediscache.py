@@ -0,0 +1,426 @@
+import os
+import time
+import uuid
+import threading
+import datetime
+import pytest
+import redis
+
+from fizzlibs.ext import rediscache
+
+
+@pytest.fixture
+def redis_env(monkeypatch):
+    monkeypatch.setenv('REDIS_SERVICE_HOST', os.environ.get('REDIS_SERVICE_HOST', 'localhost'))
+    monkeypatch.setenv('REDIS_SERVICE_PORT', os.environ.get('REDIS_SERVICE_PORT', '6379'))
+    monkeypatch.delenv('GKE_SOFTWARE_ID', raising=False)
+    monkeypatch.setattr(rediscache, '_pool', None)
+    monkeypatch.setattr(rediscache, '_pool_key', None)
+
+
+def test_pool_shared(redis_env):
+    a = rediscache.__get_radis__()
+    b = rediscache.__get_radis__()
+
+    assert a.connection_pool is b.connection_pool
+    assert a.connection_pool.max_connections == rediscache.REDIS_MAX_CONNECTIONS
+    assert rediscache.pool_statistics()['created'] == 0
+
+
+def test_pool_rebuilt_after_fork(redis_env):
+    pool = rediscache.__get_pool__()
+
+    # Simulate being a forked child
+    address, _ = rediscache._pool_key
+    rediscache._pool_key = (address, -1)
+
+    assert rediscache.__get_pool__() is not pool
+
+
+def test_pool_requires_address(redis_env, monkeypatch):
+    monkeypatch.delenv('REDIS_SERVICE_HOST')
+
+    with pytest.raises(rediscache.RADIS_AUTHENTICATION_ERROR):
+        rediscache.__get_radis__()
+
+
+@pytest.mark.skipif(not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+def test_pool_saturated_waits(redis_env, monkeypatch):
+    monkeypatch.setattr(rediscache, 'REDIS_MAX_CONNECTIONS', 1)
+    monkeypatch.setattr(rediscache, 'REDIS_POOL_TIMEOUT', 0.2)
+
+    pool = rediscache.__get_pool__()
+    held = pool.get_connection('PING')
+
+    # Exhausted until the timeout
+    with pytest.raises(redis.ConnectionError):
+        rediscache.__get_radis__().ping()
+
+    assert rediscache.pool_statistics()['in_use'] == 1
+
+    # Served once a connection is released
+    threading.Timer(0.05, pool.release, args=(held,)).start()
+    assert rediscache.__get_radis__().ping()
+    assert rediscache.pool_statistics() == {
+        'max_connections': 1, 'created': 1, 'in_use': 0, 'available': 1
+    }
+
+
+def test_sanitize_key(monkeypatch):
+    monkeypatch.setenv('GKE_SOFTWARE_ID', 'soft')
+
+    assert rediscache.__sanitize_key__('a') == 'soft-a'
+    assert rediscache.__sanitize_key__('b') == 'soft-b'
+
+
+@pytest.mark.skipif(not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+def test_set_with_ttl(redis_env):
+    key = f'test-{uuid.uuid4().hex}'
+
+    rediscache.set(key, {'x': 1}, time=1)
+
+    assert rediscache.get(key) == {'x': 1}
+    assert 0 < rediscache.__get_radis__().ttl(key) <= 1
+    assert rediscache.pool_statistics()['in_use'] == 0
+
+    rediscache.delete(key)
+    assert rediscache.get(key) is None
+
+
+def listening_cache(**kwargs):
+    cache = rediscache.NearCache(**kwargs)
+    # As once subscribed to invalidations
+    cache._listening = True
+
+    return cache
+
+
+def test_near_cache_lru_bounds():
+    cache = listening_cache(max_entries=2, max_bytes=10)
+
+    cache.put('a', 'A', 4, None, cache.epoch)
+    cache.put('b', 'B', 4, None, cache.epoch)
+    assert cache.get('a') == (True, 'A')
+
+    # Least recently used first
+    cache.put('c', 'C', 4, None, cache.epoch)
+    assert cache.get('b') == (False, None)
+
+    # Over the size bound
+    cache.put('d', 'D', 8, None, cache.epoch)
+    assert len(cache) == 1
+    assert cache.get('d') == (True, 'D')
+
+    assert cache.stats['evictions'] == 3
+
+
+def test_near_cache_ttl():
+    cache = listening_cache(ttl=10)
+
+    cache.put('a', 'A', 1, 0.05, cache.epoch)
+    assert cache.get('a') == (True, 'A')
+
+    time.sleep(0.06)
+    assert cache.get('a') == (False, None)
+
+
+def test_near_cache_invalidation_during_read():
+    cache = listening_cache()
+    epoch = cache.epoch
+
+    cache.invalidate(['a'])
+    cache.put('a', 'stale', 1, None, epoch)
+
+    assert cache.get('a') == (False, None)
+
+
+def test_near_cache_not_served_unsubscribed():
+    cache = rediscache.NearCache()
+
+    cache.put('a', 'A', 1, None, cache.epoch)
+
+    assert cache.get('a') == (False, None)
+
+
+@pytest.mark.skipif(not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+def test_near_cache_read_through(redis_env, monkeypatch):
+    monkeypatch.setattr(rediscache, 'REDIS_NEAR_CACHE', True)
+    monkeypatch.setattr(rediscache, '_near_cache', None)
+
+    key = f'test-{uuid.uuid4().hex}'
+    rediscache.set(key, {'x': 1})
+
+    near_cache = rediscache.__get_near_cache__()
+    deadline = time.monotonic() + 5
+
+    while not near_cache._listening and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    try:
+        assert rediscache.get(key) == {'x': 1}
+        assert rediscache.get(key) == {'x': 1}
+        assert near_cache.stats['local_hits'] == 1
+
+        # Written by another process
+        rediscache.__get_radis__().set(key, '{"x": 2}')
+        rediscache.__get_radis__().publish(near_cache.channel, f'["{key}"]')
+
+        while near_cache.get(key)[0] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert rediscache.get(key) == {'x': 2}
+
+        rediscache.delete(key)
+        assert rediscache.get(key) is None
+    finally:
+        near_cache.stop()
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        self.client.round_trips += 1
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeRedis(object):
+    """Dict backed client counting round trips"""
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.data.get(key) for key in keys]
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def publish(self, channel, message):
+        return 0
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedis()
+
+    monkeypatch.setattr(rediscache, '__get_radis__', lambda: client)
+    monkeypatch.setattr(rediscache, 'REDIS_MULTI_CHUNK', 100)
+    monkeypatch.setenv('GKE_SOFTWARE_ID', 'soft')
+
+    return client
+
+
+def test_multi_round_trips(fake_redis):
+    rediscache.set_multi({f'k{n}': {'n': n} for n in range(250)}, time=60)
+
+    assert fake_redis.round_trips == 3
+    assert fake_redis.data['soft-k1'] == b'\xfc\x01\x00{"n":1}'
+
+    values = rediscache.get_multi([f'k{n}' for n in range(250)] + ['missing'])
+
+    assert fake_redis.round_trips == 6
+    assert len(values) == 250
+    assert values['k7'] == {'n': 7}
+
+    assert rediscache.delete_multi(['k1', 'k2', 'missing']) == 2
+    assert rediscache.get_multi(['k1', 'k3']) == {'k3': {'n': 3}}
+    assert rediscache.get('k3') == {'n': 3}
+
+
+@pytest.mark.parametrize('value', [0, '', [], {}, False, None, 'text', {'a': [1, 2.5, None]}])
+def test_falsy_values_round_trip(fake_redis, value):
+    rediscache.set('k', value)
+
+    assert rediscache.get('k') == value
+
+
+@pytest.mark.parametrize('serializer', ['msgpack', 'pickle'])
+def test_binary_serializers(fake_redis, serializer):
+    value = {
+        'bytes': b'\x00\xff',
+        'at': datetime.datetime(2020, 5, 17, 10, 30, tzinfo=datetime.timezone.utc),
+        'day': datetime.date(2020, 5, 17)
+    }
+
+    rediscache.set('k', value, serializer=serializer)
+
+    assert rediscache.get('k') == value
+
+
+def test_json_rejects_bytes(fake_redis):
+    with pytest.raises(rediscache.RADIS_SERIALIZER_ERROR):
+        rediscache.set('k', b'bytes')
+
+
+def test_large_values_compressed(fake_redis):
+    value = {'rows': [{'id': n, 'name': f'row {n}'} for n in range(1000)]}
+
+    rediscache.set('k', value)
+
+    raw = fake_redis.data['soft-k']
+    assert raw[:3] == b'\xfc\x01\x01'
+    assert len(raw) < len(rediscache.get_cache_serializer('json').dumps(value)) / 4
+    assert rediscache.get('k') == value
+
+
+def test_legacy_values_read(fake_redis):
+    fake_redis.data['soft-k'] = b'{"x": "hello"}'
+    fake_redis.data['soft-n'] = b'1'
+
+    assert rediscache.get_multi(['k', 'n']) == {'k': {'x': 'hello'}, 'n': 1}
+
+
+def test_memoize_keys_stable():
+    @rediscache.memoize(ttl=60)
+    def report(account, options=None):
+        return account
+
+    assert report.key(1, options={'a': 1, 'b': 2}) == report.key(1, options={'b': 2, 'a': 1})
+    assert report.key(1) != report.key(2)
+    assert report.key(1).startswith(f'memoize:{__name__}.test_memoize_keys_stable.<locals>.report:')
+
+    @rediscache.memoize(key=lambda account: f'report:{account}')
+    def custom(account):
+        return account
+
+    assert custom.key(7) == 'report:7'
+    assert custom.__name__ == 'custom'
+
+
+def test_memoize_without_redis(monkeypatch):
+    monkeypatch.delenv('REDIS_SERVICE_HOST', raising=False)
+    calls = []
+
+    @rediscache.memoize(ttl=60)
+    def compute(x):
+        calls.append(x)
+        return x * 2
+
+    assert compute(2) == 4
+    assert compute(2) == 4
+    assert calls == [2, 2]
+
+
+@pytest.mark.skipif(not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+def test_memoize_stampede(redis_env):
+    calls = []
+    prefix = f'test-{uuid.uuid4().hex}'
+
+    @rediscache.memoize(ttl=60, key=prefix)
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.3)
+        return {'x': x}
+
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(slow(1))) for _ in range(8)]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    assert calls == [1]
+    assert results == [{'x': 1}] * 8
+
+    slow.invalidate(1)
+    assert slow(1) == {'x': 1}
+    assert calls == [1, 1]
+
+    slow.invalidate(1)
+
+
+@pytest.mark.skipif(not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+def test_memoize_serves_stale_while_refreshing(redis_env):
+    calls = []
+    prefix = f'test-{uuid.uuid4().hex}'
+
+    @rediscache.memoize(ttl=1, stale_ttl=30, beta=0, key=prefix)
+    def version():
+        calls.append(1)
+        return len(calls)
+
+    assert version() == 1
+    time.sleep(1.1)
+
+    # Another worker is recomputing
+    token = rediscache.__acquire_lock__(version.key(), 10)
+    assert token
+    assert version() == 1
+    assert rediscache.cache_statistics()['memoize_stale'] >= 1
+
+    rediscache.__release_lock__(version.key(), token)
+    assert version() == 2
+
+    version.invalidate()
+
+
+@pytest.mark.skipif(not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+def test_memoize_early_refresh(redis_env, monkeypatch):
+    calls = []
+    prefix = f'test-{uuid.uuid4().hex}'
+
+    @rediscache.memoize(ttl=60, key=prefix)
+    def value():
+        calls.append(1)
+        return len(calls)
+
+    assert value() == 1
+
+    # Draws close to 1 refresh well before the expiry
+    monkeypatch.setattr(rediscache.random, 'random', lambda: 0.9999999)
+    rediscache.set(value.key(), [1, 10.0, time.time() + 60])
+
+    assert value() == 2
+    assert len(calls) == 2
+
+    value.invalidate()
+
+
+def test_memoize_unserializable_result(fake_redis, monkeypatch):
+    monkeypatch.setattr(rediscache, '__acquire_lock__', lambda key, timeout: 'token')
+    monkeypatch.setattr(rediscache, '__release_lock__', lambda key, token: None)
+    calls = []
+
+    @rediscache.memoize(ttl=60)
+    def day():
+        calls.append(1)
+        return datetime.date(2020, 5, 17)
+
+    # Not cached by the json serializer, but still returned
+    assert day() == datetime.date(2020, 5, 17)
+    assert day() == datetime.date(2020, 5, 17)
+    assert len(calls) == 2
+
+
+def test_memoize_lock_unavailable(fake_redis, monkeypatch):
+    def unavailable(key, timeout):
+        raise redis.ConnectionError('unavailable')
+
+    monkeypatch.setattr(rediscache, '__acquire_lock__', unavailable)
+
+    @rediscache.memoize(ttl=60)
+    def double(x):
+        return x * 2
+
+    assert double(2) == 4
@@ -0,0 +1,95 @@
+import os
+import uuid
+import pytest
+from concurrent import futures
+
+from fizzlibs.ext import qqueue
+from fizzlibs.ext import deferred
+from fizzlibs.ext import scheduler
+from fizzlibs.ext import rediscache
+
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('REDIS_SERVICE_HOST'), reason='requires redis')
+
+
+class FakeQueue(object):
+    published = []
+
+    def __init__(self, name):
+        self.name = name
+
+    def add_async(self, task):
+        future = futures.Future()
+        FakeQueue.published.append((self.name, task.payload))
+        future.set_result('1')
+
+        return future
+
+
+@pytest.fixture
+def delayed(monkeypatch):
+    monkeypatch.setattr(qqueue, 'QQueue', FakeQueue)
+    FakeQueue.published = []
+
+    return scheduler.DelayScheduler(prefix=f'test-{uuid.uuid4().hex}')
+
+
+def test_due_tasks_published(delayed):
+    delayed.schedule('default', qqueue.Task(payload='now', method='PULL'), 0)
+    delayed.schedule('default', qqueue.Task(payload='later', method='PULL'), 3600)
+
+    assert delayed.pending() == 2
+    assert delayed.run_once() == 1
+    assert FakeQueue.published == [('default', 'now')]
+    assert delayed.pending() == 1
+    assert 0 < delayed.next_wakeup() <= delayed.max_idle
+
+
+def test_cancel(delayed):
+    task_id = delayed.schedule('default', qqueue.Task(payload='later', method='PULL'), 3600)
+
+    assert delayed.cancel(task_id)
+    assert delayed.pending() == 0
+    assert delayed.run_once() == 0
+
+
+def test_run_once_counts_published_tasks(delayed):
+    for n in range(3):
+        delayed.schedule('default', qqueue.Task(payload=n, method='PULL'), 0)
+
+    orphan = delayed.schedule('default', qqueue.Task(payload='orphan', method='PULL'), 0)
+    rediscache.__get_radis__().hdel(delayed.tasks_key, orphan)
+
+    # Orphans are cleared but not counted
+    assert delayed.run_once() == 3
+    assert sorted(payload for _, payload in FakeQueue.published) == [0, 1, 2]
+    assert delayed.pending() == 0
+
+
+def test_undecodable_task_dropped(delayed):
+    delayed.schedule('default', qqueue.Task(payload='good', method='PULL'), 0)
+    bad = delayed.schedule('default', qqueue.Task(payload='bad', method='PULL'), 0)
+    rediscache.__get_radis__().hset(delayed.tasks_key, bad, b'default\0not a task')
+
+    assert delayed.run_once() == 1
+    assert FakeQueue.published == [('default', 'good')]
+
+    # Neither left in flight nor recovered
+    r = rediscache.__get_radis__()
+    assert r.zcard(delayed.inflight_key) == 0
+    assert not r.hexists(delayed.tasks_key, bad)
+
+
+def noop(value):
+    pass
+
+
+def test_defer_countdown_only_schedules(delayed, monkeypatch):
+    monkeypatch.setattr(deferred, 'delay_scheduler', delayed)
+
+    deferred.defer(noop, 1, _countdown=60)
+
+    assert delayed.pending() == 1
+    # Started at boot or by the dedicated worker only
+    assert delayed._thread is None